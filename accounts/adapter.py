@@ -0,0 +1,19 @@
+from allauth.account.adapter import DefaultAccountAdapter
+from django.contrib.sites.shortcuts import get_current_site
+
+from core.tasks import defer_email
+
+
+class AccountAdapter(DefaultAccountAdapter):
+    """
+    Render allauth emails in the request but send them from the task queue
+    """
+
+    def send_mail(self, template_prefix, email, context):
+        ctx = {
+            'request': self.request,
+            'email': email,
+            'current_site': get_current_site(self.request),
+        }
+        ctx.update(context)
+        defer_email(self.render_mail(template_prefix, email, ctx))
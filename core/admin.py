@@ -1,3 +1,17 @@
 from django.contrib import admin
+from django.utils import timezone
 
-# Register your models here.
+from .models import Task
+
+
+@admin.register(Task)
+class TaskAdmin(admin.ModelAdmin):
+    list_display = ('name', 'status', 'priority', 'attempts', 'run_at', 'locked_by', 'created_at')
+    list_filter = ('status', 'name')
+    search_fields = ('name', 'last_error')
+    readonly_fields = ('locked_by', 'locked_at', 'created_at')
+    actions = ['requeue']
+
+    @admin.action(description='Requeue selected tasks')
+    def requeue(self, request, queryset):
+        queryset.update(status=Task.QUEUED, attempts=0, run_at=timezone.now(), locked_by='', locked_at=None)
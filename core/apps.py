@@ -4,3 +4,39 @@ from django.apps import AppConfig
 class CoreConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'core'
+
+    def ready(self):
+        from django.conf import settings
+        from django.utils.module_loading import autodiscover_modules
+
+        # Register every app's @task functions before a worker looks them up
+        autodiscover_modules('tasks')
+
+        if settings.METRICS_ENABLED:
+            _instrument_template_rendering()
+
+
+def _instrument_template_rendering():
+    """
+    Time every top-level Django template render for the metrics registry
+    """
+    import time
+
+    from django.template.backends.django import Template
+
+    from . import metrics
+
+    original = Template.render
+
+    def render(self, context=None, request=None):
+        start = time.perf_counter()
+        try:
+            return original(self, context, request)
+        finally:
+            metrics.observe(
+                'noteghar_template_render_seconds',
+                time.perf_counter() - start,
+                template=self.template.name or 'string',
+            )
+
+    Template.render = render
@@ -0,0 +1,72 @@
+"""
+Conditional GET support for views whose output depends on a few cheap
+validators.
+
+``conditional_page(validators)`` wraps a sync or async view. ``validators``
+is a sync function taking the view's arguments and returning
+``(etag, last_modified)``, or None to skip conditional handling (for
+example when the page is about to 404 or is personalised in ways the
+validators do not capture). A matching If-None-Match or If-Modified-Since
+gets a 304 without running the view.
+
+Anonymous responses are marked cacheable by shared caches for
+CONDITIONAL_SHARED_MAX_AGE seconds and vary on Cookie. Signed-in users get
+private responses that browsers must revalidate.
+"""
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date, quote_etag
+
+
+def is_anonymous(request):
+    """
+    True when the request carries no session, decided from the cookie alone
+    """
+    return settings.SESSION_COOKIE_NAME not in request.COOKIES
+
+
+def conditional_page(validators):
+    def decorator(view):
+        def before(request, *args, **kwargs):
+            result = validators(request, *args, **kwargs) if request.method in ('GET', 'HEAD') else None
+            if result is None:
+                return None, None, None
+            etag, last_modified = result
+            etag = quote_etag(etag) if etag else None
+            last_modified = int(last_modified.timestamp()) if last_modified else None
+            return get_conditional_response(request, etag=etag, last_modified=last_modified), etag, last_modified
+
+        def after(request, response, etag, last_modified):
+            if response.status_code not in (200, 304):
+                return response
+            if etag:
+                response.headers.setdefault('ETag', etag)
+            if last_modified:
+                response.headers.setdefault('Last-Modified', http_date(last_modified))
+            if is_anonymous(request):
+                patch_cache_control(response, public=True, max_age=0, s_maxage=settings.CONDITIONAL_SHARED_MAX_AGE)
+            else:
+                patch_cache_control(response, private=True, no_cache=True)
+            patch_vary_headers(response, ('Cookie',))
+            return response
+
+        if iscoroutinefunction(view):
+            @wraps(view)
+            async def async_wrapper(request, *args, **kwargs):
+                response, etag, last_modified = await sync_to_async(before)(request, *args, **kwargs)
+                if response is None:
+                    response = await view(request, *args, **kwargs)
+                return after(request, response, etag, last_modified)
+            return async_wrapper
+
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            response, etag, last_modified = before(request, *args, **kwargs)
+            if response is None:
+                response = view(request, *args, **kwargs)
+            return after(request, response, etag, last_modified)
+        return wrapper
+    return decorator
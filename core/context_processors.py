@@ -0,0 +1,21 @@
+from django.conf import settings
+
+
+def fragment_cache(request):
+    """
+    Keys shared by the {% cache %} fragments in base and list templates
+    """
+    user = request.user
+    if not user.is_authenticated:
+        role = 'anonymous'
+    elif user.is_admin_user():
+        role = 'admin'
+    elif user.is_moderator():
+        role = 'moderator'
+    else:
+        role = 'student'
+    return {
+        'fragment_version': settings.FRAGMENT_CACHE_VERSION,
+        'fragment_timeout': settings.FRAGMENT_CACHE_TIMEOUT,
+        'nav_role': role,
+    }
@@ -0,0 +1,78 @@
+"""
+Read/write routing for the production SQLite profile.
+
+All writes go through the ``default`` alias (the single writer). Reads made
+while handling a safe (GET/HEAD) request go to the ``reader`` alias, a
+separate ``query_only`` connection on the same WAL database, so page views
+never wait behind a writer holding the lock.
+
+Async views wrap their writes in ``serialized_write``, which queues them
+on a process-wide lock. Under ASGI every request runs its ORM calls on its
+own thread and connection, and hundreds of those racing for the SQLite
+write lock run past ``busy_timeout``.
+"""
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.db import DEFAULT_DB_ALIAS, connections
+
+READ_ALIAS = 'reader'
+
+_read_only = ContextVar('noteghar_read_only', default=False)
+
+_write_lock = threading.Lock()
+
+
+def is_read_only():
+    return _read_only.get()
+
+
+@contextmanager
+def read_only(enabled=True):
+    """
+    Route reads inside the block to the reader connection
+    """
+    token = _read_only.set(enabled)
+    try:
+        yield
+    finally:
+        _read_only.reset(token)
+
+
+def serialized_write(func):
+    """
+    Wrap a sync ORM function as awaitable, one writer at a time
+    """
+    @wraps(func)
+    def locked(*args, **kwargs):
+        with _write_lock:
+            return func(*args, **kwargs)
+    return sync_to_async(locked)
+
+
+class ReadWriteRouter:
+    """
+    Send reads to the reader alias during read-only requests, everything else
+    to the writer
+    """
+
+    def db_for_read(self, model, **hints):
+        if not _read_only.get() or READ_ALIAS not in connections:
+            return DEFAULT_DB_ALIAS
+        # Inside a transaction the writer may hold rows the reader cannot see
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        return READ_ALIAS
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Both aliases point at the same database file
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == DEFAULT_DB_ALIAS
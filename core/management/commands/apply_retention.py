@@ -0,0 +1,40 @@
+"""
+Roll up, archive and delete event rows older than each retention policy
+keeps (see core.retention). Safe to run from cron; an interrupted run is
+picked up by the next.
+"""
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core import retention
+
+
+class Command(BaseCommand):
+    help = 'Archive and delete event rows past their retention period'
+
+    def add_arguments(self, parser):
+        parser.add_argument('policies', nargs='*', help='Policy names (default: all)')
+        parser.add_argument('--batch-size', type=int, help='Rows deleted per transaction')
+        parser.add_argument('--dry-run', action='store_true', help='Report what would be archived')
+
+    def handle(self, *args, **options):
+        available = retention.policies()
+        names = options['policies'] or sorted(available)
+        unknown = set(names) - available.keys()
+        if unknown:
+            raise CommandError(f'Unknown policies: {", ".join(sorted(unknown))}; '
+                               f'available: {", ".join(sorted(available))}')
+        for name in names:
+            policy = available[name]
+            started = time.perf_counter()
+            try:
+                stats = retention.apply(policy, options['batch_size'], options['dry_run'], self.stdout.write)
+            except RuntimeError as error:
+                raise CommandError(str(error)) from None
+            elapsed = time.perf_counter() - started
+            verb = 'would archive' if options['dry_run'] else 'archived'
+            self.stdout.write(self.style.SUCCESS(
+                f'{name}: {verb} {stats["archived"]:,}, deleted {stats["deleted"]:,} '
+                f'(before {policy.cutoff()}) in {elapsed:.1f}s'
+            ))
@@ -0,0 +1,186 @@
+"""
+Compare WSGI and ASGI throughput under many concurrent slow clients.
+
+Each mode runs in its own subprocess, because the URLconf picks the sync or
+async note views at import time. WSGI requests go through a fixed pool of
+worker threads, as under a threaded WSGI server; ASGI requests all run on
+one event loop. A slow client is simulated by pausing after every body
+chunk for as long as its bandwidth needs to take the chunk in, which holds
+a WSGI worker for the whole transfer but only parks a coroutine under ASGI.
+"""
+import asyncio
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings
+
+from notes.models import Note
+
+from .bench_http import login_cookie, percentile, write_placeholder_files
+
+User = get_user_model()
+
+PATHS = {
+    'download': '/notes/{pk}/download/',
+    'detail': '/notes/{pk}/',
+    'catalog': '/notes/',
+}
+
+
+class Command(BaseCommand):
+    help = 'Benchmark WSGI against ASGI serving with many concurrent slow clients'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--endpoint', choices=list(PATHS), default='download')
+        parser.add_argument('--clients', type=int, default=1000, help='Concurrent clients')
+        parser.add_argument('--workers', type=int, default=16, help='WSGI worker threads')
+        parser.add_argument('--client-bandwidth', type=int, default=2 * 1024 * 1024,
+                            help='Bytes per second each slow client can receive')
+        parser.add_argument('--file-size', type=int, default=256 * 1024)
+        parser.add_argument('--mode', choices=['wsgi', 'asgi'], help='Run a single mode (used internally)')
+
+    def handle(self, *args, **options):
+        if options['mode']:
+            return self.run_mode(options)
+
+        results = {}
+        for mode in ('wsgi', 'asgi'):
+            env = dict(os.environ, NOTEGHAR_ASYNC_VIEWS='1' if mode == 'asgi' else '0', NOTEGHAR_RATELIMIT='0')
+            cmd = [sys.executable, sys.argv[0], 'bench_asgi', '--mode', mode,
+                   '--endpoint', options['endpoint'], '--clients', str(options['clients']),
+                   '--workers', str(options['workers']), '--client-bandwidth', str(options['client_bandwidth']),
+                   '--file-size', str(options['file_size'])]
+            output = subprocess.run(cmd, env=env, capture_output=True, text=True)
+            if output.returncode:
+                raise CommandError(f'{mode} run failed:\n{output.stderr}')
+            results[mode] = json.loads(output.stdout.strip().splitlines()[-1])
+
+        self.stdout.write(
+            f"{options['clients']} concurrent slow clients on {options['endpoint']} "
+            f"(WSGI pool of {options['workers']} threads)"
+        )
+        self.stdout.write(f"{'mode':<6} {'req/s':>9} {'p50 ms':>9} {'p99 ms':>9} {'wall s':>8}  status")
+        for mode, r in results.items():
+            self.stdout.write(
+                f"{mode:<6} {r['throughput']:>9.1f} {r['p50_ms']:>9.1f} {r['p99_ms']:>9.1f} "
+                f"{r['wall']:>8.2f}  {r['status_codes']}"
+            )
+        if results['wsgi']['throughput']:
+            ratio = results['asgi']['throughput'] / results['wsgi']['throughput']
+            self.stdout.write(f'ASGI/WSGI throughput: {ratio:.1f}x')
+
+    def run_mode(self, options):
+        user = User.objects.filter(is_active=True).first()
+        note_ids = list(Note.objects.filter(status='approved').values_list('pk', flat=True)[:200])
+        if not user or not note_ids:
+            raise CommandError('Need at least one user and one approved note; run seed_scale first.')
+        cookie = login_cookie(user)
+        paths = [PATHS[options['endpoint']].format(pk=note_ids[i % len(note_ids)])
+                 for i in range(options['clients'])]
+
+        with tempfile.TemporaryDirectory() as media_root, override_settings(MEDIA_ROOT=media_root):
+            write_placeholder_files(note_ids, media_root, options['file_size'])
+            run = self.run_wsgi if options['mode'] == 'wsgi' else self.run_asgi
+            started = time.perf_counter()
+            latencies, statuses = run(paths, cookie, options)
+            wall = time.perf_counter() - started
+
+        latencies.sort()
+        self.stdout.write(json.dumps({
+            'throughput': round(len(latencies) / wall, 1),
+            'p50_ms': round(percentile(latencies, 50), 1),
+            'p99_ms': round(percentile(latencies, 99), 1),
+            'wall': round(wall, 2),
+            'status_codes': statuses,
+        }))
+
+    def run_wsgi(self, paths, cookie, options):
+        from django.core.wsgi import get_wsgi_application
+
+        app = get_wsgi_application()
+        bandwidth = options['client_bandwidth']
+        latencies, statuses = [], {}
+        lock = threading.Lock()
+        submitted = time.perf_counter()
+
+        def client(path):
+            status = []
+            environ = {
+                'REQUEST_METHOD': 'GET', 'PATH_INFO': path, 'QUERY_STRING': '',
+                'SERVER_NAME': 'localhost', 'SERVER_PORT': '80', 'HTTP_HOST': 'localhost',
+                'REMOTE_ADDR': '127.0.0.1', 'HTTP_COOKIE': cookie, 'SERVER_PROTOCOL': 'HTTP/1.1',
+                'wsgi.input': io.BytesIO(b''), 'wsgi.errors': sys.stderr, 'wsgi.url_scheme': 'http',
+                'wsgi.version': (1, 0), 'wsgi.multithread': True, 'wsgi.multiprocess': False,
+                'wsgi.run_once': False,
+            }
+            body = app(environ, lambda s, h, exc_info=None: status.append(s))
+            try:
+                for chunk in body:
+                    if chunk:
+                        time.sleep(len(chunk) / bandwidth)  # the worker is stuck writing to a slow socket
+            finally:
+                if hasattr(body, 'close'):
+                    body.close()
+            code = status[0].split()[0]
+            with lock:
+                latencies.append((time.perf_counter() - submitted) * 1000)
+                statuses[code] = statuses.get(code, 0) + 1
+
+        with ThreadPoolExecutor(max_workers=options['workers']) as pool:
+            list(pool.map(client, paths))
+        return latencies, statuses
+
+    def run_asgi(self, paths, cookie, options):
+        from django.core.asgi import get_asgi_application
+
+        app = get_asgi_application()
+        bandwidth = options['client_bandwidth']
+        latencies, statuses = [], {}
+
+        async def client(path, submitted):
+            sent_request = asyncio.Event()
+            done = asyncio.Event()
+            scope = {
+                'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1',
+                'method': 'GET', 'scheme': 'http', 'path': path, 'raw_path': path.encode(),
+                'query_string': b'', 'root_path': '',
+                'headers': [(b'host', b'localhost'), (b'cookie', cookie.encode())],
+                'client': ('127.0.0.1', 0), 'server': ('localhost', 80),
+            }
+
+            async def receive():
+                if not sent_request.is_set():
+                    sent_request.set()
+                    return {'type': 'http.request', 'body': b'', 'more_body': False}
+                await done.wait()
+                return {'type': 'http.disconnect'}
+
+            async def send(message):
+                if message['type'] == 'http.response.start':
+                    code = str(message['status'])
+                    statuses[code] = statuses.get(code, 0) + 1
+                elif message['type'] == 'http.response.body':
+                    if message.get('body'):
+                        await asyncio.sleep(len(message['body']) / bandwidth)  # slow client, but only this coroutine waits
+                    if not message.get('more_body'):
+                        done.set()
+
+            await app(scope, receive, send)
+            latencies.append((time.perf_counter() - submitted) * 1000)
+
+        async def main():
+            submitted = time.perf_counter()
+            await asyncio.gather(*(client(path, submitted) for path in paths))
+
+        asyncio.run(main())
+        return latencies, statuses
@@ -0,0 +1,317 @@
+"""
+End-to-end HTTP benchmark for the main NoteGhar endpoints.
+
+Boots the project in a threaded WSGI server (or targets an already running
+one with ``--url``), logs in a student and a moderator through real session
+cookies, and drives concurrent traffic at each endpoint in turn. For every
+endpoint it reports p50/p95/p99 latency, throughput, status codes, queries
+per request (from the X-Query-Count header added by QueryCountMiddleware)
+and the server's peak RSS.
+
+Results are saved as JSON; pass a previous result with ``--compare`` to
+print deltas and fail when latency regresses beyond ``--max-regression``.
+
+Run it against a scratch database filled by ``seed_scale``: the upload,
+download and rating endpoints write to it.
+"""
+import http.client
+import json
+import logging
+import os
+import random
+import resource
+import subprocess
+import tempfile
+import threading
+import time
+import uuid
+from importlib import import_module
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY, get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.core.servers.basehttp import ThreadedWSGIServer, WSGIRequestHandler
+from django.core.wsgi import get_wsgi_application
+from django.test.utils import override_settings
+
+from notes.models import Note
+
+User = get_user_model()
+
+CSRF_TOKEN = 'benchmarkcsrftoken0123456789abcd'  # 32 chars, valid unmasked secret
+
+# name -> (method, path template, role)
+ENDPOINTS = {
+    'catalog': ('GET', '/notes/', None),
+    'search': ('GET', '/notes/?query={word}', None),
+    'detail': ('GET', '/notes/{pk}/', 'student'),
+    'download': ('GET', '/notes/{pk}/download/', 'student'),
+    'upload': ('POST', '/notes/upload/', 'student'),
+    'rating': ('POST', '/notes/{pk}/rate/', 'student'),
+    'moderation': ('GET', '/moderation/', 'moderator'),
+}
+
+SEARCH_WORDS = ('database', 'algorithms', 'midterm', 'physics', 'lab', 'notes')
+
+
+class QuietHandler(WSGIRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(q / 100 * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+def peak_rss_kb(pid=None):
+    """
+    Peak resident set size of ``pid`` (or this process) in KiB
+    """
+    if pid is None:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    try:
+        with open(f'/proc/{pid}/status') as status:
+            for line in status:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def login_cookie(user):
+    """
+    Create a session for ``user`` and return its cookie header value
+    """
+    engine = import_module(settings.SESSION_ENGINE)
+    session = engine.SessionStore()
+    session[SESSION_KEY] = user._meta.pk.value_to_string(user)
+    session[BACKEND_SESSION_KEY] = settings.AUTHENTICATION_BACKENDS[0]
+    session[HASH_SESSION_KEY] = user.get_session_auth_hash()
+    session.save()
+    return f'{settings.SESSION_COOKIE_NAME}={session.session_key}'
+
+
+def write_placeholder_files(note_ids, media_root, size):
+    """
+    Give every benchmarked note a file so downloads stream real bytes
+    """
+    payload = b'0' * size
+    for name in Note.objects.filter(pk__in=note_ids).values_list('file', flat=True):
+        path = os.path.join(media_root, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as fh:
+            fh.write(payload)
+
+
+def multipart(fields, files):
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in fields.items():
+        parts.append(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode()
+        )
+    for name, (filename, content, content_type) in files.items():
+        parts.append(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+            f'Content-Type: {content_type}\r\n\r\n'.encode() + content + b'\r\n'
+        )
+    parts.append(f'--{boundary}--\r\n'.encode())
+    return b''.join(parts), f'multipart/form-data; boundary={boundary}'
+
+
+class Command(BaseCommand):
+    help = 'Run an end-to-end HTTP benchmark and report latency percentiles per endpoint'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=500, help='Requests per endpoint')
+        parser.add_argument('--concurrency', type=int, default=8)
+        parser.add_argument('--endpoints', nargs='+', choices=list(ENDPOINTS), default=list(ENDPOINTS))
+        parser.add_argument('--url', help='Benchmark a running server instead of booting one')
+        parser.add_argument('--pid', type=int, help='Server PID for RSS sampling when using --url')
+        parser.add_argument('--output', default='bench_http.json')
+        parser.add_argument('--compare', help='Previous JSON result to compare against')
+        parser.add_argument('--max-regression', type=float, default=0.2,
+                            help='Fail if p95 latency grows by more than this fraction')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--file-size', type=int, default=64 * 1024,
+                            help='Size of placeholder files written for downloaded notes')
+
+    def handle(self, *args, **options):
+        self.rng = random.Random(options['seed'])
+        student = User.objects.filter(role='student', is_active=True).first()
+        moderator = User.objects.filter(role='moderator', is_active=True).first()
+        if not student or not moderator:
+            raise CommandError('Need at least one student and one moderator; run seed_scale first.')
+        self.note_ids = list(
+            Note.objects.filter(status='approved').order_by('?').values_list('pk', flat=True)[:1000]
+        )
+        if not self.note_ids:
+            raise CommandError('No approved notes to benchmark against.')
+        first = Note.objects.filter(pk=self.note_ids[0]).values('course_id', 'semester_id', 'subject_id').get()
+        self.upload_fields = {
+            'title': 'Benchmark upload',
+            'description': 'Uploaded by bench_http',
+            'course': first['course_id'],
+            'semester': first['semester_id'],
+            'subject': first['subject_id'],
+            'tags': 'benchmark',
+        }
+        self.cookies = {
+            None: f'csrftoken={CSRF_TOKEN}',
+            'student': f'csrftoken={CSRF_TOKEN}; {login_cookie(student)}',
+            'moderator': f'csrftoken={CSRF_TOKEN}; {login_cookie(moderator)}',
+        }
+
+        # The benchmark is a flood from one client by design; run the target
+        # server with NOTEGHAR_RATELIMIT=0 when using --url
+        no_limits = override_settings(RATELIMIT_ENABLED=False)
+        with tempfile.TemporaryDirectory() as media_root, override_settings(MEDIA_ROOT=media_root), no_limits:
+            if options['url']:
+                parts = urlsplit(options['url'])
+                self.host, self.port = parts.hostname, parts.port or 80
+                results = self.run_all(options, pid=options['pid'])
+            else:
+                write_placeholder_files(self.note_ids, media_root, options['file_size'])
+                # 404s and 500s are part of the results, not console noise
+                logging.getLogger('django.request').setLevel(logging.CRITICAL)
+                httpd = ThreadedWSGIServer(('127.0.0.1', 0), QuietHandler)
+                httpd.set_app(get_wsgi_application())
+                self.host, self.port = httpd.server_address
+                server = threading.Thread(target=httpd.serve_forever, daemon=True)
+                server.start()
+                try:
+                    results = self.run_all(options, pid=None)
+                finally:
+                    httpd.shutdown()
+                    httpd.server_close()
+
+        report = {
+            'commit': self.git_commit(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            'requests': options['requests'],
+            'concurrency': options['concurrency'],
+            'endpoints': results,
+        }
+        with open(options['output'], 'w') as fh:
+            json.dump(report, fh, indent=2)
+        self.stdout.write(f"Saved results to {options['output']}")
+
+        if options['compare']:
+            self.compare(options['compare'], report, options['max_regression'])
+
+    def run_all(self, options, pid):
+        results = {}
+        header = f"{'endpoint':<11} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'queries':>8} {'rss MB':>8}  status"
+        self.stdout.write(header)
+        for name in options['endpoints']:
+            result = self.run_endpoint(name, options['requests'], options['concurrency'])
+            rss = peak_rss_kb(pid)
+            result['peak_rss_mb'] = round(rss / 1024, 1) if rss else None
+            results[name] = result
+            self.stdout.write(
+                f"{name:<11} {result['throughput']:>8.1f} {result['p50_ms']:>8.2f} {result['p95_ms']:>8.2f} "
+                f"{result['p99_ms']:>8.2f} {result['queries_per_request'] or 0:>8.1f} "
+                f"{result['peak_rss_mb'] or 0:>8.1f}  {result['status_codes']}"
+            )
+        return results
+
+    def build_request(self, name):
+        method, template, role = ENDPOINTS[name]
+        path = template.format(pk=self.rng.choice(self.note_ids), word=self.rng.choice(SEARCH_WORDS))
+        headers = {'Cookie': self.cookies[role], 'Host': f'{self.host}:{self.port}'}
+        body = None
+        if method == 'POST':
+            headers['X-CSRFToken'] = CSRF_TOKEN
+            headers['Referer'] = f'http://{self.host}:{self.port}/'
+            if name == 'upload':
+                body, content_type = multipart(
+                    self.upload_fields,
+                    {'file': ('bench.pdf', b'%PDF-1.4\n' + b'0' * 4096, 'application/pdf')},
+                )
+            else:
+                body, content_type = b'rating=4&review=benchmark', 'application/x-www-form-urlencoded'
+            headers['Content-Type'] = content_type
+        return method, path, body, headers
+
+    def run_endpoint(self, name, total, concurrency):
+        latencies, queries, statuses = [], [], {}
+        lock = threading.Lock()
+        remaining = [total]
+
+        def worker():
+            while True:
+                with lock:
+                    if remaining[0] <= 0:
+                        return
+                    remaining[0] -= 1
+                    method, path, body, headers = self.build_request(name)
+                start = time.perf_counter()
+                conn = http.client.HTTPConnection(self.host, self.port, timeout=60)
+                try:
+                    conn.request(method, path, body=body, headers=headers)
+                    response = conn.getresponse()
+                    response.read()
+                    status = response.status
+                    count = response.getheader('X-Query-Count')
+                except (OSError, http.client.HTTPException):
+                    status, count = 'error', None
+                finally:
+                    conn.close()
+                elapsed = (time.perf_counter() - start) * 1000
+                with lock:
+                    latencies.append(elapsed)
+                    statuses[str(status)] = statuses.get(str(status), 0) + 1
+                    if count is not None:
+                        queries.append(int(count))
+
+        started = time.perf_counter()
+        threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        wall = time.perf_counter() - started
+
+        latencies.sort()
+        return {
+            'requests': len(latencies),
+            'throughput': round(len(latencies) / wall, 1) if wall else 0.0,
+            'p50_ms': round(percentile(latencies, 50), 2),
+            'p95_ms': round(percentile(latencies, 95), 2),
+            'p99_ms': round(percentile(latencies, 99), 2),
+            'queries_per_request': round(sum(queries) / len(queries), 2) if queries else None,
+            'status_codes': statuses,
+        }
+
+    def compare(self, path, current, max_regression):
+        with open(path) as fh:
+            previous = json.load(fh)
+        self.stdout.write(f"\nCompared with {previous.get('commit') or path}:")
+        regressions = []
+        for name, now in current['endpoints'].items():
+            before = previous.get('endpoints', {}).get(name)
+            if not before or not before['p95_ms']:
+                continue
+            change = (now['p95_ms'] - before['p95_ms']) / before['p95_ms']
+            self.stdout.write(
+                f"{name:<11} p95 {before['p95_ms']:>8.2f} -> {now['p95_ms']:>8.2f} ms ({change:+.0%})  "
+                f"throughput {before['throughput']:>8.1f} -> {now['throughput']:>8.1f}"
+            )
+            if change > max_regression:
+                regressions.append(name)
+        if regressions:
+            raise CommandError(f"p95 latency regressed on: {', '.join(regressions)}")
+
+    def git_commit(self):
+        try:
+            return subprocess.check_output(
+                ['git', 'rev-parse', '--short', 'HEAD'],
+                cwd=settings.BASE_DIR, stderr=subprocess.DEVNULL, text=True,
+            ).strip()
+        except (OSError, subprocess.CalledProcessError):
+            return os.environ.get('GIT_COMMIT')
@@ -0,0 +1,117 @@
+"""
+Concurrency benchmark for the SQLite connection profiles.
+
+Runs the same mixed workload as the note pages (read a note, bump its view
+counter, aggregate its ratings) from many threads against a scratch database,
+once with SQLite's defaults and once with the production pragmas, and
+reports throughput, latency and "database is locked" failures for each.
+Both profiles wait the same --timeout for locks (the production
+busy_timeout by default), so the comparison measures the journal mode and
+pragmas rather than how long each profile is willing to wait.
+"""
+import os
+import sqlite3
+import statistics
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+PROFILES = {
+    'default': '',
+    'production': settings.SQLITE_PRAGMAS,
+}
+
+
+def _connect(path, pragmas, timeout):
+    conn = sqlite3.connect(path, timeout=timeout, isolation_level=None, check_same_thread=False)
+    if pragmas:
+        conn.executescript(pragmas)
+    # After the pragmas, so their busy_timeout does not override the one
+    # under test
+    conn.execute(f'PRAGMA busy_timeout={int(timeout * 1000)}')
+    return conn
+
+
+def _prepare(path, notes):
+    conn = sqlite3.connect(path)
+    conn.executescript(
+        'CREATE TABLE note (id INTEGER PRIMARY KEY, title TEXT, view_count INTEGER DEFAULT 0);'
+        'CREATE TABLE rating (id INTEGER PRIMARY KEY, note_id INTEGER, rating INTEGER);'
+        'CREATE INDEX rating_note ON rating (note_id);'
+    )
+    conn.executemany('INSERT INTO note (id, title) VALUES (?, ?)', ((i, f'Note {i}') for i in range(1, notes + 1)))
+    conn.executemany(
+        'INSERT INTO rating (note_id, rating) VALUES (?, ?)',
+        ((i % notes + 1, i % 5 + 1) for i in range(notes * 5)),
+    )
+    conn.commit()
+    conn.close()
+
+
+class Command(BaseCommand):
+    help = 'Benchmark concurrent page-view workload under default and production SQLite settings'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=16)
+        parser.add_argument('--seconds', type=float, default=5.0)
+        parser.add_argument('--notes', type=int, default=1000)
+        parser.add_argument('--timeout', type=float, default=5.0,
+                            help='Seconds every profile waits for a lock (default: the production busy_timeout)')
+
+    def handle(self, *args, **options):
+        for name, pragmas in PROFILES.items():
+            with tempfile.TemporaryDirectory() as tmp:
+                path = os.path.join(tmp, 'bench.sqlite3')
+                _prepare(path, options['notes'])
+                result = self._run(path, pragmas, options)
+            self.stdout.write(
+                f"{name:<11} {result['ops']:>8} ops  {result['ops'] / options['seconds']:>9.1f} ops/s  "
+                f"p50 {result['p50']:.2f} ms  p99 {result['p99']:.2f} ms  locked {result['locked']}  "
+                f"(timeout {options['timeout']:g}s)"
+            )
+
+    def _run(self, path, pragmas, options):
+        stop = time.perf_counter() + options['seconds']
+        latencies = []
+        locked = [0]
+        lock = threading.Lock()
+        notes = options['notes']
+
+        def worker(seed):
+            conn = _connect(path, pragmas, options['timeout'])
+            local, errors, i = [], 0, seed
+            while time.perf_counter() < stop:
+                i += 7919
+                pk = i % notes + 1
+                start = time.perf_counter()
+                try:
+                    conn.execute('SELECT id, title, view_count FROM note WHERE id = ?', (pk,)).fetchone()
+                    conn.execute('UPDATE note SET view_count = view_count + 1 WHERE id = ?', (pk,))
+                    conn.execute('SELECT AVG(rating), COUNT(*) FROM rating WHERE note_id = ?', (pk,)).fetchone()
+                except sqlite3.OperationalError:
+                    errors += 1
+                    continue
+                local.append((time.perf_counter() - start) * 1000)
+            conn.close()
+            with lock:
+                latencies.extend(local)
+                locked[0] += errors
+
+        threads = [threading.Thread(target=worker, args=(n,)) for n in range(options['threads'])]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        latencies.sort()
+        if not latencies:
+            return {'ops': 0, 'p50': 0.0, 'p99': 0.0, 'locked': locked[0]}
+        return {
+            'ops': len(latencies),
+            'p50': statistics.median(latencies),
+            'p99': latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))],
+            'locked': locked[0],
+        }
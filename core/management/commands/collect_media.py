@@ -0,0 +1,45 @@
+"""
+Delete uploaded files no row references any more: the files of purged
+notes and replaced profile pictures (see core.mediagc). Directories are
+swept one at a time, so a run can be limited to one month
+(``collect_media notes/2025/06``) or resumed with ``--from``.
+"""
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from core import mediagc
+
+
+class Command(BaseCommand):
+    help = 'Delete orphaned files under MEDIA_ROOT'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'directories', nargs='*', help='Directories under MEDIA_ROOT (default: MEDIA_GC_DIRECTORIES)'
+        )
+        parser.add_argument('--from', dest='start', help='Skip directories before this one, e.g. notes/2025/06')
+        parser.add_argument('--grace-hours', type=float, help='Keep unreferenced files newer than this')
+        parser.add_argument('--dry-run', action='store_true', help='Report what would be deleted')
+
+    def handle(self, *args, **options):
+        grace = options['grace_hours']
+        if grace is None:
+            grace = settings.MEDIA_GC_GRACE_HOURS
+        start = options['start'].strip('/') if options['start'] else None
+        started = time.perf_counter()
+        stats = mediagc.sweep(
+            settings.MEDIA_ROOT,
+            options['directories'] or settings.MEDIA_GC_DIRECTORIES,
+            grace * 3600,
+            dry_run=options['dry_run'],
+            start=start,
+            log=self.stdout.write,
+        )
+        elapsed = time.perf_counter() - started
+        verb = 'would reclaim' if options['dry_run'] else 'reclaimed'
+        self.stdout.write(self.style.SUCCESS(
+            f'{stats["orphans"]:,} orphan(s) of {stats["files"]:,} file(s) in {stats["directories"]:,} '
+            f'directories: {verb} {stats["bytes"]:,} bytes in {elapsed:.1f}s'
+        ))
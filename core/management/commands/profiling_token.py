@@ -0,0 +1,24 @@
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from core.profiling import make_token
+
+
+class Command(BaseCommand):
+    help = 'Print a signed token that lets a staff user profile requests'
+
+    def add_arguments(self, parser):
+        parser.add_argument('username')
+
+    def handle(self, *args, **options):
+        User = get_user_model()
+        try:
+            user = User.objects.get(username=options['username'])
+        except User.DoesNotExist:
+            raise CommandError(f"No user named {options['username']}")
+        if not user.is_staff:
+            raise CommandError('Profiling is limited to staff users.')
+        if not settings.PROFILING_ON_DEMAND:
+            self.stderr.write('On-demand profiling is off; set NOTEGHAR_PROFILING=1 for the token to work.')
+        self.stdout.write(make_token(user))
@@ -0,0 +1,37 @@
+"""
+Stream archived event rows as NDJSON for audits (see core.retention).
+
+Example::
+
+    python manage.py read_archive downloads --from 2024-01-01 --to 2024-02-01 --where user_id=42
+"""
+import json
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core import retention
+
+
+class Command(BaseCommand):
+    help = 'Print archived rows of a retention policy as NDJSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument('policy')
+        parser.add_argument('--from', dest='start', type=date.fromisoformat, help='First day (inclusive)')
+        parser.add_argument('--to', dest='end', type=date.fromisoformat, help='Last day (exclusive)')
+        parser.add_argument('--where', action='append', default=[], metavar='FIELD=VALUE',
+                            help='Only rows whose field equals the value; repeatable')
+
+    def handle(self, *args, **options):
+        policy = retention.policies().get(options['policy'])
+        if policy is None:
+            raise CommandError(f"Unknown policy {options['policy']!r}")
+        try:
+            match = dict(condition.split('=', 1) for condition in options['where'])
+        except ValueError:
+            raise CommandError('--where takes FIELD=VALUE') from None
+        start = retention.day_start(options['start']) if options['start'] else None
+        end = retention.day_start(options['end']) if options['end'] else None
+        for row in retention.read_archive(policy, start, end, match):
+            self.stdout.write(json.dumps(row, separators=(',', ':')))
@@ -0,0 +1,118 @@
+"""
+Worker for the database-backed task queue (see core.taskqueue).
+
+Runs ``--concurrency`` tasks at once on a thread or process pool. Whenever
+pool slots sit idle it claims up to ``--batch`` tasks to fill them, never
+more than it can start at once: a claimed task that waited in the pool
+could outlive TASK_LOCK_TIMEOUT and be requeued while still pending here.
+Threads suit tasks that mostly wait on the database, mail server or disk;
+processes suit CPU-heavy ones. SIGINT/SIGTERM stop claiming and let in-flight tasks
+finish.
+"""
+import multiprocessing
+import os
+import signal
+import socket
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from core import metrics, taskqueue
+
+STATS_INTERVAL = 15  # seconds between queue depth/lag gauge updates
+
+
+class Command(BaseCommand):
+    help = 'Run queued background tasks'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--pool', choices=['thread', 'process'], default='thread')
+        parser.add_argument('--concurrency', type=int, default=4, help='Tasks running at once')
+        parser.add_argument('--batch', type=int, default=20, help='Most tasks claimed per query (at most --concurrency)')
+        parser.add_argument('--poll-interval', type=float, default=1.0,
+                            help='Seconds to sleep when the queue is empty')
+        parser.add_argument('--once', action='store_true', help='Exit once no tasks are due')
+
+    def handle(self, *args, **options):
+        worker_id = f'{socket.gethostname()}:{os.getpid()}'
+        concurrency = options['concurrency']
+        stopping = threading.Event()
+
+        def stop(signum, frame):
+            self.stdout.write('Stopping after in-flight tasks finish...')
+            stopping.set()
+
+        signal.signal(signal.SIGINT, stop)
+        signal.signal(signal.SIGTERM, stop)
+
+        if options['pool'] == 'process':
+            # Children open their own connections; never share the parent's
+            connections.close_all()
+            pool = ProcessPoolExecutor(
+                max_workers=concurrency,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=_init_process,
+            )
+        else:
+            pool = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='task')
+
+        self.stdout.write(f"Worker {worker_id}: {options['pool']} pool, concurrency {concurrency}")
+        in_flight = {}
+        outcomes = {}
+
+        def collect(done):
+            succeeded = []
+            for future in done:
+                outcome = future.result()
+                outcomes[outcome] = outcomes.get(outcome, 0) + 1
+                row = in_flight.pop(future)
+                if outcome == 'success':
+                    succeeded.append((row.pk, row.locked_by))
+            taskqueue.complete(succeeded)
+
+        started = time.perf_counter()
+        last_stats = 0.0
+        try:
+            while not stopping.is_set():
+                now = time.monotonic()
+                if now - last_stats > STATS_INTERVAL:
+                    last_stats = now
+                    released = taskqueue.release_stale()
+                    if released:
+                        self.stdout.write(f'Requeued {released} stale task(s)')
+                    if settings.METRICS_ENABLED:
+                        taskqueue.record_queue_stats()
+                        metrics.flush()
+
+                # Fill the idle slots, at most a batch at a time
+                idle = min(concurrency - len(in_flight), options['batch'])
+                claimed = taskqueue.claim(worker_id, idle) if idle > 0 else []
+                in_flight.update((pool.submit(taskqueue.execute, row), row) for row in claimed)
+
+                if not in_flight:
+                    if options['once']:
+                        break
+                    stopping.wait(options['poll_interval'])
+                    continue
+                # Wake as soon as a slot frees up, or poll again if there is room
+                timeout = None if len(in_flight) >= concurrency else (0 if claimed else options['poll_interval'])
+                done, _ = wait(in_flight, timeout=timeout, return_when=FIRST_COMPLETED)
+                collect(done)
+        finally:
+            collect(wait(in_flight).done)
+            pool.shutdown()
+
+        elapsed = time.perf_counter() - started
+        total = sum(outcomes.values())
+        rate = total / elapsed if elapsed else 0
+        summary = ', '.join(f'{n} {outcome}' for outcome, n in sorted(outcomes.items())) or 'nothing'
+        self.stdout.write(f'Ran {total} task(s) in {elapsed:.1f}s ({rate:.0f}/s): {summary}')
+
+
+def _init_process():
+    django.setup()
@@ -0,0 +1,127 @@
+"""
+Mark and sweep for orphaned media files.
+
+Uploaded files are only referenced from file columns (Note.file,
+User.profile_picture, ...), and rows deleted or pictures replaced leave
+their files behind. ``sweep`` goes through the media tree one directory
+at a time, e.g. notes/YYYY/MM month by month. It lists the directory's
+files with os.scandir, sorts their names, and merges them against the
+names every file column holds under that directory, read in the same
+order with one range scan per column. A file no column mentions is an
+orphan. Only orphans are stat()ed, and only those older than the grace
+period are counted or deleted: an upload is written to disk before its
+row commits.
+
+Memory is bounded by the largest single directory, not the whole tree,
+and an interrupted run can resume from any directory (``start``). SQLite
+compares text byte by byte, which orders UTF-8 names the same way as
+Python does.
+"""
+import heapq
+import os
+import time
+from pathlib import Path
+
+from django.apps import apps
+from django.db import models
+
+CHUNK = 2000
+
+
+def file_fields():
+    """
+    (model, field name) of every file column
+    """
+    return [
+        (model, field.name)
+        for model in apps.get_models()
+        for field in model._meta.concrete_fields
+        if isinstance(field, models.FileField)
+    ]
+
+
+def references(prefix):
+    """
+    The stored names under a directory prefix ending in '/', from every
+    file column, in order
+    """
+    # Every name starting with prefix sorts between it and this
+    end = prefix[:-1] + chr(ord('/') + 1)
+    return heapq.merge(*[
+        model._base_manager.filter(**{f'{name}__gte': prefix, f'{name}__lt': end})
+        .order_by(name).values_list(name, flat=True).iterator(chunk_size=CHUNK)
+        for model, name in file_fields()
+    ])
+
+
+def walk(root, directory):
+    """
+    Yield (directory, sorted file names) for a directory and everything
+    below it, in name order
+    """
+    files, subdirectories = [], []
+    with os.scandir(root / directory) as entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                subdirectories.append(entry.name)
+            elif entry.is_file(follow_symlinks=False):
+                files.append(entry.name)
+    yield directory, sorted(files)
+    for name in sorted(subdirectories):
+        yield from walk(root, f'{directory}/{name}')
+
+
+def orphans(root, directory, names, cutoff):
+    """
+    Yield (name, size) of the files of one directory that no row
+    references and that were last modified before cutoff
+    """
+    prefix = f'{directory}/'
+    referenced = references(prefix)
+    current = next(referenced, None)
+    for name in names:
+        path = prefix + name
+        while current is not None and current < path:
+            current = next(referenced, None)
+        if current == path:
+            continue
+        try:
+            stat = os.stat(root / path)
+        except FileNotFoundError:
+            continue
+        if stat.st_mtime < cutoff:
+            yield path, stat.st_size
+
+
+def sweep(root, directories, grace_seconds, dry_run=False, start=None, log=lambda message: None):
+    """
+    Find, and unless dry_run delete, the orphaned files under the given
+    directories (relative to root), skipping directories before start.
+    Returns {'directories', 'files', 'orphans', 'bytes'}.
+    """
+    root = Path(root)
+    cutoff = time.time() - grace_seconds
+    stats = {'directories': 0, 'files': 0, 'orphans': 0, 'bytes': 0}
+    for top in directories:
+        top = top.strip('/')
+        if not (root / top).is_dir():
+            continue
+        for directory, names in walk(root, top):
+            if start and directory < start:
+                continue
+            found = size = 0
+            for path, length in orphans(root, directory, names, cutoff):
+                found += 1
+                size += length
+                if not dry_run:
+                    try:
+                        os.unlink(root / path)
+                    except FileNotFoundError:
+                        pass
+            stats['directories'] += 1
+            stats['files'] += len(names)
+            stats['orphans'] += found
+            stats['bytes'] += size
+            if found:
+                log(f'{directory}: {found:,} orphan(s) of {len(names):,}, {size / 2**20:,.1f} MiB')
+    return stats
@@ -0,0 +1,293 @@
+"""
+In-process metrics with a file-backed registry shared across workers.
+
+Each thread records into its own shard, so the hot path never takes a
+lock. Threads come and go (servers start one per connection), so a
+snapshot folds the shards of threads that have exited into one and drops
+them. Every process periodically writes a merged snapshot of its shards to
+``METRICS_DIR/<pid>.json`` (atomically, via rename); the /metrics endpoint
+merges all snapshot files and renders them in the Prometheus text format.
+Counters and histograms are summed across processes, gauges take the
+maximum. The counters and histograms of processes that have exited are
+folded into ``retired.json``; their gauges are dropped.
+"""
+import fcntl
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+from django.conf import settings
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+HELP = {
+    'noteghar_requests_total': ('counter', 'Requests served, by view and status code'),
+    'noteghar_request_duration_seconds': ('histogram', 'Request latency by view'),
+    'noteghar_db_queries_total': ('counter', 'SQL statements executed, by view'),
+    'noteghar_db_query_seconds_total': ('counter', 'Time spent in SQL, by view'),
+    'noteghar_template_render_seconds': ('histogram', 'Template render time, by template'),
+    'noteghar_response_bytes_total': ('counter', 'Response body bytes sent, by view'),
+    'noteghar_cache_requests_total': ('counter', 'Cache lookups, by cache and result (hit/miss)'),
+    'noteghar_tasks_total': ('counter', 'Background tasks run, by task and outcome'),
+    'noteghar_task_duration_seconds': ('histogram', 'Background task run time, by task'),
+    'noteghar_task_queue_depth': ('gauge', 'Tasks in the queue table, by status'),
+    'noteghar_task_lag_seconds': ('gauge', 'How long the oldest due task has been waiting'),
+    'noteghar_ratelimited_total': ('counter', 'Requests rejected with 429, by view'),
+}
+
+RETIRED = 'retired.json'
+
+_local = threading.local()
+# (thread, shard) of every thread that has recorded anything
+_shards = []
+_shards_lock = threading.Lock()
+_last_flush = [0.0]
+
+
+class _Shard:
+    __slots__ = ('counters', 'histograms', 'gauges')
+
+    def __init__(self):
+        self.counters = defaultdict(float)
+        self.histograms = {}
+        self.gauges = {}
+
+    def add(self, other):
+        for key, value in dict(other.counters).items():
+            self.counters[key] += value
+        for key, (counts, total, count, buckets) in dict(other.histograms).items():
+            merged = self.histograms.setdefault(key, [[0] * len(counts), 0.0, 0, buckets])
+            merged[0] = [a + b for a, b in zip(merged[0], counts)]
+            merged[1] += total
+            merged[2] += count
+        for key, value in dict(other.gauges).items():
+            self.gauges[key] = max(self.gauges.get(key, value), value)
+
+
+# Everything recorded by threads that have exited
+_retired = _Shard()
+
+
+def _shard():
+    shard = getattr(_local, 'shard', None)
+    if shard is None:
+        shard = _local.shard = _Shard()
+        # Only taken once per thread
+        with _shards_lock:
+            _shards.append((threading.current_thread(), shard))
+    return shard
+
+
+def _key(name, labels):
+    return (name, tuple(sorted(labels.items())) if labels else ())
+
+
+def inc(name, value=1, **labels):
+    _shard().counters[_key(name, labels)] += value
+
+
+def observe(name, value, buckets=LATENCY_BUCKETS, **labels):
+    histograms = _shard().histograms
+    key = _key(name, labels)
+    entry = histograms.get(key)
+    if entry is None:
+        entry = histograms[key] = [[0] * (len(buckets) + 1), 0.0, 0, buckets]
+    counts = entry[0]
+    for i, bound in enumerate(buckets):
+        if value <= bound:
+            counts[i] += 1
+            break
+    else:
+        counts[-1] += 1
+    entry[1] += value
+    entry[2] += 1
+
+
+def set_gauge(name, value, **labels):
+    _shard().gauges[_key(name, labels)] = value
+
+
+def cache_hit(cache_name):
+    inc('noteghar_cache_requests_total', cache=cache_name, result='hit')
+
+
+def cache_miss(cache_name):
+    inc('noteghar_cache_requests_total', cache=cache_name, result='miss')
+
+
+def snapshot():
+    """
+    Merge this process's shards into a JSON-serializable dict
+    """
+    merged = _Shard()
+    with _shards_lock:
+        # A thread that has exited never writes to its shard again
+        for entry in [entry for entry in _shards if not entry[0].is_alive()]:
+            _retired.add(entry[1])
+            _shards.remove(entry)
+        merged.add(_retired)
+        live = [shard for thread, shard in _shards]
+    for shard in live:
+        merged.add(shard)
+    return _dump(merged)
+
+
+def _dump(shard):
+    """
+    A _Shard as a JSON-serializable dict
+    """
+    return {
+        'counters': [[name, list(labels), value] for (name, labels), value in shard.counters.items()],
+        'histograms': [[name, list(labels), counts, total, count, list(buckets)]
+                       for (name, labels), (counts, total, count, buckets) in shard.histograms.items()],
+        'gauges': [[name, list(labels), value] for (name, labels), value in shard.gauges.items()],
+    }
+
+
+def _write(path, data):
+    tmp = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    with open(tmp, 'w') as fh:
+        json.dump(data, fh)
+    os.replace(tmp, path)
+
+
+def _read(path):
+    try:
+        with open(path) as fh:
+            return json.load(fh)
+    except (OSError, ValueError):
+        return None
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+@contextmanager
+def _directory_lock(directory):
+    with open(os.path.join(directory, '.lock'), 'w') as fh:
+        fcntl.flock(fh, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(fh, fcntl.LOCK_UN)
+
+
+def _parse(data):
+    """
+    A snapshot dict back as a _Shard
+    """
+    shard = _Shard()
+    for name, labels, value in data['counters']:
+        shard.counters[(name, tuple(map(tuple, labels)))] += value
+    for name, labels, counts, total, count, buckets in data['histograms']:
+        shard.histograms[(name, tuple(map(tuple, labels)))] = [counts, total, count, buckets]
+    for name, labels, value in data['gauges']:
+        shard.gauges[(name, tuple(map(tuple, labels)))] = value
+    return shard
+
+
+def retire_dead(directory):
+    """
+    Fold the snapshots of exited processes into RETIRED and delete them, so
+    the directory does not grow with every restart while counters keep
+    counting up
+    """
+    dead = []
+    for entry in os.scandir(directory):
+        pid = entry.name[:-len('.json')]
+        if entry.name.endswith('.json') and pid.isdigit() and not _alive(int(pid)):
+            dead.append(entry.path)
+    if not dead:
+        return
+    retired_path = os.path.join(directory, RETIRED)
+    data = _read(retired_path)
+    retired = _parse(data) if data is not None else _Shard()
+    for path in dead:
+        data = _read(path)
+        if data is not None:
+            retired.add(_parse(data))
+    # Gauges describe a live process
+    retired.gauges.clear()
+    _write(retired_path, _dump(retired))
+    for path in dead:
+        os.unlink(path)
+
+
+def flush(force=False):
+    """
+    Write this process's snapshot to the shared registry directory
+    """
+    now = time.monotonic()
+    if not force and now - _last_flush[0] < settings.METRICS_FLUSH_INTERVAL:
+        return
+    _last_flush[0] = now
+    directory = settings.METRICS_DIR
+    os.makedirs(directory, exist_ok=True)
+    _write(os.path.join(directory, f'{os.getpid()}.json'), snapshot())
+
+
+def collect():
+    """
+    Merge the snapshots of every worker process
+    """
+    flush(force=True)
+    merged = _Shard()
+    directory = settings.METRICS_DIR
+    # Two scrapes must not both fold the same dead process
+    with _directory_lock(directory):
+        retire_dead(directory)
+        for entry in os.scandir(directory):
+            if entry.name.endswith('.json'):
+                data = _read(entry.path)
+                if data is not None:
+                    merged.add(_parse(data))
+    return merged.counters, merged.histograms, merged.gauges
+
+
+def _labels(labels, extra=None):
+    pairs = list(labels) + (list(extra) if extra else [])
+    if not pairs:
+        return ''
+    body = ','.join(
+        '{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for k, v in pairs
+    )
+    return '{' + body + '}'
+
+
+def render_prometheus():
+    """
+    Render all merged metrics in the Prometheus text exposition format
+    """
+    counters, histograms, gauges = collect()
+    by_name = defaultdict(list)
+    for (name, labels), value in sorted(counters.items()):
+        by_name[name].append(f'{name}{_labels(labels)} {value:g}')
+    for (name, labels), value in sorted(gauges.items()):
+        by_name[name].append(f'{name}{_labels(labels)} {value:g}')
+    for (name, labels), (counts, total, count, buckets) in sorted(histograms.items()):
+        cumulative = 0
+        for bound, n in zip(list(buckets) + ['+Inf'], counts):
+            cumulative += n
+            le = bound if bound == '+Inf' else f'{bound:g}'
+            by_name[name].append(f'{name}_bucket{_labels(labels, [("le", le)])} {cumulative}')
+        by_name[name].append(f'{name}_sum{_labels(labels)} {total:g}')
+        by_name[name].append(f'{name}_count{_labels(labels)} {count}')
+
+    lines = []
+    for name in sorted(by_name):
+        kind, text = HELP.get(name, ('untyped', name))
+        lines.append(f'# HELP {name} {text}')
+        lines.append(f'# TYPE {name} {kind}')
+        lines.extend(by_name[name])
+    return '\n'.join(lines) + '\n'
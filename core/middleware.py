@@ -0,0 +1,336 @@
+import logging
+import math
+import random
+import time
+from contextlib import ExitStack
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.http import HttpResponse
+from django.urls import Resolver404, resolve
+
+from . import metrics
+from .db import read_only
+from .profiling import RequestProfile, save_profile, token_is_valid
+from .querycount import QueryRecorder, check_budget, get_query_budget
+from .ratelimit import Rule, cookie_user, get_store, remember_user
+
+logger = logging.getLogger(__name__)
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+
+class HybridMiddleware:
+    """
+    Base for middleware that runs natively under both WSGI and ASGI.
+
+    Subclasses implement ``call`` and ``acall``; Django picks the mode from
+    the next handler so async views are never forced through a thread.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.acall(request)
+        return self.call(request)
+
+
+class ReadOnlyRoutingMiddleware(HybridMiddleware):
+    """
+    Mark safe requests as read-only so the database router sends their
+    SELECTs to the reader connection
+    """
+
+    def call(self, request):
+        with read_only(request.method in SAFE_METHODS):
+            return self.get_response(request)
+
+    async def acall(self, request):
+        # The ORM copies the context into its worker thread, so the flag
+        # set here is visible to the router
+        with read_only(request.method in SAFE_METHODS):
+            return await self.get_response(request)
+
+
+class QueryCountMiddleware(HybridMiddleware):
+    """
+    Record the SQL run by each request, expose it in response headers and
+    log N+1 suspects and budget overruns.
+
+    With QUERY_BUDGET_STRICT enabled (the test helpers turn it on), a view
+    that goes over its QUERY_BUDGETS entry raises QueryBudgetExceeded.
+    """
+
+    def call(self, request):
+        with QueryRecorder() as recorder:
+            response = self.get_response(request)
+        return self.report(request, response, recorder)
+
+    async def acall(self, request):
+        # Under ASGI the ORM runs on the request's sync thread; install the
+        # wrappers on that thread's connections
+        recorder = QueryRecorder()
+        await sync_to_async(recorder.__enter__)()
+        try:
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(recorder.__exit__)(None, None, None)
+        return self.report(request, response, recorder)
+
+    def report(self, request, response, recorder):
+        request.query_recorder = recorder
+        match = getattr(request, 'resolver_match', None)
+        url_name = match.view_name if match else None
+
+        response['X-Query-Count'] = str(recorder.count)
+        response['X-Query-Time-Ms'] = f'{recorder.total_time * 1000:.2f}'
+        if recorder.background_queries:
+            # Run by tasks executed eagerly; queued in production
+            response['X-Task-Query-Count'] = str(len(recorder.background_queries))
+
+        suspects = recorder.n_plus_one_suspects()
+        if suspects:
+            logger.warning('Possible N+1 in %s: %s', url_name or request.path, suspects)
+
+        if url_name:
+            budget = get_query_budget(url_name)
+            if budget is not None and recorder.count > budget:
+                if getattr(settings, 'QUERY_BUDGET_STRICT', False):
+                    check_budget(url_name, recorder)
+                logger.warning(
+                    '%s ran %d queries (budget %d)', url_name, recorder.count, budget
+                )
+        return response
+
+
+class ProfilingMiddleware(HybridMiddleware):
+    """
+    Profile individual requests on demand or by random sampling.
+
+    Staff trigger a profile with a token from ``manage.py profiling_token``
+    in the ``_profile`` query parameter or the ``X-Profile-Token`` header;
+    ``_profile_mode=cprofile`` switches from the stack sampler to cProfile
+    and ``_profile_return=1`` returns the profile instead of the page.
+    When neither on-demand nor sampled profiling is enabled the middleware
+    removes itself from the chain. Under ASGI the sampler follows the event
+    loop thread, where async views run. Work they hand to sync_to_async
+    threads (ORM calls, rendering) runs on other threads and only shows up
+    as the event loop waiting; profile the same view under WSGI to see
+    inside it.
+    """
+
+    def __init__(self, get_response):
+        self.on_demand = settings.PROFILING_ON_DEMAND
+        self.sample_rate = settings.PROFILING_SAMPLE_RATE
+        if not self.on_demand and not self.sample_rate:
+            raise MiddlewareNotUsed
+        super().__init__(get_response)
+
+    def call(self, request):
+        token = self.token(request)
+        if token and token_is_valid(token, request.user):
+            return self.profile_on_demand(request)
+        if self.sample_rate and random.randrange(self.sample_rate) == 0:
+            return self.profile_sampled(request)
+        return self.get_response(request)
+
+    async def acall(self, request):
+        token = self.token(request)
+        if token and token_is_valid(token, await request.auser()):
+            profile = RequestProfile(request.GET.get('_profile_mode', 'sample'))
+            with profile:
+                response = await self.get_response(request)
+            return self.finish_on_demand(request, response, profile)
+        if self.sample_rate and random.randrange(self.sample_rate) == 0:
+            profile = RequestProfile('sample')
+            with profile:
+                response = await self.get_response(request)
+            return self.finish_sampled(request, response, profile)
+        return await self.get_response(request)
+
+    def token(self, request):
+        if not self.on_demand:
+            return None
+        return request.GET.get('_profile') or request.headers.get('X-Profile-Token')
+
+    def profile_on_demand(self, request):
+        profile = RequestProfile(request.GET.get('_profile_mode', 'sample'))
+        with profile:
+            response = self.get_response(request)
+        return self.finish_on_demand(request, response, profile)
+
+    def profile_sampled(self, request):
+        profile = RequestProfile('sample')
+        with profile:
+            response = self.get_response(request)
+        return self.finish_sampled(request, response, profile)
+
+    def finish_on_demand(self, request, response, profile):
+        if request.GET.get('_profile_return'):
+            return HttpResponse(profile.content(), content_type=profile.content_type)
+        response['X-Profile-Id'] = save_profile(profile, _profile_label(request))
+        response['X-Profile-Time-Ms'] = f'{profile.elapsed * 1000:.2f}'
+        return response
+
+    def finish_sampled(self, request, response, profile):
+        try:
+            save_profile(profile, _profile_label(request))
+        except OSError:
+            logger.exception('Could not save sampled profile')
+        return response
+
+
+def _profile_label(request):
+    match = getattr(request, 'resolver_match', None)
+    name = match.view_name if match else 'unresolved'
+    return name.replace(':', '-')
+
+
+class _SQLTimer:
+    """
+    Lightweight execute_wrapper that only counts and times statements
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.time = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.time += time.perf_counter() - start
+            self.count += 1
+
+    def installed(self):
+        """
+        Install the timer on this thread's connections for all aliases
+        """
+        stack = ExitStack()
+        for alias in connections:
+            stack.enter_context(connections[alias].execute_wrapper(self))
+        return stack
+
+
+class MetricsMiddleware(HybridMiddleware):
+    """
+    Record latency, SQL count/time and response size per URL name
+    """
+
+    def __init__(self, get_response):
+        if not settings.METRICS_ENABLED:
+            raise MiddlewareNotUsed
+        super().__init__(get_response)
+
+    def call(self, request):
+        sql = _SQLTimer()
+        start = time.perf_counter()
+        with sql.installed():
+            response = self.get_response(request)
+        return self.record(request, response, sql, time.perf_counter() - start)
+
+    async def acall(self, request):
+        sql = _SQLTimer()
+        start = time.perf_counter()
+        stack = await sync_to_async(sql.installed)()
+        try:
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(stack.close)()
+        return self.record(request, response, sql, time.perf_counter() - start)
+
+    def record(self, request, response, sql, elapsed):
+        match = getattr(request, 'resolver_match', None)
+        view = match.view_name if match else 'unresolved'
+        metrics.observe('noteghar_request_duration_seconds', elapsed, view=view)
+        metrics.inc('noteghar_requests_total', view=view, status=str(response.status_code))
+        metrics.inc('noteghar_db_queries_total', sql.count, view=view)
+        metrics.inc('noteghar_db_query_seconds_total', sql.time, view=view)
+        if not response.streaming:
+            metrics.inc('noteghar_response_bytes_total', len(response.content), view=view)
+        metrics.flush()
+        return response
+
+
+class RateLimitMiddleware(HybridMiddleware):
+    """
+    Turn away clients that exceed RATE_LIMITS with 429 before the view, or
+    any session and user lookups, run.
+
+    Per-user buckets are keyed on the user id from a signed cookie (see
+    core.ratelimit). Without a valid one, the IP bucket is checked first
+    and only a request it lets through loads the user, from the
+    AuthenticationMiddleware before this one.
+    """
+
+    def __init__(self, get_response):
+        if not settings.RATELIMIT_ENABLED or not settings.RATE_LIMITS:
+            raise MiddlewareNotUsed
+        self.rules = {name: Rule(name, config) for name, config in settings.RATE_LIMITS.items()}
+        super().__init__(get_response)
+
+    def call(self, request):
+        match, rule = self.match(request)
+        if rule is None:
+            return self.get_response(request)
+        known, user_id = cookie_user(request) if rule.per_user else (True, None)
+        if known:
+            return self.limit(request, match, rule, user_id) or self.get_response(request)
+
+        response = self.limit(request, match, rule, None, scopes=('ip',))
+        if response is None:
+            user_id = request.user.pk
+            response = self.limit(request, match, rule, user_id, scopes=('user',)) or self.get_response(request)
+            remember_user(request, response, user_id)
+        return response
+
+    async def acall(self, request):
+        match, rule = self.match(request)
+        if rule is None:
+            return await self.get_response(request)
+        known, user_id = cookie_user(request) if rule.per_user else (True, None)
+        # Bucket checks never block for long, so they stay on the event loop
+        if known:
+            return self.limit(request, match, rule, user_id) or await self.get_response(request)
+
+        response = self.limit(request, match, rule, None, scopes=('ip',))
+        if response is None:
+            user_id = (await request.auser()).pk
+            response = self.limit(request, match, rule, user_id, scopes=('user',)) or await self.get_response(request)
+            remember_user(request, response, user_id)
+        return response
+
+    def match(self, request):
+        """
+        The resolved URL and the rule that applies to this request, if any
+        """
+        try:
+            match = resolve(request.path_info)
+        except Resolver404:
+            return None, None
+        rule = self.rules.get(match.view_name)
+        if rule is None or not rule.applies(request):
+            return match, None
+        return match, rule
+
+    def limit(self, request, match, rule, user_id, scopes=Rule.SCOPES):
+        retry_after = rule.check(request, get_store(), user_id, scopes)
+        if not retry_after:
+            return None
+
+        request.resolver_match = match  # so metrics label the 429 by view
+        if settings.METRICS_ENABLED:
+            metrics.inc('noteghar_ratelimited_total', view=match.view_name)
+        response = HttpResponse('Too many requests, slow down.', status=429, content_type='text/plain')
+        response['Retry-After'] = str(math.ceil(retry_after))
+        return response
@@ -0,0 +1,186 @@
+"""
+Full-page cache for anonymous GET requests.
+
+``cache_anonymous_page(tags)`` wraps a sync or async view. ``tags`` maps a
+request to the dependency tags its page is built from (see notes.signals),
+for example ``['catalog:filters', 'subject:7']``. Pages are stored in the
+PAGE_CACHE_ALIAS cache under their normalized URL together with the
+version of every tag at render time. A lookup re-reads the current tag
+versions (one indexed query on core.Version, shared by all processes), so
+a bump anywhere drops exactly the pages that carry that tag, however many
+processes hold copies.
+
+Regeneration is single-flight per process. When a page is stale, one
+request rebuilds it and concurrent requests are served the stale copy. When
+there is no copy at all, they wait up to PAGE_CACHE_WAIT seconds for the
+first request to finish instead of all rendering the same page.
+
+Only anonymous requests (no session or messages cookie) are served from or
+stored in the cache, and only plain 200 responses that set no cookies and
+did not issue a CSRF token.
+"""
+import hashlib
+import threading
+from functools import wraps
+from urllib.parse import urlencode
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.contrib.messages.storage.cookie import CookieStorage
+from django.core.cache import caches
+from django.http import HttpResponse
+
+from . import metrics, versions
+from .conditional import is_anonymous
+
+IGNORED_PARAMS = ('utm_source', 'utm_medium', 'utm_campaign', 'utm_term', 'utm_content', 'fbclid', 'gclid')
+
+_flights = {}
+_flights_lock = threading.Lock()
+
+
+def cache_key(request):
+    """
+    Path plus the non-empty, non-tracking query parameters in sorted order
+    """
+    params = sorted(
+        (key, value) for key, values in request.GET.lists() if key not in IGNORED_PARAMS
+        for value in values if value
+    )
+    url = f'{request.path}?{urlencode(params)}'
+    digest = hashlib.sha256(url.encode()).hexdigest()[:32]
+    return f'page:{settings.FRAGMENT_CACHE_VERSION}:{digest}'
+
+
+def cacheable_request(request):
+    return (
+        settings.PAGE_CACHE_ENABLED
+        and request.method in ('GET', 'HEAD')
+        and is_anonymous(request)
+        and CookieStorage.cookie_name not in request.COOKIES
+    )
+
+
+def cacheable_response(request, response):
+    return (
+        response.status_code == 200
+        and not response.streaming
+        and not response.cookies
+        and not request.META.get('CSRF_COOKIE_NEEDS_UPDATE')
+    )
+
+
+class _Flight:
+    """
+    One in-process regeneration of a page that others can wait on
+    """
+
+    def __init__(self):
+        self.done = threading.Event()
+
+
+def _join_flight(key):
+    """
+    (flight, leader): the current regeneration of key, and whether this
+    caller started it and must finish it
+    """
+    with _flights_lock:
+        flight = _flights.get(key)
+        if flight is not None:
+            return flight, False
+        flight = _flights[key] = _Flight()
+        return flight, True
+
+
+def _land(key, flight):
+    with _flights_lock:
+        _flights.pop(key, None)
+    flight.done.set()
+
+
+def _lookup(request, tags):
+    """
+    Return (response or None, key, current tag versions, leader flight)
+    """
+    cache = caches[settings.PAGE_CACHE_ALIAS]
+    key = cache_key(request)
+    current = versions.current_many(tags)
+    entry = cache.get(key)
+    if entry is not None and entry['tags'] == current:
+        metrics.cache_hit('page')
+        return _build(entry, 'hit'), key, current, None
+
+    metrics.cache_miss('page')
+    flight, leader = _join_flight(key)
+    if leader:
+        return None, key, current, flight
+    if entry is not None:
+        # Someone is already rebuilding it; the old copy will do meanwhile
+        return _build(entry, 'stale'), key, current, None
+    if flight.done.wait(settings.PAGE_CACHE_WAIT):
+        entry = cache.get(key)
+        if entry is not None and entry['tags'] == current:
+            return _build(entry, 'hit'), key, current, None
+    # The leader failed or is slow; render without caching
+    return None, key, current, None
+
+
+def _store(key, current, response):
+    caches[settings.PAGE_CACHE_ALIAS].set(key, {
+        'content': response.content,
+        'content_type': response['Content-Type'],
+        'tags': current,
+    }, settings.PAGE_CACHE_TIMEOUT)
+
+
+def _build(entry, state):
+    response = HttpResponse(entry['content'], content_type=entry['content_type'])
+    response['X-Page-Cache'] = state
+    return response
+
+
+def cache_anonymous_page(tags):
+    def decorator(view):
+        def finish(request, response, key, current, flight):
+            try:
+                if flight is not None and cacheable_response(request, response):
+                    _store(key, current, response)
+                    response['X-Page-Cache'] = 'miss'
+            finally:
+                if flight is not None:
+                    _land(key, flight)
+            return response
+
+        if iscoroutinefunction(view):
+            @wraps(view)
+            async def async_wrapper(request, *args, **kwargs):
+                if not cacheable_request(request):
+                    return await view(request, *args, **kwargs)
+                cached, key, current, flight = await sync_to_async(_lookup)(request, tags(request))
+                if cached is not None:
+                    return cached
+                response = None
+                try:
+                    response = await view(request, *args, **kwargs)
+                finally:
+                    if response is None and flight is not None:
+                        _land(key, flight)
+                return finish(request, response, key, current, flight)
+            return async_wrapper
+
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if not cacheable_request(request):
+                return view(request, *args, **kwargs)
+            cached, key, current, flight = _lookup(request, tags(request))
+            if cached is not None:
+                return cached
+            response = None
+            try:
+                response = view(request, *args, **kwargs)
+            finally:
+                if response is None and flight is not None:
+                    _land(key, flight)
+            return finish(request, response, key, current, flight)
+        return wrapper
+    return decorator
@@ -0,0 +1,181 @@
+"""
+Per-request profiling.
+
+Two profilers are available:
+
+* ``StackSampler`` - a statistical sampler that snapshots the request
+  thread's stack every few milliseconds and aggregates the samples into
+  folded stacks (``frame;frame;frame count``), the input format of
+  flamegraph.pl, speedscope and most flame graph viewers. It sees one
+  thread only: under ASGI that is the event loop, not the sync_to_async
+  threads doing an async view's ORM work.
+* ``cProfile`` - deterministic profiling, saved in pstats format.
+
+``ProfilingMiddleware`` runs one of them around the view (which includes
+template rendering and SQL) when a staff user sends a valid signed token,
+or for a random 1-in-N sample of all requests when PROFILING_SAMPLE_RATE is
+set. Sampled profiles go to a rotating directory that keeps only the most
+recent PROFILING_MAX_FILES files.
+"""
+import cProfile
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+
+from django.conf import settings
+from django.core import signing
+
+TOKEN_SALT = 'noteghar.profiling'
+SITE_PACKAGES = 'site-packages' + os.sep
+
+
+def make_token(user):
+    """
+    Create a signed profiling token for a staff user
+    """
+    return signing.dumps({'u': user.pk}, salt=TOKEN_SALT)
+
+
+def token_is_valid(token, user):
+    """
+    Check a profiling token was issued to this user and has not expired
+    """
+    if not token or not user.is_authenticated or not user.is_staff:
+        return False
+    try:
+        data = signing.loads(token, salt=TOKEN_SALT, max_age=settings.PROFILING_TOKEN_MAX_AGE)
+    except signing.BadSignature:
+        return False
+    return data.get('u') == user.pk
+
+
+def frame_label(code):
+    filename = code.co_filename
+    if SITE_PACKAGES in filename:
+        filename = filename.split(SITE_PACKAGES, 1)[1]
+    elif filename.startswith(str(settings.BASE_DIR)):
+        filename = os.path.relpath(filename, settings.BASE_DIR)
+    return f'{code.co_name} ({filename}:{code.co_firstlineno})'
+
+
+class StackSampler:
+    """
+    Sample one thread's call stack at a fixed interval
+    """
+
+    def __init__(self, thread_id=None, interval=None):
+        self.thread_id = thread_id or threading.get_ident()
+        self.interval = interval or settings.PROFILING_SAMPLE_INTERVAL
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(frame_label(frame.f_code))
+                frame = frame.f_back
+            self.stacks[';'.join(reversed(stack))] += 1
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self._run, name='noteghar-profiler', daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+
+    def folded(self):
+        """
+        Samples in folded-stack format, one stack per line
+        """
+        return ''.join(f'{stack} {count}\n' for stack, count in self.stacks.most_common())
+
+
+class RequestProfile:
+    """
+    Profile a block with the sampler or cProfile and serialize the result
+    """
+
+    def __init__(self, mode='sample'):
+        self.mode = mode if mode in ('sample', 'cprofile') else 'sample'
+        self.elapsed = 0.0
+        self._profiler = StackSampler() if self.mode == 'sample' else cProfile.Profile()
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        if self.mode == 'sample':
+            self._profiler.__enter__()
+        else:
+            self._profiler.enable()
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.mode == 'sample':
+            self._profiler.__exit__(*exc_info)
+        else:
+            self._profiler.disable()
+        self.elapsed = time.perf_counter() - self._start
+
+    @property
+    def extension(self):
+        return 'folded' if self.mode == 'sample' else 'prof'
+
+    @property
+    def content_type(self):
+        return 'text/plain; charset=utf-8' if self.mode == 'sample' else 'application/octet-stream'
+
+    def dump(self, path):
+        if self.mode == 'sample':
+            with open(path, 'w') as fh:
+                fh.write(self._profiler.folded())
+        else:
+            self._profiler.dump_stats(path)
+
+    def content(self):
+        if self.mode == 'sample':
+            return self._profiler.folded().encode()
+        # pstats has no in-memory serializer; round-trip through a file
+        path = os.path.join(settings.PROFILING_DIR, f'.tmp-{uuid.uuid4().hex}.prof')
+        os.makedirs(settings.PROFILING_DIR, exist_ok=True)
+        try:
+            self._profiler.dump_stats(path)
+            with open(path, 'rb') as fh:
+                return fh.read()
+        finally:
+            os.remove(path)
+
+
+def save_profile(profile, label):
+    """
+    Write a profile into the rotating store and return its file name
+    """
+    directory = settings.PROFILING_DIR
+    os.makedirs(directory, exist_ok=True)
+    name = f"{time.strftime('%Y%m%dT%H%M%S')}-{label}-{uuid.uuid4().hex[:8]}.{profile.extension}"
+    profile.dump(os.path.join(directory, name))
+    rotate(directory, settings.PROFILING_MAX_FILES)
+    return name
+
+
+def rotate(directory, keep):
+    """
+    Delete all but the ``keep`` most recent profiles
+    """
+    entries = sorted(
+        (e for e in os.scandir(directory) if e.is_file() and not e.name.startswith('.')),
+        key=lambda e: e.stat().st_mtime,
+    )
+    for entry in entries[:max(0, len(entries) - keep)]:
+        try:
+            os.remove(entry.path)
+        except FileNotFoundError:
+            pass
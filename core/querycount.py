@@ -0,0 +1,138 @@
+"""
+Per-request SQL instrumentation.
+
+``QueryRecorder`` hooks every database connection through
+``execute_wrapper`` and records each statement with its parameters and
+duration. From that it reports the total count and time, exact duplicates
+(same SQL and parameters) and N+1 suspects (the same SQL shape executed
+repeatedly with different parameters).
+
+Statements run inside ``background()`` (tasks run eagerly in development)
+are kept apart in ``background_queries``; they are not part of the
+request in production, so budgets and N+1 checks ignore them.
+"""
+import threading
+import time
+from collections import Counter
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.db import connections
+
+
+_local = threading.local()
+
+
+@contextmanager
+def background():
+    """
+    Record the queries run inside as background work, not the request's
+    """
+    outer = getattr(_local, 'background', False)
+    _local.background = True
+    try:
+        yield
+    finally:
+        _local.background = outer
+
+
+class QueryBudgetExceeded(AssertionError):
+    """
+    Raised when a view runs more queries than its declared budget
+    """
+
+
+class QueryRecorder:
+    """
+    Context manager that records SQL run on all database aliases
+    """
+
+    def __init__(self, n_plus_one_threshold=None):
+        self.queries = []
+        self.background_queries = []
+        self.n_plus_one_threshold = n_plus_one_threshold or getattr(
+            settings, 'QUERY_N_PLUS_ONE_THRESHOLD', 3
+        )
+        self._stack = None
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            queries = self.background_queries if getattr(_local, 'background', False) else self.queries
+            queries.append({
+                'sql': sql,
+                'params': _freeze(params),
+                'time': time.perf_counter() - start,
+                'alias': context['connection'].alias,
+            })
+
+    def __enter__(self):
+        self._stack = ExitStack()
+        for alias in connections:
+            self._stack.enter_context(connections[alias].execute_wrapper(self))
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stack.close()
+        self._stack = None
+
+    @property
+    def count(self):
+        return len(self.queries)
+
+    @property
+    def total_time(self):
+        return sum(q['time'] for q in self.queries)
+
+    def duplicates(self):
+        """
+        Statements run more than once with identical parameters
+        """
+        counts = Counter((q['sql'], q['params']) for q in self.queries)
+        return {sql: n for (sql, params), n in counts.items() if n > 1}
+
+    def n_plus_one_suspects(self):
+        """
+        SQL shapes repeated at least ``n_plus_one_threshold`` times
+        """
+        counts = Counter(q['sql'] for q in self.queries)
+        return {sql: n for sql, n in counts.items() if n >= self.n_plus_one_threshold}
+
+    def summary(self):
+        return {
+            'count': self.count,
+            'time_ms': round(self.total_time * 1000, 2),
+            'duplicates': self.duplicates(),
+            'n_plus_one': self.n_plus_one_suspects(),
+        }
+
+
+def get_query_budget(url_name):
+    """
+    Return the declared query budget for a namespaced URL name, if any
+    """
+    return getattr(settings, 'QUERY_BUDGETS', {}).get(url_name)
+
+
+def check_budget(url_name, recorder):
+    """
+    Raise QueryBudgetExceeded if the recorder is over the URL's budget
+    """
+    budget = get_query_budget(url_name)
+    if budget is not None and recorder.count > budget:
+        lines = '\n'.join(q['sql'] for q in recorder.queries)
+        raise QueryBudgetExceeded(
+            f"{url_name} ran {recorder.count} queries (budget {budget}):\n{lines}"
+        )
+
+
+def _freeze(params):
+    if params is None:
+        return None
+    if isinstance(params, dict):
+        return tuple(sorted((k, repr(v)) for k, v in params.items()))
+    if isinstance(params, (list, tuple)):
+        return tuple(_freeze(p) if isinstance(p, (list, tuple, dict)) else repr(p) for p in params)
+    return repr(params)
@@ -0,0 +1,263 @@
+"""
+Token-bucket rate limiting.
+
+Each rule in ``settings.RATE_LIMITS`` gives a URL name a bucket per client
+IP and/or per user. The user bucket is keyed on the signed-in user's id,
+so signing in again or clearing cookies does not refill it; anonymous
+clients fall back to a user bucket per IP. A bucket holds up to N tokens
+and refills at N per period; a request spends one token or is turned away
+with 429 and a ``Retry-After`` telling the client when the next token
+arrives.
+
+Checks run before any ORM work. The user id is read from a signed cookie
+(RATELIMIT_USER_COOKIE) bound to the session cookie, so it needs no
+session or user query. Only when that cookie is missing or belongs to
+another session is the user loaded, once the IP bucket has let the
+request through, and the cookie issued again.
+
+Bucket state lives outside the main database:
+
+* ``SharedMemoryBuckets`` (the production default) keeps a fixed table of
+  buckets in an mmap'd file under /dev/shm, shared by every worker process
+  on the host. Each lookup locks a few bytes of the file with ``lockf``,
+  so a check costs microseconds and no network round trip.
+* ``CacheBuckets`` keeps buckets in a Django cache. With the default
+  LocMemCache every process has its own buckets, which is fine for
+  development.
+
+Both stores fail open: if the table is full of live buckets, the
+oldest is reused and its client gets a fresh bucket.
+"""
+import fcntl
+import hashlib
+import ipaddress
+import math
+import mmap
+import os
+import struct
+import threading
+import time
+
+from django.conf import settings
+from django.core import signing
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
+
+PERIODS = {'s': 1, 'm': 60, 'h': 60 * 60, 'd': 24 * 60 * 60}
+
+USER_COOKIE_SALT = 'core.ratelimit.user'
+
+
+def parse_rate(rate):
+    """
+    '30/m' -> (30, 60): up to 30 requests per minute, refilled evenly
+    """
+    try:
+        count, period = rate.split('/')
+        return int(count), PERIODS[period]
+    except (ValueError, KeyError):
+        raise ImproperlyConfigured(f'Bad rate {rate!r}; expected e.g. "30/m"') from None
+
+
+def client_ip(request):
+    """
+    The client address, with IPv6 collapsed to its /64 so a single host
+    cannot rotate through its own address block
+    """
+    addr = request.META.get('REMOTE_ADDR', '')
+    try:
+        ip = ipaddress.ip_address(addr)
+    except ValueError:
+        return addr
+    if ip.version == 6:
+        return str(ipaddress.ip_network(f'{ip}/64', strict=False).network_address)
+    return addr
+
+
+def _session_digest(session_key):
+    return hashlib.blake2b(session_key.encode(), digest_size=16).hexdigest()
+
+
+def cookie_user(request):
+    """
+    (known, user id) for the request, without the database. Clients with
+    no session are known to be anonymous; with a session, the user id comes
+    from RATELIMIT_USER_COOKIE if it was signed for that session.
+    """
+    session_key = request.COOKIES.get(settings.SESSION_COOKIE_NAME)
+    if not session_key:
+        return True, None
+    try:
+        digest, user_id = signing.loads(request.COOKIES[settings.RATELIMIT_USER_COOKIE], salt=USER_COOKIE_SALT)
+    except (KeyError, ValueError, signing.BadSignature):
+        return False, None
+    if digest != _session_digest(session_key):
+        return False, None
+    return True, user_id
+
+
+def remember_user(request, response, user_id):
+    """
+    Sign the user id (None for anonymous) for the request's session, so
+    cookie_user finds it next time
+    """
+    digest = _session_digest(request.COOKIES[settings.SESSION_COOKIE_NAME])
+    response.set_cookie(
+        settings.RATELIMIT_USER_COOKIE,
+        signing.dumps([digest, user_id], salt=USER_COOKIE_SALT),
+        max_age=settings.SESSION_COOKIE_AGE,
+        secure=settings.SESSION_COOKIE_SECURE,
+        httponly=True,
+        samesite=settings.SESSION_COOKIE_SAMESITE,
+    )
+
+
+def refill(tokens, updated, now, count, period):
+    """
+    Top up a bucket for the time since it was last touched
+    """
+    return min(count, tokens + (now - updated) * count / period)
+
+
+def spend(tokens, count, period):
+    """
+    Take one token; return (tokens left, seconds until one is available)
+    """
+    if tokens >= 1:
+        return tokens - 1, 0
+    return tokens, (1 - tokens) * period / count
+
+
+class CacheBuckets:
+    """
+    Buckets stored as (tokens, updated) tuples in a Django cache
+    """
+
+    def __init__(self, alias):
+        self.cache = caches[alias]
+
+    def take(self, key, count, period):
+        now = time.time()
+        state = self.cache.get(f'rl:{key}')
+        tokens = count if state is None else refill(*state, now, count, period)
+        tokens, retry_after = spend(tokens, count, period)
+        self.cache.set(f'rl:{key}', (tokens, now), timeout=period + 1)
+        return retry_after
+
+
+class SharedMemoryBuckets:
+    """
+    A fixed-size open-addressing table of buckets in a shared mmap.
+
+    Each slot is (key hash, tokens, last update). A key hashes to a home
+    slot and may live in any of the next PROBE slots; the whole window is
+    locked while it is read and updated. ``lockf`` only excludes other
+    processes, so threads in this process also share a lock; the critical
+    section is only a few struct reads and one write.
+    """
+    SLOT = struct.Struct('=Qdd')
+    PROBE = 4
+
+    def __init__(self, path, slots):
+        if slots <= self.PROBE:
+            raise ImproperlyConfigured('RATELIMIT_SHM_SLOTS is too small')
+        self.slots = slots
+        size = slots * self.SLOT.size
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        if os.fstat(fd).st_size != size:
+            # Sized once; every process maps the same table
+            os.ftruncate(fd, size)
+        self.fd = fd
+        self.map = mmap.mmap(fd, size)
+        self.lock = threading.Lock()
+
+    def take(self, key, count, period):
+        digest = hashlib.blake2b(key.encode(), digest_size=8).digest()
+        key_hash = int.from_bytes(digest, 'little') or 1  # 0 marks an empty slot
+        home = key_hash % (self.slots - self.PROBE)
+        start, length = home * self.SLOT.size, self.PROBE * self.SLOT.size
+
+        with self.lock:
+            fcntl.lockf(self.fd, fcntl.LOCK_EX, length, start)
+            try:
+                now = time.time()
+                slot, tokens = self.find(key_hash, home, now, count, period)
+                tokens, retry_after = spend(tokens, count, period)
+                self.SLOT.pack_into(self.map, slot * self.SLOT.size, key_hash, tokens, now)
+            finally:
+                fcntl.lockf(self.fd, fcntl.LOCK_UN, length, start)
+        return retry_after
+
+    def find(self, key_hash, home, now, count, period):
+        """
+        The key's slot and current token count, claiming a slot if needed
+        """
+        free = None
+        oldest, oldest_updated = home, math.inf
+        for slot in range(home, home + self.PROBE):
+            stored, tokens, updated = self.SLOT.unpack_from(self.map, slot * self.SLOT.size)
+            if stored == key_hash:
+                return slot, refill(tokens, updated, now, count, period)
+            # A bucket untouched for a full period has refilled and can go
+            if free is None and (stored == 0 or now - updated >= period):
+                free = slot
+            if updated < oldest_updated:
+                oldest, oldest_updated = slot, updated
+        return (oldest if free is None else free), count
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                if settings.RATELIMIT_STORE == 'shm':
+                    _store = SharedMemoryBuckets(settings.RATELIMIT_SHM_PATH, settings.RATELIMIT_SHM_SLOTS)
+                elif settings.RATELIMIT_STORE == 'cache':
+                    _store = CacheBuckets(settings.RATELIMIT_CACHE)
+                else:
+                    raise ImproperlyConfigured(f'Unknown RATELIMIT_STORE {settings.RATELIMIT_STORE!r}')
+    return _store
+
+
+class Rule:
+    """
+    The limits for one URL name, parsed from a RATE_LIMITS entry
+    """
+    SCOPES = ('user', 'ip')
+
+    def __init__(self, url_name, config):
+        self.url_name = url_name
+        self.limits = [(scope, *parse_rate(config[scope])) for scope in self.SCOPES if scope in config]
+        self.per_user = any(scope == 'user' for scope, *_ in self.limits)
+        self.methods = {m.upper() for m in config.get('methods', ())}
+        self.param = config.get('param')
+
+    def applies(self, request):
+        if self.methods and request.method not in self.methods:
+            return False
+        if self.param and not request.GET.get(self.param):
+            return False
+        return True
+
+    def check(self, request, store, user_id=None, scopes=SCOPES):
+        """
+        Spend a token from every bucket in scopes that applies; return the
+        longest wait if any of them is empty, else 0. user_id is the
+        signed-in user's pk, or None for anonymous clients.
+        """
+        wait = 0
+        for scope, count, period in self.limits:
+            if scope not in scopes:
+                continue
+            if scope == 'user' and user_id is not None:
+                ident = user_id
+            else:
+                ident = client_ip(request)
+            wait = max(wait, store.take(f'{self.url_name}:{scope}:{ident}', count, period))
+        return wait
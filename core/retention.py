@@ -0,0 +1,288 @@
+"""
+Retention for append-only event tables.
+
+A ``Policy`` names a model, its timestamp field and how many days of rows
+stay in the database; apps register theirs in a ``retention`` module. Each
+run of ``apply_retention`` takes the days older than that window, oldest
+first, in chunks that never cross a month boundary. For each chunk it:
+
+1. rolls the rows up into per-day aggregates with the policy's ``rollup``
+   (recomputed from the raw rows, so repeating it is harmless)
+2. writes the rows as gzip NDJSON to a new file under
+   ``RETENTION_ARCHIVE_DIR/<policy>/<YYYY-MM>/``. The file is written to a
+   temporary name and renamed into place; files below the watermark are
+   never touched again.
+3. records the chunk end as the policy's watermark in ``state.json``
+4. deletes the rows in batches of RETENTION_BATCH_SIZE, each its own
+   short transaction so live writers are never held up for long
+
+If a run stops part-way, the next one first finishes deleting below the
+watermark, then re-does any chunk whose archive write had not completed.
+Neither the rollups nor the archive end up counting a row twice.
+
+``read_archive`` streams archived rows back for audits without loading
+whole files, filtered by time range and field values.
+"""
+import fcntl
+import gzip
+import json
+import os
+import tempfile
+from datetime import date, datetime, time, timedelta
+from pathlib import Path
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+_policies = {}
+
+
+class ArchiveEncoder(DjangoJSONEncoder):
+    """
+    Keeps full timestamp precision, which DjangoJSONEncoder cuts to
+    milliseconds
+    """
+    def default(self, o):
+        if isinstance(o, datetime):
+            return o.isoformat()
+        return super().default(o)
+
+
+class Policy:
+    def __init__(self, name, model, time_field, keep_days, rollup=None):
+        """
+        ``rollup(start, end)`` aggregates the rows in [start, end) into
+        their summary tables; it is called before those rows are archived
+        """
+        self.name = name
+        self.model = model
+        self.time_field = time_field
+        self.keep_days = settings.RETENTION_DAYS.get(name, keep_days)
+        self.rollup = rollup
+
+    def __repr__(self):
+        return f'<Policy {self.name}: keep {self.keep_days} days of {self.model._meta.label}>'
+
+    @property
+    def directory(self):
+        return Path(settings.RETENTION_ARCHIVE_DIR) / self.name
+
+    def rows(self, start=None, end=None):
+        lookups = {}
+        if start is not None:
+            lookups[f'{self.time_field}__gte'] = start
+        if end is not None:
+            lookups[f'{self.time_field}__lt'] = end
+        return self.model._default_manager.filter(**lookups)
+
+    def cutoff(self):
+        """
+        The first day whose rows are kept
+        """
+        return timezone.localdate() - timedelta(days=self.keep_days)
+
+    # State
+
+    def watermark(self):
+        """
+        The first day not yet archived, or None before the first run
+        """
+        try:
+            with open(self.directory / 'state.json') as f:
+                return date.fromisoformat(json.load(f)['archived_before'])
+        except FileNotFoundError:
+            return None
+
+    def set_watermark(self, day):
+        write_atomically(self.directory / 'state.json', json.dumps({'archived_before': day.isoformat()}).encode())
+
+
+def register(policy):
+    _policies[policy.name] = policy
+    return policy
+
+
+def policies():
+    from django.utils.module_loading import autodiscover_modules
+
+    autodiscover_modules('retention')
+    return dict(_policies)
+
+
+def day_start(day):
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+def next_month(day):
+    return (day.replace(day=1) + timedelta(days=32)).replace(day=1)
+
+
+def write_atomically(path, data):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+def archive_rows(policy, start_day, end_day):
+    """
+    Write the rows of [start_day, end_day) to their month's partition and
+    return (path, row count)
+    """
+    fields = [field.attname for field in policy.model._meta.concrete_fields]
+    rows = policy.rows(day_start(start_day), day_start(end_day)).order_by('pk').values_list(*fields)
+    last_day = end_day - timedelta(days=1)
+    path = policy.directory / start_day.strftime('%Y-%m') / f'{start_day}_{last_day}.ndjson.gz'
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # A run that stopped before moving the watermark may have left a file
+    # for an overlapping range; its rows are all still in the table. It can
+    # start before start_day, which is the oldest row left, not the
+    # watermark.
+    for stale in path.parent.glob('*.ndjson.gz'):
+        if file_end(stale) >= start_day:
+            stale.unlink()
+    encoder = ArchiveEncoder(separators=(',', ':'))
+
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix='.tmp-')
+    count = 0
+    try:
+        with os.fdopen(fd, 'wb') as raw:
+            with gzip.GzipFile(fileobj=raw, mode='wb') as out:
+                for row in rows.iterator(chunk_size=settings.RETENTION_BATCH_SIZE):
+                    out.write(encoder.encode(dict(zip(fields, row))).encode())
+                    out.write(b'\n')
+                    count += 1
+            raw.flush()
+            os.fsync(raw.fileno())
+        if count:
+            os.replace(tmp, path)
+        else:
+            os.unlink(tmp)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+        raise
+    return (path if count else None), count
+
+
+def file_start(path):
+    return date.fromisoformat(path.name.split('_', 1)[0])
+
+
+def file_end(path):
+    """
+    The last day a partition file covers
+    """
+    return date.fromisoformat(path.name.split('_', 1)[1].split('.', 1)[0])
+
+
+def delete_before(policy, end, batch_size):
+    """
+    Delete rows older than end in small batches; return how many went
+    """
+    deleted = 0
+    queryset = policy.rows(end=end).order_by()
+    while True:
+        pks = list(queryset.values_list('pk', flat=True)[:batch_size])
+        if not pks:
+            return deleted
+        deleted += policy.model._default_manager.filter(pk__in=pks).delete()[0]
+
+
+def chunks(start_day, end_day):
+    """
+    [start, end) day ranges covering start_day..end_day, one per month
+    """
+    while start_day < end_day:
+        stop = min(next_month(start_day), end_day)
+        yield start_day, stop
+        start_day = stop
+
+
+def apply(policy, batch_size=None, dry_run=False, log=lambda message: None):
+    """
+    Bring one policy up to date; returns {'archived': rows, 'deleted': rows}
+    """
+    policy.directory.mkdir(parents=True, exist_ok=True)
+    with open(policy.directory / '.lock', 'w') as lock:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            raise RuntimeError(f'Retention for {policy.name} is already running') from None
+        return _apply(policy, batch_size or settings.RETENTION_BATCH_SIZE, dry_run, log)
+
+
+def _apply(policy, batch_size, dry_run, log):
+    stats = {'archived': 0, 'deleted': 0}
+    cutoff = policy.cutoff()
+    watermark = policy.watermark()
+
+    # Left over from a run that stopped while deleting
+    if watermark is not None and not dry_run:
+        stats['deleted'] += delete_before(policy, day_start(watermark), batch_size)
+
+    oldest = policy.rows(end=day_start(cutoff)).order_by(policy.time_field).values_list(
+        policy.time_field, flat=True
+    ).first()
+    if oldest is None:
+        return stats
+    start_day = timezone.localtime(oldest).date()
+    if watermark is not None:
+        start_day = max(start_day, watermark)
+
+    for chunk_start, chunk_end in chunks(start_day, cutoff):
+        if dry_run:
+            count = policy.rows(day_start(chunk_start), day_start(chunk_end)).count()
+            log(f'{policy.name}: would archive {count:,} row(s) from {chunk_start} to {chunk_end}')
+            stats['archived'] += count
+            continue
+        if policy.rollup:
+            policy.rollup(day_start(chunk_start), day_start(chunk_end))
+        path, count = archive_rows(policy, chunk_start, chunk_end)
+        policy.set_watermark(chunk_end)
+        deleted = delete_before(policy, day_start(chunk_end), batch_size)
+        stats['archived'] += count
+        stats['deleted'] += deleted
+        if count:
+            log(f'{policy.name}: archived {count:,} row(s) to {path}, deleted {deleted:,}')
+    return stats
+
+
+def read_archive(policy, start=None, end=None, match=None):
+    """
+    Stream archived rows (dicts) of one policy, oldest partition first.
+    ``start``/``end`` bound the timestamp field (aware datetimes);
+    ``match`` maps field names to values the row must equal as strings.
+    """
+    watermark = policy.watermark()
+    if watermark is None:
+        return
+    match = {field: str(value) for field, value in (match or {}).items()}
+    first_month = timezone.localtime(start).strftime('%Y-%m') if start else None
+    last_month = timezone.localtime(end).strftime('%Y-%m') if end else None
+    for month in sorted(p for p in policy.directory.iterdir() if p.is_dir()):
+        if (first_month and month.name < first_month) or (last_month and month.name > last_month):
+            continue
+        for path in sorted(month.glob('*.ndjson.gz')):
+            if file_start(path) >= watermark:
+                # Left by an interrupted run; the rows are still in the table
+                continue
+            with gzip.open(path, 'rt', encoding='utf-8') as f:
+                for line in f:
+                    row = json.loads(line)
+                    if start or end:
+                        moment = parse_datetime(row[policy.time_field])
+                        if (start and moment < start) or (end and moment >= end):
+                            continue
+                    if any(str(row.get(field)) != value for field, value in match.items()):
+                        continue
+                    yield row
@@ -0,0 +1,96 @@
+/*
+ * Subject dropdowns filtered client-side from the taxonomy document.
+ *
+ * A form opts in with data-taxonomy-url; its course, semester and subject
+ * selects are found by name. With data-taxonomy-strict, subjects are only
+ * offered once both a course and a semester are chosen (the upload form);
+ * otherwise either one narrows the list (the search form).
+ */
+(function () {
+    'use strict';
+
+    var documents = {};
+
+    function load(url) {
+        // One request per page; the browser revalidates with the ETag
+        if (!documents[url]) {
+            documents[url] = fetch(url, {credentials: 'same-origin'}).then(function (response) {
+                if (!response.ok) {
+                    throw new Error('taxonomy: ' + response.status);
+                }
+                return response.json();
+            });
+        }
+        return documents[url];
+    }
+
+    function subjectsFor(taxonomy, courseId, semesterId) {
+        var semesterNumbers = {};
+        taxonomy.semesters.forEach(function (semester) {
+            semesterNumbers[semester.id] = semester.number;
+        });
+        var found = [];
+        taxonomy.courses.forEach(function (course) {
+            if (courseId && String(course.id) !== courseId) {
+                return;
+            }
+            Object.keys(course.semesters).forEach(function (id) {
+                if (semesterId && id !== semesterId) {
+                    return;
+                }
+                course.semesters[id].forEach(function (subject) {
+                    found.push({subject: subject, course: course, semester: semesterNumbers[id]});
+                });
+            });
+        });
+        return found;
+    }
+
+    function bind(form) {
+        var course = form.querySelector('select[name="course"]');
+        var semester = form.querySelector('select[name="semester"]');
+        var subject = form.querySelector('select[name="subject"]');
+        if (!course || !semester || !subject) {
+            return;
+        }
+        var strict = form.hasAttribute('data-taxonomy-strict');
+        var emptyLabel = subject.options.length && subject.options[0].value === '' ? subject.options[0].text : '---------';
+
+        function render(taxonomy) {
+            var courseId = course.value;
+            var semesterId = semester.value;
+            var current = subject.selectedIndex > 0 ? subject.options[subject.selectedIndex] : null;
+            subject.options.length = 0;
+            subject.add(new Option(emptyLabel, ''));
+            // Listing every subject would rebuild the page-sized dropdown
+            // this replaces, so wait for something to narrow it down
+            if (strict ? !(courseId && semesterId) : !(courseId || semesterId)) {
+                if (current && !strict) {
+                    subject.add(new Option(current.text, current.value, true, true));
+                }
+                return;
+            }
+            subjectsFor(taxonomy, courseId, semesterId).forEach(function (item) {
+                var label = item.subject.code + ' - ' + item.subject.name;
+                if (!(courseId && semesterId)) {
+                    label += ' (' + item.course.code + ', Sem ' + item.semester + ')';
+                }
+                var value = String(item.subject.id);
+                var selected = current !== null && value === current.value;
+                subject.add(new Option(label, value, selected, selected));
+            });
+        }
+
+        var taxonomy = load(form.getAttribute('data-taxonomy-url'));
+        taxonomy.then(render).catch(function () {
+            // Keep the server-rendered options
+        });
+        [course, semester].forEach(function (select) {
+            select.addEventListener('change', function () {
+                taxonomy.then(render);
+            });
+        });
+    }
+
+    document.querySelectorAll('form[data-taxonomy-url]').forEach(bind);
+})();
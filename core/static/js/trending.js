@@ -0,0 +1,55 @@
+/*
+ * Trending notes on the catalog, loaded from the trending API so the page
+ * itself stays cacheable while the ranking moves.
+ *
+ * The box is marked with data-trending-url; the page's course, semester
+ * and subject filter is passed on from the query string. data-note-url is
+ * the detail URL of note 0, used as a template for the links.
+ */
+(function () {
+    'use strict';
+
+    var box = document.querySelector('[data-trending-url]');
+    if (!box) {
+        return;
+    }
+    var params = new URLSearchParams(window.location.search);
+    var query = new URLSearchParams({
+        fields: 'id,title,download_count',
+        limit: box.getAttribute('data-trending-limit') || '5'
+    });
+    ['course', 'semester', 'subject'].forEach(function (name) {
+        var value = params.get(name);
+        if (value && /^\d+$/.test(value)) {
+            query.set(name, value);
+        }
+    });
+
+    fetch(box.getAttribute('data-trending-url') + '?' + query, {credentials: 'same-origin'}).then(function (response) {
+        if (!response.ok) {
+            throw new Error('trending: ' + response.status);
+        }
+        return response.json();
+    }).then(function (payload) {
+        if (!payload.data.length) {
+            return;
+        }
+        var list = box.querySelector('ol');
+        var noteUrl = box.getAttribute('data-note-url');
+        payload.data.forEach(function (note) {
+            var item = document.createElement('li');
+            var link = document.createElement('a');
+            link.href = noteUrl.replace('/0/', '/' + note.id + '/');
+            link.textContent = note.title;
+            item.appendChild(link);
+            var count = document.createElement('small');
+            count.className = 'text-muted ms-2';
+            count.textContent = note.download_count + ' downloads';
+            item.appendChild(count);
+            list.appendChild(item);
+        });
+        box.classList.remove('d-none');
+    }).catch(function () {
+        // The box stays hidden
+    });
+})();
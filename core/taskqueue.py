@@ -0,0 +1,239 @@
+"""
+A small database-backed task queue.
+
+Functions decorated with ``@task`` (in any app's ``tasks.py``) can be
+deferred from a view with ``func.defer(*args, **kwargs)``, which inserts a
+``Task`` row and returns immediately. ``manage.py run_tasks`` claims due
+tasks in batches, highest priority first, and runs them on a thread or
+process pool. A task that raises is retried with exponential backoff until
+``max_attempts`` is reached, then left in the ``failed`` state for
+inspection in the admin. Successful tasks are deleted in batches, so the
+table only holds pending and dead work. Delivery is at-least-once: a
+worker that dies after running a task but before deleting it leaves the
+task to be rerun once its lock times out, so tasks should be idempotent or
+tolerate the odd duplicate.
+
+Claiming works without SELECT ... FOR UPDATE (SQLite has none): a single
+UPDATE flips the next due rows to ``running`` and tags them with a fresh
+claim token, and the worker loads back only the rows carrying its token.
+Two workers can never claim the same task. Workers only claim as many
+tasks as they have idle slots, so a claimed task starts at once. One
+still running after TASK_LOCK_TIMEOUT is taken to be from a dead worker,
+and it is requeued and may run again. Its first worker then finds its
+token gone and leaves the row alone.
+
+With ``TASKS_EAGER`` on (the default outside production) deferred calls
+run inline once the surrounding transaction commits, so development needs
+no worker. Their queries are left out of the request's query budget, as
+production queues the same call with a single INSERT.
+"""
+import logging
+import random
+import time
+import traceback
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+
+from . import metrics, querycount
+
+logger = logging.getLogger(__name__)
+
+_registry = {}
+
+
+class TaskFunction:
+    """
+    A registered task; call it directly or defer it to a worker
+    """
+
+    def __init__(self, func, name, priority, max_attempts):
+        self.func = func
+        self.name = name
+        self.priority = priority
+        self.max_attempts = max_attempts
+        self.__doc__ = func.__doc__
+        self.__wrapped__ = func
+
+    def __call__(self, *args, **kwargs):
+        return self.func(*args, **kwargs)
+
+    def __repr__(self):
+        return f'<task {self.name}>'
+
+    def defer(self, *args, **kwargs):
+        """
+        Queue a call with the task's default priority, due now
+        """
+        return enqueue(self, args, kwargs)
+
+
+def task(func=None, *, name=None, priority=0, max_attempts=None):
+    """
+    Register a function as a task. Arguments must be JSON-serializable.
+    """
+    def register(func):
+        task_name = name or f'{func.__module__}.{func.__qualname__}'
+        attempts = max_attempts or settings.TASK_MAX_ATTEMPTS
+        registered = _registry[task_name] = TaskFunction(func, task_name, priority, attempts)
+        return registered
+
+    return register(func) if func is not None else register
+
+
+def get_task(name):
+    try:
+        return _registry[name]
+    except KeyError:
+        raise LookupError(f'No task registered as {name!r}') from None
+
+
+def _run_eagerly(task_function, args, kwargs):
+    with querycount.background():
+        task_function(*args, **kwargs)
+
+
+def enqueue(task_function, args=(), kwargs=None, *, priority=None, run_at=None, delay=None):
+    """
+    Queue a call to a registered task. ``run_at`` or ``delay`` (seconds)
+    schedule it for later; ``priority`` overrides the task's default.
+    Returns the Task row, or None when the call ran eagerly.
+    """
+    from .models import Task
+
+    kwargs = kwargs or {}
+    if settings.TASKS_EAGER and run_at is None and delay is None:
+        transaction.on_commit(lambda: _run_eagerly(task_function, args, kwargs))
+        return None
+
+    if run_at is None:
+        run_at = timezone.now() + timedelta(seconds=delay or 0)
+    return Task.objects.create(
+        name=task_function.name,
+        args=list(args),
+        kwargs=kwargs,
+        priority=task_function.priority if priority is None else priority,
+        max_attempts=task_function.max_attempts,
+        run_at=run_at,
+    )
+
+
+def retry_delay(attempts):
+    """
+    Seconds to wait before the next attempt: exponential, capped, jittered
+    """
+    base = settings.TASK_RETRY_BASE_DELAY * 2 ** (attempts - 1)
+    return min(base, settings.TASK_RETRY_MAX_DELAY) * random.uniform(0.5, 1.5)
+
+
+def release_stale(now=None):
+    """
+    Put tasks back in the queue whose worker died while running them
+    """
+    from .models import Task
+
+    now = now or timezone.now()
+    cutoff = now - timedelta(seconds=settings.TASK_LOCK_TIMEOUT)
+    return Task.objects.filter(status=Task.RUNNING, locked_at__lt=cutoff).update(
+        status=Task.QUEUED, locked_by='', locked_at=None, run_at=now,
+    )
+
+
+def claim(worker_id, limit):
+    """
+    Lock up to ``limit`` due tasks for this worker and return them
+    """
+    from .models import Task
+
+    now = timezone.now()
+    token = f'{worker_id}:{uuid.uuid4().hex[:12]}'
+    due = (
+        Task.objects.filter(status=Task.QUEUED, run_at__lte=now)
+        .order_by('-priority', 'run_at')
+        .values('pk')[:limit]
+    )
+    # One statement, so SQLite never has to upgrade a read lock mid-claim
+    claimed = Task.objects.filter(pk__in=due, status=Task.QUEUED).update(
+        status=Task.RUNNING, locked_by=token, locked_at=now,
+    )
+    if not claimed:
+        return []
+    return list(Task.objects.filter(locked_by=token).order_by('-priority', 'run_at'))
+
+
+def execute(task_row):
+    """
+    Run one claimed task and record a failure or retry. Never raises;
+    returns 'success', 'retry' or 'failed'.
+    """
+    from .models import Task
+
+    close_old_connections()
+    start = time.perf_counter()
+    attempts = task_row.attempts + 1
+    owned = Task.objects.filter(pk=task_row.pk, locked_by=task_row.locked_by)
+    try:
+        get_task(task_row.name).func(*task_row.args, **task_row.kwargs)
+    except Exception as exc:
+        error = ''.join(traceback.format_exception(exc))
+        if attempts >= task_row.max_attempts:
+            outcome = 'failed'
+            owned.update(status=Task.FAILED, attempts=attempts, last_error=error,
+                         locked_by='', locked_at=None)
+            logger.error('Task %s (%s) failed for good after %d attempts',
+                         task_row.name, task_row.pk, attempts, exc_info=exc)
+        else:
+            outcome = 'retry'
+            owned.update(status=Task.QUEUED, attempts=attempts, last_error=error,
+                         locked_by='', locked_at=None,
+                         run_at=timezone.now() + timedelta(seconds=retry_delay(attempts)))
+            logger.warning('Task %s (%s) failed, attempt %d of %d: %s',
+                           task_row.name, task_row.pk, attempts, task_row.max_attempts, exc)
+    else:
+        # Deleted in bulk by the worker loop, see complete()
+        outcome = 'success'
+    finally:
+        close_old_connections()
+
+    if settings.METRICS_ENABLED:
+        elapsed = time.perf_counter() - start
+        metrics.inc('noteghar_tasks_total', task=task_row.name, outcome=outcome)
+        metrics.observe('noteghar_task_duration_seconds', elapsed, task=task_row.name)
+        metrics.flush()
+    return outcome
+
+
+def complete(claims):
+    """
+    Drop tasks that ran successfully, given as (pk, claim token) pairs,
+    one DELETE per claim. A task requeued since and claimed again carries
+    another token and is kept.
+    """
+    from .models import Task
+
+    by_token = {}
+    for pk, token in claims:
+        by_token.setdefault(token, []).append(pk)
+    for token, pks in by_token.items():
+        Task.objects.filter(pk__in=pks, locked_by=token).delete()
+
+
+def record_queue_stats():
+    """
+    Publish queue depth and the age of the oldest due task
+    """
+    from django.db.models import Count, Min
+
+    from .models import Task
+
+    now = timezone.now()
+    depth = dict.fromkeys((status for status, _ in Task.STATUS_CHOICES), 0)
+    for row in Task.objects.values('status').annotate(n=Count('pk')):
+        depth[row['status']] = row['n']
+    for status, n in depth.items():
+        metrics.set_gauge('noteghar_task_queue_depth', n, status=status)
+    oldest = Task.objects.filter(status=Task.QUEUED, run_at__lte=now).aggregate(Min('run_at'))['run_at__min']
+    metrics.set_gauge('noteghar_task_lag_seconds', (now - oldest).total_seconds() if oldest else 0)
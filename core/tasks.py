@@ -0,0 +1,32 @@
+from django.core.mail import EmailMultiAlternatives, get_connection
+
+from .taskqueue import task
+
+
+@task(priority=10)
+def send_email(subject, body, from_email, to, alternatives=(), headers=None, content_subtype='plain'):
+    """
+    Send one message outside the request that triggered it
+    """
+    message = EmailMultiAlternatives(
+        subject, body, from_email, to, headers=headers or {}, connection=get_connection(),
+    )
+    message.content_subtype = content_subtype
+    for content, mimetype in alternatives:
+        message.attach_alternative(content, mimetype)
+    message.send()
+
+
+def defer_email(message):
+    """
+    Queue an already-rendered EmailMessage for delivery by a worker
+    """
+    return send_email.defer(
+        message.subject,
+        message.body,
+        message.from_email,
+        list(message.to),
+        alternatives=[list(alt) for alt in getattr(message, 'alternatives', [])],
+        headers=dict(message.extra_headers),
+        content_subtype=message.content_subtype,
+    )
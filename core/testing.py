@@ -0,0 +1,45 @@
+"""
+Test helpers for enforcing per-view query budgets.
+
+Usage::
+
+    class NoteDetailTests(QueryBudgetTestCase):
+        def test_detail_budget(self):
+            self.client.get(reverse('notes:detail', args=[note.pk]))
+
+Every request made through the test client inside a QueryBudgetTestCase is
+checked against ``settings.QUERY_BUDGETS`` by QueryCountMiddleware, so a
+view that regresses fails the test that exercises it.
+"""
+from contextlib import contextmanager
+
+from django.test import TestCase, override_settings
+
+from .querycount import QueryRecorder, check_budget
+
+
+@override_settings(QUERY_BUDGET_STRICT=True)
+class QueryBudgetTestCase(TestCase):
+    """
+    TestCase that fails any request exceeding its URL's query budget
+    """
+
+    @contextmanager
+    def assertQueryBudget(self, url_name, budget=None):
+        """
+        Assert the block stays within ``budget`` queries, or the declared
+        budget for ``url_name`` when no explicit budget is given
+        """
+        with QueryRecorder() as recorder:
+            yield recorder
+        if budget is None:
+            check_budget(url_name, recorder)
+        elif recorder.count > budget:
+            self.fail(f"{url_name} ran {recorder.count} queries (budget {budget})")
+
+    def assertNoNPlusOne(self, response):
+        """
+        Assert the request behind ``response`` repeated no SQL shape
+        """
+        suspects = response.wsgi_request.query_recorder.n_plus_one_suspects()
+        self.assertFalse(suspects, f"Possible N+1 queries: {suspects}")
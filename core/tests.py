@@ -1,3 +1,320 @@
-from django.test import TestCase
+import json
+import os
+import subprocess
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from unittest import mock
+from io import StringIO
+from pathlib import Path
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
+from django.http import HttpResponse
+from django.middleware.csrf import get_token
+from django.test import Client, RequestFactory, TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from notes.tests import make_note, make_subject
+
+from . import metrics, pagecache, querycount, taskqueue, versions
+from .models import Task
+
+
+class TaskQueueTests(TestCase):
+    def test_requeued_task_is_only_completed_by_its_new_claim(self):
+        Task.objects.create(name='notes.tasks.index_note', args=[1])
+        first, = taskqueue.claim('worker-a', 5)
+        # Worker a stalls past the lock timeout and the task goes to b
+        Task.objects.update(locked_at=timezone.now() - timedelta(seconds=settings.TASK_LOCK_TIMEOUT + 1))
+        self.assertEqual(taskqueue.release_stale(), 1)
+        second, = taskqueue.claim('worker-b', 5)
+
+        taskqueue.complete([(first.pk, first.locked_by)])
+        self.assertTrue(Task.objects.filter(pk=first.pk, locked_by=second.locked_by).exists())
+        taskqueue.complete([(second.pk, second.locked_by)])
+        self.assertFalse(Task.objects.exists())
+
+
+
+class VersionTests(TestCase):
+    def test_bump_many_is_two_statements(self):
+        versions.bump('catalog')
+        with self.assertNumQueries(2):
+            versions.bump_many(['catalog', 'subject:1', 'course:1', 'catalog'])
+        self.assertEqual(versions.current_many(['catalog', 'subject:1', 'course:1', 'semester:1']), {
+            'catalog': 2, 'subject:1': 1, 'course:1': 1, 'semester:1': 0,
+        })
+
+class QueryRecorderTests(TestCase):
+    def test_eager_task_queries_are_kept_out_of_the_count(self):
+        with override_settings(TASKS_EAGER=True), querycount.QueryRecorder() as recorder:
+            Task.objects.exists()
+            with self.captureOnCommitCallbacks(execute=True):
+                taskqueue.enqueue(Task.objects.exists)
+        self.assertEqual(recorder.count, 1)
+        self.assertEqual(len(recorder.background_queries), 1)
+
+
+@override_settings(METRICS_DIR=tempfile.mkdtemp())
+class MetricsTests(TestCase):
+    def total(self, counters, task):
+        return counters[('noteghar_tasks_total', (('outcome', 'success'), ('task', task)))]
+
+    def test_shards_of_exited_threads_are_folded(self):
+        labels = {'task': 'fold', 'outcome': 'success'}
+        threads = [
+            threading.Thread(target=metrics.inc, args=('noteghar_tasks_total',), kwargs=labels) for _ in range(20)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        metrics.flush(force=True)
+        self.assertTrue(all(thread.is_alive() for thread, shard in metrics._shards))
+        counters, histograms, gauges = metrics.collect()
+        self.assertEqual(self.total(counters, 'fold'), 20)
+
+    def test_snapshots_of_exited_processes_are_retired(self):
+        process = subprocess.Popen(['true'])
+        process.wait()
+        path = os.path.join(settings.METRICS_DIR, f'{process.pid}.json')
+        with open(path, 'w') as fh:
+            json.dump({
+                'counters': [['noteghar_tasks_total', [['outcome', 'success'], ['task', 'dead']], 5]],
+                'histograms': [],
+                'gauges': [['noteghar_task_lag_seconds', [], 30]],
+            }, fh)
+        for _ in range(2):
+            counters, histograms, gauges = metrics.collect()
+            self.assertEqual(self.total(counters, 'dead'), 5)
+        self.assertFalse(os.path.exists(path))
+        self.assertNotIn(('noteghar_task_lag_seconds', ()), gauges)
+
+    @override_settings(METRICS_TOKEN='s3cret', METRICS_ALLOWED_IPS=['127.0.0.1'])
+    def test_scrape_needs_token_behind_a_proxy(self):
+        url = reverse('core:metrics')
+        proxied = {'HTTP_X_FORWARDED_FOR': '203.0.113.9'}
+        self.assertEqual(self.client.get(url).status_code, 200)
+        self.assertEqual(self.client.get(url, **proxied).status_code, 403)
+        self.assertEqual(self.client.get(url, HTTP_AUTHORIZATION='Bearer wrong', **proxied).status_code, 403)
+        self.assertEqual(self.client.get(url, HTTP_AUTHORIZATION='Bearer s3cret', **proxied).status_code, 200)
+
+
+@override_settings(RATELIMIT_ENABLED=True, RATE_LIMITS={'notes:list': {'user': '2/m', 'param': 'query'}})
+class RateLimitTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_user_bucket_is_shared_across_sessions(self):
+        user = get_user_model().objects.create_user('reader', password='x')
+        first, second = Client(), Client()
+        first.force_login(user)
+        second.force_login(user)
+        url = reverse('notes:list') + '?query=calculus'
+        self.assertEqual([first.get(url).status_code for _ in range(2)], [200, 200])
+        # A fresh session (or dropped cookie) does not get a fresh bucket
+        self.assertEqual(second.get(url).status_code, 429)
+        # Anonymous clients are limited per IP instead
+        self.assertEqual(self.client.get(url).status_code, 200)
+
+    def test_throttled_requests_run_no_queries(self):
+        self.client.force_login(get_user_model().objects.create_user('reader', password='x'))
+        url = reverse('notes:list') + '?query=calculus'
+        self.assertEqual([self.client.get(url).status_code for _ in range(2)], [200, 200])
+        # The user id now comes from the signed cookie
+        self.assertIn(settings.RATELIMIT_USER_COOKIE, self.client.cookies)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(url).status_code, 429)
+
+    @override_settings(RATE_LIMITS={'notes:list': {'user': '5/m', 'ip': '1/m', 'param': 'query'}})
+    def test_ip_is_checked_before_the_user_is_loaded(self):
+        self.client.force_login(get_user_model().objects.create_user('reader', password='x'))
+        url = reverse('notes:list') + '?query=calculus'
+        self.assertEqual(self.client.get(url).status_code, 200)
+        # Without the signed cookie (or with a forged one) the user would
+        # have to be loaded, but the IP bucket turns the request away first
+        self.client.cookies[settings.RATELIMIT_USER_COOKIE] = 'forged'
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(url).status_code, 429)
+
+
+class MediaCollectorTests(TestCase):
+    def setUp(self):
+        self.root = Path(tempfile.mkdtemp())
+        self.enterContext(override_settings(MEDIA_ROOT=self.root, MEDIA_GC_GRACE_HOURS=24))
+        user = get_user_model().objects.create_user('uploader', password='x', profile_picture='profiles/me.png')
+        make_note(user, make_subject(), file='notes/2026/01/kept.pdf')
+        # Rows in any state hold on to their files
+        make_note(user, make_subject('CS102'), status='deleted', file='notes/2026/01/deleted.pdf')
+        old = time.time() - 2 * 24 * 3600
+        for name in (
+            'profiles/me.png', 'profiles/replaced.png', 'notes/2026/01/kept.pdf', 'notes/2026/01/deleted.pdf',
+            'notes/2026/01/orphan.pdf', 'notes/2026/02/orphan.pdf', 'notes/2026/02/uploading.pdf',
+        ):
+            path = self.root / name
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_bytes(b'data')
+            if name != 'notes/2026/02/uploading.pdf':
+                os.utime(path, (old, old))
+
+    def files(self):
+        return sorted(str(path.relative_to(self.root)) for path in self.root.rglob('*') if path.is_file())
+
+    def test_only_old_unreferenced_files_are_deleted(self):
+        call_command('collect_media', stdout=StringIO())
+        self.assertEqual(self.files(), [
+            'notes/2026/01/deleted.pdf', 'notes/2026/01/kept.pdf', 'notes/2026/02/uploading.pdf', 'profiles/me.png',
+        ])
+
+    def test_dry_run_deletes_nothing(self):
+        before = self.files()
+        out = StringIO()
+        call_command('collect_media', dry_run=True, stdout=out)
+        self.assertEqual(self.files(), before)
+        self.assertIn('3 orphan(s) of 7 file(s)', out.getvalue())
+
+
+@override_settings(PAGE_CACHE_ENABLED=True)
+class PageCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.uploader = get_user_model().objects.create_user('uploader', password='x')
+        self.subject, self.other = make_subject(), make_subject('CS102')
+        self.note = make_note(self.uploader, self.subject, title='Entropy basics')
+        self.pages = [reverse('notes:list'), reverse('notes:list') + f'?subject={self.subject.pk}']
+
+    def fetch(self, url, client=None):
+        response = (client or self.client).get(url)
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def assertCached(self):
+        for url in self.pages:
+            self.fetch(url)
+            self.assertEqual(self.fetch(url)['X-Page-Cache'], 'hit')
+
+    def assertRebuilt(self, contains=(), excludes=()):
+        for url in self.pages:
+            with self.subTest(url):
+                response = self.fetch(url)
+                self.assertEqual(response['X-Page-Cache'], 'miss')
+                for text in contains:
+                    self.assertContains(response, text)
+                for text in excludes:
+                    self.assertNotContains(response, text)
+
+    def test_approving_a_note_invalidates_its_pages(self):
+        pending = make_note(self.uploader, self.subject, status='pending', title='Heat engines')
+        self.assertCached()
+        pending.status = 'approved'
+        pending.save()
+        self.assertRebuilt(contains=['Heat engines'])
+
+    def test_editing_a_note_invalidates_its_pages(self):
+        self.assertCached()
+        self.note.title = 'Entropy revisited'
+        self.note.save()
+        self.assertRebuilt(contains=['Entropy revisited'], excludes=['Entropy basics'])
+
+    def test_deleting_a_note_invalidates_its_pages(self):
+        for delete in ('soft_delete', 'delete'):
+            with self.subTest(delete):
+                note = make_note(self.uploader, self.subject, title=f'Doomed {delete}')
+                self.assertCached()
+                getattr(note, delete)()
+                self.assertRebuilt(excludes=[f'Doomed {delete}'])
+
+    def test_other_subjects_pages_are_kept(self):
+        self.assertCached()
+        make_note(self.uploader, self.other, title='Sonnets').save()
+        self.assertEqual(self.fetch(self.pages[1])['X-Page-Cache'], 'hit')
+        self.assertEqual(self.fetch(self.pages[0])['X-Page-Cache'], 'miss')
+
+    def test_signed_in_users_bypass_the_cache(self):
+        self.assertCached()
+        signed_in = Client()
+        signed_in.force_login(self.uploader)
+        for url in self.pages:
+            for _ in range(2):
+                self.assertNotIn('X-Page-Cache', self.fetch(url, signed_in))
+
+    def test_pages_with_a_csrf_token_are_not_stored(self):
+        calls = []
+
+        @pagecache.cache_anonymous_page(lambda request: [])
+        def form_view(request):
+            calls.append(request)
+            return HttpResponse(get_token(request))
+
+        for _ in range(2):
+            response = form_view(RequestFactory().get('/form/'))
+            self.assertNotIn('X-Page-Cache', response)
+        self.assertEqual(len(calls), 2)
+
+
+@override_settings(PAGE_CACHE_ENABLED=True, PAGE_CACHE_WAIT=5)
+class PageCacheFlightTests(TestCase):
+    """
+    Concurrent requests for a page being rebuilt; tag versions are pinned
+    so the other threads never touch the test database
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.tags = {'tag': 1}
+        self.enterContext(mock.patch.object(pagecache.versions, 'current_many', lambda names: dict(self.tags)))
+        self.calls = 0
+        self.entered, self.release = threading.Event(), threading.Event()
+
+        @pagecache.cache_anonymous_page(lambda request: ['tag'])
+        def slow_view(request):
+            self.calls += 1
+            self.entered.set()
+            self.release.wait(5)
+            return HttpResponse(f'render {self.calls}')
+
+        self.view = slow_view
+
+    def concurrently(self):
+        """
+        Start a rebuild, make a second request while it runs, and return
+        both responses
+        """
+        responses = {}
+        leader = threading.Thread(target=lambda: responses.setdefault('leader', self.view(self.request())))
+        leader.start()
+        self.entered.wait(5)
+        follower = threading.Thread(target=lambda: responses.setdefault('follower', self.view(self.request())))
+        follower.start()
+        # Let the follower reach the flight before the leader lands
+        time.sleep(0.1)
+        self.release.set()
+        leader.join()
+        follower.join()
+        return responses['leader'], responses['follower']
+
+    def request(self):
+        return RequestFactory().get('/page/')
+
+    def test_missing_page_is_rendered_once(self):
+        leader, follower = self.concurrently()
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(leader['X-Page-Cache'], 'miss')
+        self.assertEqual(follower['X-Page-Cache'], 'hit')
+        self.assertEqual(follower.content, b'render 1')
+
+    def test_stale_page_is_served_while_rebuilt(self):
+        self.release.set()
+        self.view(self.request())
+        self.entered.clear()
+        self.release.clear()
+        self.tags['tag'] = 2
+        leader, follower = self.concurrently()
+        self.assertEqual(self.calls, 2)
+        self.assertEqual((leader.content, follower.content), (b'render 2', b'render 1'))
+        self.assertEqual(follower['X-Page-Cache'], 'stale')
@@ -6,4 +6,5 @@ app_name = 'core'
 urlpatterns = [
     path('', views.home_view, name='home'),
     path('dashboard/', views.dashboard_view, name='dashboard'),
+    path('metrics/', views.metrics_view, name='metrics'),
 ]
\ No newline at end of file
@@ -0,0 +1,54 @@
+"""
+Named content versions for cache validation.
+
+``bump('catalog')`` after anything that changes what a set of pages shows;
+``current('catalog')`` is a single primary-key lookup returning the value
+and time of the last bump, ready to go into an ETag and Last-Modified.
+A job whose output follows a source table can ``set_value`` its position
+in that table instead, which serves the same purpose.
+"""
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Version
+
+
+def current(name):
+    """
+    (value, updated_at) for a version, (0, None) if it was never bumped
+    """
+    row = Version.objects.filter(name=name).values_list('value', 'updated_at').first()
+    return row or (0, None)
+
+
+def current_many(names):
+    """
+    {name: value} for several versions in one query
+    """
+    found = dict(Version.objects.filter(name__in=names).values_list('name', 'value'))
+    return {name: found.get(name, 0) for name in names}
+
+
+def bump(name):
+    bump_many([name])
+
+
+def bump_many(names):
+    """
+    Bump several versions with one INSERT and one UPDATE, however many
+    """
+    names = sorted(set(names))
+    now = timezone.now()
+    # A missing row starts at 0, the same as never bumped, so a concurrent
+    # bump creating it first loses nothing
+    Version.objects.bulk_create(
+        [Version(name=name, value=0, updated_at=now) for name in names], ignore_conflicts=True
+    )
+    Version.objects.filter(name__in=names).update(value=F('value') + 1, updated_at=now)
+
+
+def set_value(name, value):
+    """
+    Store a value directly, e.g. a high-water mark that only moves forward
+    """
+    Version.objects.update_or_create(name=name, defaults={'value': value, 'updated_at': timezone.now()})
@@ -1,8 +1,19 @@
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
 from django.shortcuts import render
+from django.utils.crypto import constant_time_compare
 from django.contrib.auth.decorators import login_required
+from notes import trending
 from notes.models import Note, Download
-from django.db.models import Count
+from django.db.models import Count, Q, Sum
+from . import metrics
+from .pagecache import cache_anonymous_page
 
+def _no_tags(request):
+    return []
+
+
+@cache_anonymous_page(_no_tags)
 def home_view(request):
     """
     Homepage view - shows landing page for guests, dashboard for logged-in users
@@ -20,33 +31,51 @@ def dashboard_view(request):
     user = request.user
     
     # Get user's notes stats
-    my_notes = Note.objects.filter(uploaded_by=user)
-    total_notes = my_notes.count()
-    approved_notes = my_notes.filter(status='approved').count()
-    pending_notes = my_notes.filter(status='pending').count()
-    rejected_notes = my_notes.filter(status='rejected').count()
-    
-    # Total downloads of user's notes
-    total_downloads = sum(note.download_count for note in my_notes)
+    my_notes = Note.objects.filter(uploaded_by=user).exclude(status='deleted')
+    stats = my_notes.aggregate(
+        total_notes=Count('id'),
+        approved_notes=Count('id', filter=Q(status='approved')),
+        pending_notes=Count('id', filter=Q(status='pending')),
+        rejected_notes=Count('id', filter=Q(status='rejected')),
+        total_downloads=Sum('download_count'),
+    )
     
     # Recent downloads by user
-    recent_downloads = Download.objects.filter(user=user).select_related('note').order_by('-downloaded_at')[:5]
+    recent_downloads = Download.objects.filter(user=user).exclude(note__status='deleted').select_related(
+        'note__subject'
+    ).order_by('-downloaded_at')[:5]
     
     # Recent uploads
-    recent_uploads = my_notes.order_by('-created_at')[:5]
+    recent_uploads = my_notes.select_related('subject').order_by('-created_at')[:5]
     
-    # Most downloaded notes 
-    popular_notes = Note.objects.filter(status='approved').order_by('-download_count')[:5]
+    # Trending across the site, read from its precomputed ranking
+    popular_notes = trending.notes(trending.GLOBAL, 5, Note.objects.select_related('subject'))
     
     context = {
-        'total_notes': total_notes,
-        'approved_notes': approved_notes,
-        'pending_notes': pending_notes,
-        'rejected_notes': rejected_notes,
-        'total_downloads': total_downloads,
+        **stats,
+        'total_downloads': stats['total_downloads'] or 0,
         'recent_downloads': recent_downloads,
         'recent_uploads': recent_uploads,
         'popular_notes': popular_notes,
     }
     
     return render(request, 'core/dashboard.html', context)
+
+
+def metrics_allowed(request):
+    token = settings.METRICS_TOKEN
+    header = request.headers.get('Authorization', '')
+    if token and header.startswith('Bearer ') and constant_time_compare(header[len('Bearer '):], token):
+        return True
+    if 'X-Forwarded-For' not in request.headers and request.META.get('REMOTE_ADDR') in settings.METRICS_ALLOWED_IPS:
+        return True
+    return request.user.is_staff
+
+
+def metrics_view(request):
+    """
+    Prometheus scrape endpoint, merged across all worker processes
+    """
+    if not metrics_allowed(request):
+        return HttpResponseForbidden()
+    return HttpResponse(metrics.render_prometheus(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,16 @@
+from django.utils.dateparse import parse_datetime
+
+from core.taskqueue import task
+from notes.models import ModerationAction
+
+
+@task
+def log_moderation_action(moderator_id, action_type, reason, created_at, note_id=None, report_id=None):
+    ModerationAction.objects.create(
+        moderator_id=moderator_id,
+        action_type=action_type,
+        reason=reason,
+        note_id=note_id,
+        report_id=report_id,
+        created_at=parse_datetime(created_at),
+    )
@@ -5,10 +5,12 @@
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required, user_passes_test
 from django.contrib import messages
+from django.http import Http404
 from django.utils import timezone
 from django.db.models import Count, Q, Avg
 from notes.models import Note, Report, Rating, Download, ModerationAction
 from accounts.models import User
+from .tasks import log_moderation_action
 
 def is_moderator(user):
     """Check if user is moderator or admin"""
@@ -20,10 +22,6 @@ def moderator_dashboard(request):
     """
     Enhanced moderator dashboard with comprehensive statistics
     """
-    # Pending content counts
-    pending_notes = Note.objects.filter(status='pending')
-    pending_reports = Report.objects.filter(status='pending')
-    
     # Recent activity
     recent_notes = Note.objects.filter(status='pending').select_related(
         'uploaded_by', 'subject', 'course', 'semester'
@@ -35,23 +33,39 @@ def moderator_dashboard(request):
     
     # Moderator statistics
     if request.user.role == 'moderator':
-        my_actions = ModerationAction.objects.filter(moderator=request.user)
-        my_actions_count = my_actions.count()
-        my_approvals = my_actions.filter(action_type='approve').count()
-        my_rejections = my_actions.filter(action_type='reject').count()
+        my_actions = ModerationAction.objects.filter(moderator=request.user).aggregate(
+            count=Count('id'),
+            approvals=Count('id', filter=Q(action_type='approve')),
+            rejections=Count('id', filter=Q(action_type='reject')),
+        )
+        my_actions_count = my_actions['count']
+        my_approvals = my_actions['approvals']
+        my_rejections = my_actions['rejections']
     else:
         my_actions_count = 0
         my_approvals = 0
         my_rejections = 0
     
-    # Overall statistics
-    total_notes = Note.objects.count()
-    approved_notes = Note.objects.filter(status='approved').count()
-    rejected_notes = Note.objects.filter(status='rejected').count()
-    
-    total_reports = Report.objects.count()
-    resolved_reports = Report.objects.filter(status='resolved').count()
-    dismissed_reports = Report.objects.filter(status='dismissed').count()
+    # Overall statistics, one query per table
+    note_stats = Note.objects.aggregate(
+        total_notes=Count('id', filter=~Q(status='deleted')),
+        approved_notes=Count('id', filter=Q(status='approved')),
+        rejected_notes=Count('id', filter=Q(status='rejected')),
+        pending_notes=Count('id', filter=Q(status='pending')),
+        needs_attention=Count(
+            'id', filter=Q(status='pending', created_at__lt=timezone.now() - timezone.timedelta(hours=48))
+        ),
+    )
+    total_notes = note_stats['total_notes']
+    approved_notes = note_stats['approved_notes']
+    rejected_notes = note_stats['rejected_notes']
+
+    report_stats = Report.objects.aggregate(
+        total_reports=Count('id'),
+        resolved_reports=Count('id', filter=Q(status='resolved')),
+        dismissed_reports=Count('id', filter=Q(status='dismissed')),
+        pending_reports=Count('id', filter=Q(status='pending')),
+    )
     
     # Recent moderation actions (all moderators)
     recent_actions = ModerationAction.objects.select_related(
@@ -65,16 +79,10 @@ def moderator_dashboard(request):
         approved_count=Count('notes', filter=Q(notes__status='approved'))
     ).filter(approved_count__gt=0).order_by('-approved_count')[:5]
     
-    # Notes needing attention (pending for > 48 hours)
-    needs_attention = Note.objects.filter(
-        status='pending',
-        created_at__lt=timezone.now() - timezone.timedelta(hours=48)
-    ).count()
-    
     context = {
-        'pending_notes_count': pending_notes.count(),
-        'pending_reports_count': pending_reports.count(),
-        'needs_attention': needs_attention,
+        'pending_notes_count': note_stats['pending_notes'],
+        'pending_reports_count': report_stats['pending_reports'],
+        'needs_attention': note_stats['needs_attention'],
         
         'recent_notes': recent_notes,
         'recent_reports': recent_reports,
@@ -89,9 +97,9 @@ def moderator_dashboard(request):
         'rejected_notes': rejected_notes,
         'approval_rate': round((approved_notes / total_notes * 100) if total_notes > 0 else 0, 1),
         
-        'total_reports': total_reports,
-        'resolved_reports': resolved_reports,
-        'dismissed_reports': dismissed_reports,
+        'total_reports': report_stats['total_reports'],
+        'resolved_reports': report_stats['resolved_reports'],
+        'dismissed_reports': report_stats['dismissed_reports'],
         
         'top_contributors': top_contributors,
     }
@@ -142,17 +150,12 @@ def approve_note(request, pk):
     """Quick approve a note"""
     note = get_object_or_404(Note, pk=pk, status='pending')
     
-    note.status = 'approved'
-    note.approved_by = request.user
-    note.approved_at = timezone.now()
-    note.save()
+    if not note.moderate('approved', approved_by=request.user, approved_at=timezone.now()):
+        raise Http404("Note not found")
     
     # Log the action
-    ModerationAction.objects.create(
-        moderator=request.user,
-        action_type='approve',
-        note=note,
-        reason='Note approved'
+    log_moderation_action.defer(
+        request.user.pk, 'approve', 'Note approved', timezone.now().isoformat(), note_id=note.pk
     )
     
     messages.success(request, f' Note "{note.title}" has been approved!')
@@ -170,15 +173,12 @@ def reject_note(request, pk):
     if request.method == 'POST':
         reason = request.POST.get('reason', 'Quality standards not met')
         
-        note.status = 'rejected'
-        note.save()
+        if not note.moderate('rejected'):
+            raise Http404("Note not found")
         
         # Log the action
-        ModerationAction.objects.create(
-            moderator=request.user,
-            action_type='reject',
-            note=note,
-            reason=reason
+        log_moderation_action.defer(
+            request.user.pk, 'reject', reason, timezone.now().isoformat(), note_id=note.pk
         )
         
         messages.warning(request, f'Note "{note.title}" has been rejected.')
@@ -203,17 +203,18 @@ def review_report(request, pk):
         if action == 'resolve':
             report.status = 'resolved'
             
-            # Optionally remove the note
-            if request.POST.get('remove_note'):
+            # Optionally remove the note, unless it is deleted and being purged
+            if request.POST.get('remove_note') and report.note.status != 'deleted':
                 report.note.status = 'rejected'
                 report.note.save()
                 
-                ModerationAction.objects.create(
-                    moderator=request.user,
-                    action_type='remove',
-                    note=report.note,
-                    report=report,
-                    reason=f"Removed due to report: {report.get_reason_display()}"
+                log_moderation_action.defer(
+                    request.user.pk,
+                    'remove',
+                    f"Removed due to report: {report.get_reason_display()}",
+                    timezone.now().isoformat(),
+                    note_id=report.note_id,
+                    report_id=report.pk,
                 )
             
             messages.success(request, 'Report resolved successfully.')
@@ -12,5 +12,7 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'noteghar.settings')
+# Serve the async note views under ASGI
+os.environ.setdefault('NOTEGHAR_ASYNC_VIEWS', '1')
 
 application = get_asgi_application()
@@ -10,6 +10,8 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
+import tempfile
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -25,6 +27,10 @@ SECRET_KEY = 'django-insecure-*)%_2!o%d-t=a8ebo-s^muxc%9&*x1+(q=cx2_)(*787&f+hh0
 # SECURITY WARNING: don't run with debug turned on in production!
 DEBUG = True
 
+# Deployment profile: 'development' (default) or 'production'
+NOTEGHAR_ENV = os.environ.get('NOTEGHAR_ENV', 'development')
+PRODUCTION = NOTEGHAR_ENV == 'production'
+
 ALLOWED_HOSTS = []
 
 #SITE ID
@@ -62,7 +68,18 @@ AUTHENTICATION_BACKENDS = [
     'allauth.account.auth_backends.AuthenticationBackend',  # Allauth
 ]
 
-EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend' #Prints email to console
+# Email: printed to the console unless NOTEGHAR_EMAIL_BACKEND says otherwise,
+# e.g. django.core.mail.backends.filebased.EmailBackend (one file per
+# connection under EMAIL_FILE_PATH) or django.core.mail.backends.smtp.EmailBackend
+EMAIL_BACKEND = os.environ.get('NOTEGHAR_EMAIL_BACKEND', 'django.core.mail.backends.console.EmailBackend')
+EMAIL_FILE_PATH = BASE_DIR / 'var' / 'mail'
+EMAIL_HOST = os.environ.get('NOTEGHAR_EMAIL_HOST', 'localhost')
+EMAIL_PORT = int(os.environ.get('NOTEGHAR_EMAIL_PORT', '25'))
+EMAIL_HOST_USER = os.environ.get('NOTEGHAR_EMAIL_USER', '')
+EMAIL_HOST_PASSWORD = os.environ.get('NOTEGHAR_EMAIL_PASSWORD', '')
+EMAIL_USE_TLS = os.environ.get('NOTEGHAR_EMAIL_TLS') == '1'
+EMAIL_TIMEOUT = 30
+DEFAULT_FROM_EMAIL = os.environ.get('NOTEGHAR_FROM_EMAIL', 'webmaster@localhost')
 LOGIN_REDIRECT_URL = '/'
 # Allauth settings
 ACCOUNT_AUTHENTICATION_METHOD = 'username_email'
@@ -80,6 +97,7 @@ ACCOUNT_EMAIL_CONFIRMATION_EXPIRE_DAYS = 3
 ACCOUNT_LOGIN_ATTEMPTS_LIMIT = 5
 ACCOUNT_LOGIN_ATTEMPTS_TIMEOUT = 300
 ACCOUNT_FORMS = {'login': 'accounts.forms.CustomAllauthLoginForm'}
+ACCOUNT_ADAPTER = 'accounts.adapter.AccountAdapter'  # sends mail via the task queue
 
 # Password validation - Strong passwords required
 AUTH_PASSWORD_VALIDATORS = [
@@ -139,6 +157,113 @@ MIDDLEWARE = [
     'allauth.account.middleware.AccountMiddleware',
 ]
 
+# Per-request SQL instrumentation (query count/time headers, N+1 warnings)
+QUERY_INSTRUMENTATION = DEBUG or os.environ.get('NOTEGHAR_QUERY_INSTRUMENTATION') == '1'
+if QUERY_INSTRUMENTATION:
+    MIDDLEWARE.insert(0, 'core.middleware.QueryCountMiddleware')
+
+# Maximum queries per request for each URL name (worst case across roles,
+# including session/auth lookups), measured against the seeded fixture in
+# notes.tests.QueryBudgetTests, which enforces them. Deferred work counts
+# as the one INSERT that queues it; with eager tasks (development) it runs
+# inline but outside the budget.
+QUERY_BUDGETS = {
+    'core:home': 7,  # session, user, note counts, trending, recent downloads/uploads, popular notes
+    'core:dashboard': 7,
+    # Catalog version, note count, taxonomy version, session, user, the
+    # course and semester lists (which also validate those filters), the
+    # subject filter with its course and semester, and the notes
+    'notes:list': 9,
+    # Session, user, note, ratings, downloaded?, related notes, and queuing
+    # the buffered view counts when they are due
+    'notes:detail': 7,
+    'notes:download': 4,  # session, user, note, queue record_download
+    'notes:taxonomy': 4,
+    'api:notes': 1,
+    'api:note': 1,
+    'api:note_ratings': 2,
+    'api:subjects': 2,
+    'api:note_stats': 4,  # session, user, note, rollup rows
+    'api:subject_stats': 4,
+    'api:my_stats': 3,
+    'api:trending': 2,
+    'api:similar_notes': 3,
+    'api:similar': 1,
+    'notes:my_notes': 4,
+    'notes:upload': 4,
+    'notes:moderation_dashboard': 6,
+    'moderation:dashboard': 9,
+    'moderation:pending_notes': 4,
+    'moderation:pending_reports': 4,
+    'moderation:history': 4,
+}
+QUERY_N_PLUS_ONE_THRESHOLD = 3
+
+# Metrics: per-process registry flushed to METRICS_DIR, merged on scrape
+METRICS_ENABLED = os.environ.get('NOTEGHAR_METRICS', '1') == '1'
+METRICS_DIR = BASE_DIR / 'var' / 'metrics'
+METRICS_FLUSH_INTERVAL = 5  # seconds
+# Scrapers authenticate with 'Authorization: Bearer <METRICS_TOKEN>'. Behind
+# a reverse proxy on the same host every request comes from 127.0.0.1, so
+# addresses are only trusted outside production, and never for requests a
+# proxy forwarded
+METRICS_TOKEN = os.environ.get('NOTEGHAR_METRICS_TOKEN', '')
+METRICS_ALLOWED_IPS = [] if PRODUCTION else ['127.0.0.1', '::1']
+# Outermost so latency covers all other middleware
+MIDDLEWARE.insert(0, 'core.middleware.MetricsMiddleware')
+
+# Token-bucket rate limits per URL name: 'user' buckets are per signed-in
+# user id (per address for anonymous clients), 'ip' buckets per client
+# address (IPv6 per /64). Rates are N/s, /m, /h or /d. 'methods' and
+# 'param' restrict a rule to those methods or to requests carrying that
+# query parameter.
+RATELIMIT_ENABLED = os.environ.get('NOTEGHAR_RATELIMIT', '1') == '1'
+RATE_LIMITS = {
+    'notes:download': {'user': '30/m', 'ip': '120/m'},
+    'notes:upload': {'user': '20/h', 'ip': '60/h', 'methods': ['POST']},
+    'notes:list': {'user': '30/m', 'ip': '120/m', 'param': 'query'},
+    'api:notes': {'ip': '300/m'},
+    'api:note': {'ip': '600/m'},
+    'api:note_ratings': {'ip': '300/m'},
+    'api:subjects': {'ip': '300/m'},
+    'api:note_stats': {'user': '60/m', 'ip': '300/m'},
+    'api:subject_stats': {'user': '60/m', 'ip': '300/m'},
+    'api:my_stats': {'user': '60/m', 'ip': '300/m'},
+    'api:trending': {'ip': '300/m'},
+    'api:similar_notes': {'ip': '300/m'},
+    'api:similar': {'ip': '120/m'},
+}
+# 'shm' shares buckets between all worker processes on the host; 'cache'
+# uses RATELIMIT_CACHE (per process with the default LocMemCache)
+RATELIMIT_STORE = 'shm' if PRODUCTION else 'cache'
+RATELIMIT_CACHE = 'default'
+RATELIMIT_SHM_PATH = '/dev/shm/noteghar-ratelimit' if os.path.isdir('/dev/shm') else BASE_DIR / 'var' / 'ratelimit'
+RATELIMIT_SHM_SLOTS = 1 << 16
+# Carries the signed user id for the session, so user buckets are found
+# without a query
+RATELIMIT_USER_COOKIE = 'noteghar_rl'
+# After the auth middleware, which loads the user when that cookie is missing
+MIDDLEWARE.insert(
+    MIDDLEWARE.index('django.contrib.auth.middleware.AuthenticationMiddleware') + 1, 'core.middleware.RateLimitMiddleware'
+)
+
+# Request profiling, off unless enabled: with NOTEGHAR_PROFILING=1 staff can
+# profile a single request with a signed token; PROFILING_SAMPLE_RATE = N
+# also samples 1-in-N requests to disk. With neither, the middleware drops
+# out of the chain.
+PROFILING_ON_DEMAND = os.environ.get('NOTEGHAR_PROFILING', '0') == '1'
+PROFILING_SAMPLE_RATE = int(os.environ.get('NOTEGHAR_PROFILING_SAMPLE_RATE', '0'))
+PROFILING_SAMPLE_INTERVAL = 0.005  # seconds between stack samples
+PROFILING_TOKEN_MAX_AGE = 3600
+PROFILING_DIR = BASE_DIR / 'var' / 'profiles'
+PROFILING_MAX_FILES = 500
+# Needs request.user, so it runs after AuthenticationMiddleware
+MIDDLEWARE.append('core.middleware.ProfilingMiddleware')
+
+if PRODUCTION:
+    # Must run before any view code so reads are routed to the reader alias
+    MIDDLEWARE.insert(0, 'core.middleware.ReadOnlyRoutingMiddleware')
+
 ROOT_URLCONF = 'noteghar.urls'
 
 TEMPLATES = [
@@ -153,24 +278,194 @@ TEMPLATES = [
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
                 'notes.context_processors.moderation_stats',  # ADD THIS
+                'core.context_processors.fragment_cache',
             ],
         },
     },
 ]
 
+if PRODUCTION:
+    # Compile each template once per process
+    TEMPLATES[0]['APP_DIRS'] = False
+    TEMPLATES[0]['OPTIONS']['loaders'] = [
+        ('django.template.loaders.cached.Loader', [
+            'django.template.loaders.filesystem.Loader',
+            'django.template.loaders.app_directories.Loader',
+        ]),
+    ]
+
+# Caches
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'noteghar-default',
+        'OPTIONS': {'MAX_ENTRIES': 50000},
+    }
+}
+
+# Template fragment caching: bump the version whenever the markup inside a
+# {% cache %} block changes (base.html navbar, note_list.html cards)
+FRAGMENT_CACHE_VERSION = 4
+FRAGMENT_CACHE_TIMEOUT = 60 * 60 * 24
+
+# Conditional GET on the catalog and note pages (core.conditional): how long
+# a reverse proxy may serve an anonymous page before revalidating
+CONDITIONAL_SHARED_MAX_AGE = 60
+
+# Admin changelists (core.adminscale): filtered results are counted up to
+# this many rows, and related searches match at most this many notes/users
+ADMIN_COUNT_LIMIT = 10000
+ADMIN_SEARCH_CANDIDATES = 200
+
+# Retention (core.retention): days of raw events kept in the database per
+# policy, overriding each policy's default; older rows are rolled up,
+# archived as gzip NDJSON under RETENTION_ARCHIVE_DIR and deleted
+RETENTION_DAYS = {}
+RETENTION_ARCHIVE_DIR = BASE_DIR / 'var' / 'archive'
+RETENTION_BATCH_SIZE = 2000
+
+# Trending notes (notes.trending): what each event adds to a note's score,
+# how fast that fades, and how many notes the site and each course,
+# semester and subject keep ranked
+TRENDING_WEIGHTS = {'download': 1.0, 'view': 0.2, 'rating': 2.0}
+TRENDING_HALF_LIFE_DAYS = 3
+TRENDING_HEAP_SIZE = 50
+
+# "Students also downloaded" (notes.recommendations): neighbours stored per
+# note and shown on its page, the fewest shared downloaders that make two
+# notes related, and the most notes one user may have downloaded to count
+RECOMMENDATIONS_STORED = 20
+RECOMMENDATIONS_SHOWN = 5
+RECOMMENDATIONS_MIN_SUPPORT = 2
+RECOMMENDATIONS_MAX_USER_NOTES = 500
+
+# "More like this" (notes.similarity): where the TF-IDF index is saved,
+# neighbours stored per note, how many of a note's strongest terms are
+# matched when finding them, and the longest text query accepted
+SIMILARITY_INDEX_DIR = BASE_DIR / 'var' / 'similarity'
+SIMILARITY_NEIGHBOURS = 10
+SIMILARITY_QUERY_TERMS = 50
+SIMILARITY_MAX_QUERY_LENGTH = 2000
+# Notes added since the last build are scanned on every search; past this
+# many they are merged into the main index
+SIMILARITY_DELTA_NOTES = 500
+
+# Saved searches, subscriptions and notification digests (notes.percolator,
+# notes.notifications): searches and follows one user may keep, followers
+# notified per fan-out task, users mailed per connection, notes listed in
+# one digest, and the address links point to
+SAVED_SEARCHES_PER_USER = 20
+SUBSCRIPTIONS_PER_USER = 50
+NOTIFICATION_FANOUT_CHUNK = 2000
+NOTIFICATION_DIGEST_BATCH = 200
+NOTIFICATION_DIGEST_MAX_NOTES = 20
+SITE_URL = os.environ.get('NOTEGHAR_SITE_URL', 'http://localhost:8000').rstrip('/')
+
+# Purging deleted notes (notes.purge): rows removed per transaction, and how
+# long one purge task runs before queueing the rest
+NOTE_PURGE_BATCH_SIZE = 1000
+NOTE_PURGE_TASK_SECONDS = 5
+
+# Orphaned media collection (core.mediagc, manage.py collect_media): the
+# MEDIA_ROOT directories swept, and how old an unreferenced file must be to
+# go, since uploads are written before their row is saved
+MEDIA_GC_DIRECTORIES = ['notes', 'profiles']
+MEDIA_GC_GRACE_HOURS = 24
+
+# Read-only JSON API (notes.api): default and maximum page size, which also
+# caps the number of ids in a batch lookup, and the longest range of days
+# one stats request may cover
+API_PAGE_SIZE = 50
+API_MAX_PAGE_SIZE = 200
+API_STATS_MAX_DAYS = 3 * 366
+
+# Full-page cache for anonymous catalog and home pages (core.pagecache)
+PAGE_CACHE_ENABLED = os.environ.get('NOTEGHAR_PAGE_CACHE', '1') == '1'
+PAGE_CACHE_ALIAS = 'default'
+PAGE_CACHE_TIMEOUT = 10 * 60  # also bounds how stale view/download counts get
+PAGE_CACHE_WAIT = 5  # seconds a request waits for another to build the page
+
 WSGI_APPLICATION = 'noteghar.wsgi.application'
+ASGI_APPLICATION = 'noteghar.asgi.application'
+
+# Route the read-heavy note views to their async variants (set by asgi.py)
+ASYNC_VIEWS = os.environ.get('NOTEGHAR_ASYNC_VIEWS') == '1'
+
+# Background tasks (core.taskqueue). Eager mode runs deferred calls inline
+# after commit, so only production needs a `manage.py run_tasks` worker.
+TASKS_EAGER = os.environ.get('NOTEGHAR_TASKS_EAGER', '0' if PRODUCTION else '1') == '1'
+TASK_MAX_ATTEMPTS = 5
+TASK_RETRY_BASE_DELAY = 10  # seconds, doubled on every attempt
+TASK_RETRY_MAX_DELAY = 60 * 60
+TASK_LOCK_TIMEOUT = 10 * 60  # running tasks older than this are requeued
+# Page views are added up in each process and recorded as one task this
+# often (seconds, notes.viewcounts); 0 records every view on its own
+VIEW_COUNT_FLUSH_INTERVAL = 0 if TASKS_EAGER else 10
+# How often the trending rankings take in changed scores (seconds,
+# notes.trending); 0 refreshes them after every event
+TRENDING_REFRESH_INTERVAL = 0 if TASKS_EAGER else 60
+# How long digests wait for more notes (seconds, notes.notifications); 0
+# sends them as soon as a notification is made
+NOTIFICATION_DIGEST_DELAY = 0 if TASKS_EAGER else 15 * 60
 
 
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
+# Tests run on a file rather than in memory, so that concurrent connections
+# see SQLite's real locking
+TEST_DATABASE = {'NAME': os.path.join(tempfile.gettempdir(), 'noteghar-test.sqlite3')}
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'TEST': TEST_DATABASE,
     }
 }
 
+# Production SQLite profile: WAL journaling and tuned pragmas on every
+# connection, persistent connections, and a separate read-only alias on the
+# same file so GET views never queue behind the single writer.
+SQLITE_PRAGMAS = (
+    'PRAGMA journal_mode=WAL;'
+    'PRAGMA synchronous=NORMAL;'
+    'PRAGMA busy_timeout=5000;'
+    'PRAGMA mmap_size=268435456;'   # 256 MB
+    'PRAGMA cache_size=-65536;'     # 64 MB
+    'PRAGMA temp_store=MEMORY;'
+)
+
+if PRODUCTION:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': BASE_DIR / 'db.sqlite3',
+            'CONN_MAX_AGE': 600,
+            'CONN_HEALTH_CHECKS': True,
+            'OPTIONS': {
+                'init_command': SQLITE_PRAGMAS,
+                # Take the write lock up front so concurrent writers wait on
+                # busy_timeout instead of failing on lock upgrade.
+                'transaction_mode': 'IMMEDIATE',
+                'timeout': 5,
+            },
+            'TEST': TEST_DATABASE,
+        },
+        'reader': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': BASE_DIR / 'db.sqlite3',
+            'CONN_MAX_AGE': 600,
+            'CONN_HEALTH_CHECKS': True,
+            'OPTIONS': {
+                'init_command': SQLITE_PRAGMAS + 'PRAGMA query_only=ON;',
+                'timeout': 5,
+            },
+            'TEST': {'MIRROR': 'default'},
+        },
+    }
+    DATABASE_ROUTERS = ['core.db.ReadWriteRouter']
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -207,6 +502,14 @@ USE_TZ = True
 # https://docs.djangoproject.com/en/5.2/howto/static-files/
 
 STATIC_URL = 'static/'
+STATIC_ROOT = BASE_DIR / 'staticfiles'
+
+if PRODUCTION:
+    # Content-hashed file names so static assets can be cached forever
+    STORAGES = {
+        'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+        'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.ManifestStaticFilesStorage'},
+    }
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
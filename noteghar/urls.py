@@ -26,6 +26,7 @@ urlpatterns = [
     path('accounts/', include('allauth.urls')),
     path('notes/', include('notes.urls')), 
     path('moderation/', include('moderation.urls')),
+    path('api/v1/', include('notes.api_urls')),
 
 ]
 
@@ -1,5 +1,6 @@
 from django.contrib import admin
 from django.utils.html import format_html
+from core.adminscale import LargeTableAdmin
 from .models import Course, Semester, Subject, Note, Download
 
 @admin.register(Course)
@@ -12,6 +13,7 @@ class CourseAdmin(admin.ModelAdmin):
 @admin.register(Semester)
 class SemesterAdmin(admin.ModelAdmin):
     list_display = ('number', 'name')
+    search_fields = ('name',)
     ordering = ('number',)
 
 
@@ -21,14 +23,22 @@ class SubjectAdmin(admin.ModelAdmin):
     list_filter = ('course', 'semester')
     search_fields = ('name', 'code')
     prepopulated_fields = {'slug': ('code', 'name')}
+    list_select_related = ('course', 'semester')
+
+    def get_queryset(self, request):
+        # __str__ shows the course and semester, also in autocomplete results
+        return super().get_queryset(request).select_related('course', 'semester')
 
 
 @admin.register(Note)
-class NoteAdmin(admin.ModelAdmin):
+class NoteAdmin(LargeTableAdmin, admin.ModelAdmin):
     list_display = ('title', 'subject', 'uploaded_by', 'status', 'download_count', 'created_at')
     list_filter = ('status', 'course', 'semester', 'created_at')
+    list_select_related = ('subject__course', 'subject__semester', 'uploaded_by')
     search_fields = ('title', 'description', 'tags')
     readonly_fields = ('download_count', 'view_count', 'created_at', 'updated_at')
+    autocomplete_fields = ('course', 'semester', 'subject', 'uploaded_by', 'approved_by')
+    ordering = ('-pk',)
     
     fieldsets = (
         ('Basic Information', {
@@ -55,29 +65,45 @@ class NoteAdmin(admin.ModelAdmin):
 
 
 @admin.register(Download)
-class DownloadAdmin(admin.ModelAdmin):
+class DownloadAdmin(LargeTableAdmin, admin.ModelAdmin):
     list_display = ('note', 'user', 'downloaded_at', 'ip_address')
     list_filter = ('downloaded_at',)
+    list_select_related = ('note', 'user')
+    # Answered through related_search; see core.adminscale
     search_fields = ('note__title', 'user__username')
+    search_help_text = 'Note title, username or email, or an id'
+    related_search = {'note': ('title',), 'user': ('username', 'email')}
     readonly_fields = ('note', 'user', 'downloaded_at', 'ip_address')
+    # The primary key follows download time and is indexed
+    ordering = ('-pk',)
 
 
 from .models import Rating, Report
 
 @admin.register(Rating)
-class RatingAdmin(admin.ModelAdmin):
+class RatingAdmin(LargeTableAdmin, admin.ModelAdmin):
     list_display = ('note', 'user', 'rating', 'created_at')
     list_filter = ('rating', 'created_at')
+    list_select_related = ('note', 'user')
     search_fields = ('note__title', 'user__username', 'review')
+    search_help_text = 'Note title, username or email, review text, or an id'
+    related_search = {'note': ('title',), 'user': ('username', 'email')}
     readonly_fields = ('created_at', 'updated_at')
+    autocomplete_fields = ('note', 'user')
+    ordering = ('-pk',)
 
 
 @admin.register(Report)
-class ReportAdmin(admin.ModelAdmin):
+class ReportAdmin(LargeTableAdmin, admin.ModelAdmin):
     list_display = ('note', 'reported_by', 'reason', 'status', 'created_at')
     list_filter = ('status', 'reason', 'created_at')
+    list_select_related = ('note', 'reported_by')
     search_fields = ('note__title', 'reported_by__username', 'description')
+    search_help_text = 'Note title, username or email, description, or an id'
+    related_search = {'note': ('title',), 'reported_by': ('username', 'email')}
     readonly_fields = ('created_at', 'reviewed_at')
+    autocomplete_fields = ('note', 'reported_by', 'reviewed_by')
+    ordering = ('-pk',)
     
     fieldsets = (
         ('Report Information', {
@@ -0,0 +1,427 @@
+"""
+Read-only JSON API (v1) for notes, subjects and ratings.
+
+List endpoints never instantiate models: the requested fields map to ORM
+paths (or aggregates) and rows come straight out of ``values_list``.
+
+Query parameters shared by the list endpoints:
+
+* ``fields=id,title,subject`` picks the fields to return (``id`` is always
+  included); unknown names are a 400.
+* ``ids=3,9,12`` fetches up to API_MAX_PAGE_SIZE objects in one query,
+  returned in the order asked for; missing ids are left out.
+* ``limit`` and ``cursor`` page through everything else, newest first.
+  ``next`` in the response is the cursor for the following page, or null.
+
+Every response carries an ETag and answers If-None-Match with a 304.
+Subjects are validated against the taxonomy version before any query
+runs; notes and ratings carry live counters, so their ETag is a hash of
+the body and only saves the transfer.
+
+The stats endpoints serve daily download and view counts from the rollup
+tables (see notes.rollups) to signed-in users: a note's to its uploader,
+``me/stats/`` across all of a user's notes, and any note's or subject's to
+moderators. ``from`` and ``to`` (YYYY-MM-DD, both included) default to the
+last 30 days; ``bucket`` is day, week or month.
+
+``trending/`` lists the trending notes of the site, or of the course,
+semester or subject given (see notes.trending), best first.
+
+``notes/<id>/similar/`` lists the notes closest in content to a note, and
+``similar/?q=...`` those closest to a piece of text (see
+notes.similarity), best first and each with its ``score``.
+"""
+import base64
+import hashlib
+import json
+from datetime import date, timedelta
+from functools import wraps
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Avg, Count
+from django.http import HttpResponse
+from django.utils import timezone
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.views.decorators.http import require_safe
+
+from core import versions
+
+from . import rollups, similarity, trending
+from .models import Note, NoteDailyStats, Rating, SimilarNote, Subject, SubjectDailyStats
+from .signals import TAXONOMY
+from .views import is_moderator
+
+NOTE_FIELDS = {
+    'id': 'id',
+    'title': 'title',
+    'description': 'description',
+    'tags': 'tags',
+    'course': 'course_id',
+    'semester': 'semester_id',
+    'subject': 'subject_id',
+    'file_size': 'file_size',
+    'download_count': 'download_count',
+    'view_count': 'view_count',
+    'uploader': 'uploaded_by__username',
+    'created_at': 'created_at',
+    'updated_at': 'updated_at',
+    'approved_at': 'approved_at',
+    'average_rating': Avg('ratings__rating'),
+    'rating_count': Count('ratings'),
+}
+NOTE_DEFAULT_FIELDS = ('id', 'title', 'course', 'semester', 'subject', 'created_at')
+
+SUBJECT_FIELDS = {
+    'id': 'id',
+    'code': 'code',
+    'name': 'name',
+    'description': 'description',
+    'course': 'course_id',
+    'course_code': 'course__code',
+    'semester': 'semester_id',
+    'semester_number': 'semester__number',
+}
+SUBJECT_DEFAULT_FIELDS = ('id', 'code', 'name', 'course', 'semester')
+
+RATING_FIELDS = {
+    'id': 'id',
+    'rating': 'rating',
+    'review': 'review',
+    'user': 'user__username',
+    'created_at': 'created_at',
+    'updated_at': 'updated_at',
+    'helpful_count': Count('helpful_marks'),
+}
+RATING_DEFAULT_FIELDS = ('id', 'rating', 'review', 'user', 'created_at')
+
+
+class ApiError(Exception):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def api_view(view):
+    """
+    GET/HEAD only; ApiError becomes a JSON error response
+    """
+    @require_safe
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        try:
+            return view(request, *args, **kwargs)
+        except ApiError as error:
+            return HttpResponse(dumps({'error': str(error)}), status=error.status, content_type='application/json')
+    return wrapper
+
+
+def dumps(payload):
+    return json.dumps(payload, cls=DjangoJSONEncoder, separators=(',', ':')).encode()
+
+
+def json_response(request, payload, etag=None, public=True):
+    """
+    Serialize compactly and answer If-None-Match. Without a precomputed
+    ETag the body's hash is used.
+    """
+    body = dumps(payload)
+    if etag is None:
+        etag = '"%s"' % hashlib.blake2b(body, digest_size=12).hexdigest()
+    response = get_conditional_response(request, etag=etag) or HttpResponse(body, content_type='application/json')
+    return finish(response, etag, public)
+
+
+def finish(response, etag, public=True):
+    response.headers['ETag'] = etag
+    if public:
+        # The same for every client
+        patch_cache_control(response, public=True, max_age=0, s_maxage=settings.CONDITIONAL_SHARED_MAX_AGE)
+    else:
+        patch_cache_control(response, private=True, max_age=0)
+    return response
+
+
+def int_list(value, name):
+    try:
+        ids = [int(part) for part in value.split(',') if part]
+    except ValueError:
+        raise ApiError(f'{name} must be a comma-separated list of integers') from None
+    if len(ids) > settings.API_MAX_PAGE_SIZE:
+        raise ApiError(f'At most {settings.API_MAX_PAGE_SIZE} {name} per request')
+    return ids
+
+
+def int_param(request, name):
+    value = request.GET.get(name)
+    if not value:
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        raise ApiError(f'{name} must be an integer') from None
+
+
+def selected_fields(request, spec, default):
+    """
+    The field names asked for with fields=, always starting with id
+    """
+    value = request.GET.get('fields')
+    names = [name for name in value.split(',') if name] if value else list(default)
+    unknown = sorted(set(names) - spec.keys())
+    if unknown:
+        raise ApiError(f'Unknown fields: {", ".join(unknown)}; available: {", ".join(spec)}')
+    return ['id'] + [name for name in dict.fromkeys(names) if name != 'id']
+
+
+def project(queryset, spec, names):
+    """
+    Rows as dicts of the named fields, straight from values_list
+    """
+    aggregates = {f'_{name}': spec[name] for name in names if not isinstance(spec[name], str)}
+    if aggregates:
+        queryset = queryset.annotate(**aggregates)
+    paths = [spec[name] if isinstance(spec[name], str) else f'_{name}' for name in names]
+    return [dict(zip(names, row)) for row in queryset.values_list(*paths)]
+
+
+def encode_cursor(pk):
+    return base64.urlsafe_b64encode(str(pk).encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        return int(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except ValueError:
+        raise ApiError('Invalid cursor') from None
+
+
+def page(request, queryset, spec, default):
+    """
+    One page of a list endpoint, or the objects named by ids=
+    """
+    names = selected_fields(request, spec, default)
+
+    ids = request.GET.get('ids')
+    if ids is not None:
+        ids = int_list(ids, 'ids')
+        by_id = {row['id']: row for row in project(queryset.filter(pk__in=ids).order_by(), spec, names)}
+        return {'data': [by_id[pk] for pk in dict.fromkeys(ids) if pk in by_id]}
+
+    limit = int_param(request, 'limit')
+    if limit is None:
+        limit = settings.API_PAGE_SIZE
+    if not 0 < limit <= settings.API_MAX_PAGE_SIZE:
+        raise ApiError(f'limit must be between 1 and {settings.API_MAX_PAGE_SIZE}')
+    cursor = request.GET.get('cursor')
+    if cursor:
+        queryset = queryset.filter(pk__lt=decode_cursor(cursor))
+    # Keyset pagination on the primary key: every page is an index range
+    # scan, however deep the client has paged
+    rows = project(queryset.order_by('-pk')[:limit + 1], spec, names)
+    more = len(rows) > limit
+    rows = rows[:limit]
+    return {'data': rows, 'next': encode_cursor(rows[-1]['id']) if more else None}
+
+
+def approved_notes():
+    return Note.objects.filter(status='approved')
+
+
+@api_view
+def note_list(request):
+    """
+    Approved notes, optionally filtered by course, semester or subject
+    """
+    notes = approved_notes()
+    for name in ('course', 'semester', 'subject'):
+        value = int_param(request, name)
+        if value is not None:
+            notes = notes.filter(**{f'{name}_id': value})
+    return json_response(request, page(request, notes, NOTE_FIELDS, NOTE_DEFAULT_FIELDS))
+
+
+@api_view
+def note_detail(request, pk):
+    names = selected_fields(request, NOTE_FIELDS, NOTE_DEFAULT_FIELDS)
+    rows = project(approved_notes().filter(pk=pk), NOTE_FIELDS, names)
+    if not rows:
+        raise ApiError('Not found', status=404)
+    return json_response(request, {'data': rows[0]})
+
+
+@api_view
+def subject_list(request):
+    """
+    Subjects, optionally filtered by course or semester
+    """
+    # Subjects only change with the taxonomy version, so a repeat request
+    # is answered before touching the subject table
+    version, _ = versions.current(TAXONOMY)
+    query = hashlib.blake2b(request.GET.urlencode().encode(), digest_size=8).hexdigest()
+    etag = f'"subjects-{version}-{query}"'
+    response = get_conditional_response(request, etag=etag)
+    if response is not None:
+        return finish(response, etag)
+
+    subjects = Subject.objects.all()
+    for name in ('course', 'semester'):
+        value = int_param(request, name)
+        if value is not None:
+            subjects = subjects.filter(**{f'{name}_id': value})
+    return json_response(request, page(request, subjects, SUBJECT_FIELDS, SUBJECT_DEFAULT_FIELDS), etag)
+
+
+@api_view
+def note_ratings(request, pk):
+    """
+    Ratings of one approved note
+    """
+    if not approved_notes().filter(pk=pk).exists():
+        raise ApiError('Not found', status=404)
+    ratings = Rating.objects.filter(note_id=pk)
+    return json_response(request, page(request, ratings, RATING_FIELDS, RATING_DEFAULT_FIELDS))
+
+
+@api_view
+def trending_list(request):
+    """
+    Trending notes, optionally of one course, semester or subject (the
+    most specific one given)
+    """
+    names = selected_fields(request, NOTE_FIELDS, NOTE_DEFAULT_FIELDS)
+    limit = int_param(request, 'limit')
+    if limit is None:
+        limit = 10
+    if not 0 < limit <= settings.TRENDING_HEAP_SIZE:
+        raise ApiError(f'limit must be between 1 and {settings.TRENDING_HEAP_SIZE}')
+    key = trending.facet_key(**{name: int_param(request, name) for name in ('course', 'semester', 'subject')})
+    ids = trending.top(key, limit)
+    rows = project(trending.listed(key, Note.objects.filter(pk__in=ids)).order_by(), NOTE_FIELDS, names) if ids else []
+    by_id = {row['id']: row for row in rows}
+    return json_response(request, {'data': [by_id[pk] for pk in ids if pk in by_id]})
+
+
+def limit_param(request, default, maximum):
+    limit = int_param(request, 'limit')
+    if limit is None:
+        return default
+    if not 0 < limit <= maximum:
+        raise ApiError(f'limit must be between 1 and {maximum}')
+    return limit
+
+
+def scored_notes(ranked, names):
+    """
+    The listed notes among (note id, score) pairs, in order, with their
+    score
+    """
+    by_id = {row['id']: row for row in project(
+        approved_notes().filter(pk__in=[pk for pk, _ in ranked]).order_by(), NOTE_FIELDS, names
+    )} if ranked else {}
+    return [dict(by_id[pk], score=round(score, 4)) for pk, score in ranked if pk in by_id]
+
+
+@api_view
+def similar_notes(request, pk):
+    """
+    The notes most similar in content to one approved note
+    """
+    names = selected_fields(request, NOTE_FIELDS, NOTE_DEFAULT_FIELDS)
+    limit = limit_param(request, 5, settings.SIMILARITY_NEIGHBOURS)
+    if not approved_notes().filter(pk=pk).exists():
+        raise ApiError('Not found', status=404)
+    ranked = SimilarNote.objects.filter(note_id=pk).values_list('similar_id', 'score')
+    # Some may have been unlisted since; ask for a few more than shown
+    return json_response(request, {'data': scored_notes(list(ranked[:limit * 2]), names)[:limit]})
+
+
+@api_view
+def similar_to_text(request):
+    """
+    The notes most similar in content to the text given as q=
+    """
+    names = selected_fields(request, NOTE_FIELDS, NOTE_DEFAULT_FIELDS)
+    limit = limit_param(request, 10, settings.API_PAGE_SIZE)
+    text = request.GET.get('q', '').strip()
+    if not text:
+        raise ApiError('q is required')
+    if len(text) > settings.SIMILARITY_MAX_QUERY_LENGTH:
+        raise ApiError(f'q may be at most {settings.SIMILARITY_MAX_QUERY_LENGTH} characters')
+    ranked = similarity.search(text, limit * 2)
+    return json_response(request, {'data': scored_notes(ranked, names)[:limit]})
+
+
+# Stats
+
+def date_param(request, name, default):
+    value = request.GET.get(name)
+    if not value:
+        return default
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        raise ApiError(f'{name} must be a date (YYYY-MM-DD)') from None
+
+
+def stats_response(request, rows, metrics):
+    """
+    Chart data for rollup rows of (day, *metrics) in the requested range
+    """
+    last = date_param(request, 'to', timezone.localdate())
+    first = date_param(request, 'from', last - timedelta(days=29))
+    if first > last:
+        raise ApiError('from must not be after to')
+    if (last - first).days >= settings.API_STATS_MAX_DAYS:
+        raise ApiError(f'At most {settings.API_STATS_MAX_DAYS} days per request')
+    bucket = request.GET.get('bucket', 'day')
+    if bucket not in rollups.BUCKETS:
+        raise ApiError(f'bucket must be one of {", ".join(rollups.BUCKETS)}')
+    end = last + timedelta(days=1)
+    rows = rows.filter(day__gte=first, day__lt=end).order_by().values_list('day', *metrics)
+    payload = {'from': first, 'to': last, 'bucket': bucket, **rollups.series(rows, metrics, first, end, bucket)}
+    # Per user, and today's counts keep moving
+    return json_response(request, payload, public=False)
+
+
+def signed_in(request):
+    if not request.user.is_authenticated:
+        raise ApiError('Authentication required', status=401)
+    return request.user
+
+
+@api_view
+def note_stats(request, pk):
+    """
+    Downloads and views of one note, for its uploader and moderators
+    """
+    user = signed_in(request)
+    uploader = Note.objects.filter(pk=pk).exclude(status='deleted').values_list('uploaded_by_id', flat=True).first()
+    if uploader is None or (uploader != user.pk and not is_moderator(user)):
+        raise ApiError('Not found', status=404)
+    return stats_response(
+        request, NoteDailyStats.objects.filter(note_id=pk), ('downloads', 'downloaders', 'views')
+    )
+
+
+@api_view
+def my_stats(request):
+    """
+    Downloads and views of all the signed-in user's notes together
+    """
+    user = signed_in(request)
+    return stats_response(
+        request, NoteDailyStats.objects.filter(note__uploaded_by=user), ('downloads', 'views')
+    )
+
+
+@api_view
+def subject_stats(request, pk):
+    """
+    Downloads and views of all notes in one subject, for moderators
+    """
+    if not is_moderator(signed_in(request)):
+        raise ApiError('Moderators only', status=403)
+    if not Subject.objects.filter(pk=pk).exists():
+        raise ApiError('Not found', status=404)
+    return stats_response(request, SubjectDailyStats.objects.filter(subject_id=pk), ('downloads', 'views'))
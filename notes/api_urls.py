@@ -0,0 +1,17 @@
+from django.urls import path
+from . import api
+
+app_name = 'api'
+
+urlpatterns = [
+    path('notes/', api.note_list, name='notes'),
+    path('notes/<int:pk>/', api.note_detail, name='note'),
+    path('notes/<int:pk>/ratings/', api.note_ratings, name='note_ratings'),
+    path('notes/<int:pk>/stats/', api.note_stats, name='note_stats'),
+    path('notes/<int:pk>/similar/', api.similar_notes, name='similar_notes'),
+    path('subjects/', api.subject_list, name='subjects'),
+    path('subjects/<int:pk>/stats/', api.subject_stats, name='subject_stats'),
+    path('trending/', api.trending_list, name='trending'),
+    path('similar/', api.similar_to_text, name='similar'),
+    path('me/stats/', api.my_stats, name='my_stats'),
+]
@@ -2,16 +2,25 @@ from .models import Note, Report
 
 def moderation_stats(request):
     """
-    Add moderation stats to context for all templates
+    Add moderation stats to context for all templates. The counts are
+    callables, so only the pages that show them run the queries.
     """
     if request.user.is_authenticated and (
         request.user.role in ['moderator', 'admin'] or request.user.is_superuser
     ):
-        pending_notes = Note.objects.filter(status='pending').count()
-        pending_reports = Report.objects.filter(status='pending').count()
+        counts = {}
+
+        def pending(model):
+            def count():
+                if model not in counts:
+                    counts[model] = model.objects.filter(status='pending').count()
+                return counts[model]
+            return count
+
+        pending_notes, pending_reports = pending(Note), pending(Report)
         return {
             'pending_notes_count': pending_notes,
             'pending_reports_count': pending_reports,
-            'total_pending': pending_notes + pending_reports,
+            'total_pending': lambda: pending_notes() + pending_reports(),
         }
-    return {}
\ No newline at end of file
+    return {}
@@ -0,0 +1,118 @@
+"""
+Plain text from uploaded documents, using the standard library only.
+
+DOCX and PPTX files are zip archives of XML; the text runs of the document
+body and of every slide are read in order. For PDF, the page content
+streams are inflated and the strings shown by the Tj, TJ, ' and "
+operators are collected. That covers PDFs whose fonts use a standard
+encoding (most exports from office suites). Scanned pages and text in
+CID fonts (hex strings) yield nothing, and neither do legacy .doc and
+.ppt files.
+
+Imports nothing from Django, so it can run in worker processes.
+"""
+import re
+import zipfile
+import zlib
+from xml.etree import ElementTree
+
+MAX_TEXT = 200_000  # characters kept per document
+
+OOXML_PARTS = {
+    '.docx': re.compile(r'word/document\.xml$'),
+    '.pptx': re.compile(r'ppt/slides/slide\d+\.xml$'),
+}
+OOXML_TEXT = ('{http://schemas.openxmlformats.org/wordprocessingml/2006/main}t',
+              '{http://schemas.openxmlformats.org/drawingml/2006/main}t')
+
+PDF_STREAM = re.compile(rb'>>\s*stream\r?\n')
+PDF_STRING = rb'\((?:\\.|[^\\()])*\)'
+PDF_SHOW = re.compile(rb'(' + PDF_STRING + rb')\s*(?:Tj|\'|")|\[((?:' + PDF_STRING + rb'|[^\]()])*)\]\s*TJ')
+PDF_ESCAPES = {b'n': b'\n', b'r': b'\r', b't': b'\t', b'b': b'\b', b'f': b'\f'}
+
+
+def extract_text(path):
+    """
+    The document's text, or '' if it has none that can be read
+    """
+    suffix = path[path.rfind('.'):].lower()
+    try:
+        if suffix in OOXML_PARTS:
+            text = ooxml_text(path, OOXML_PARTS[suffix])
+        elif suffix == '.pdf':
+            text = pdf_text(path)
+        else:
+            return ''
+    except (OSError, zipfile.BadZipFile, ElementTree.ParseError):
+        return ''
+    return text[:MAX_TEXT]
+
+
+def ooxml_text(path, parts):
+    chunks = []
+    with zipfile.ZipFile(path) as archive:
+        names = sorted(
+            (name for name in archive.namelist() if parts.search(name)),
+            key=lambda name: [int(n) if n.isdigit() else n for n in re.split(r'(\d+)', name)],
+        )
+        for name in names:
+            root = ElementTree.fromstring(archive.read(name))
+            chunks.extend(element.text for element in root.iter() if element.tag in OOXML_TEXT and element.text)
+    return ' '.join(chunks)
+
+
+def pdf_text(path):
+    with open(path, 'rb') as f:
+        raw = f.read()
+    chunks = []
+    for match in PDF_STREAM.finditer(raw):
+        start = match.end()
+        end = raw.find(b'endstream', start)
+        if end < 0:
+            break
+        data = raw[start:end]
+        # The stream's dictionary, back to the start of its object
+        header = raw[raw.rfind(b'obj', 0, match.start()):match.start()]
+        if re.search(rb'/Subtype\s*/Image', header) or b'/Length1' in header:
+            # Pictures and embedded fonts
+            continue
+        if b'/FlateDecode' in header:
+            try:
+                data = zlib.decompressobj().decompress(data)
+            except zlib.error:
+                continue
+        elif b'/Filter' in header:
+            # Encodings text is never stored in
+            continue
+        if b'BT' in data:
+            chunks.extend(pdf_strings(data))
+    return ' '.join(chunks)
+
+
+def pdf_strings(content):
+    for match in PDF_SHOW.finditer(content):
+        if match.group(1):
+            yield decode_pdf_string(match.group(1))
+        else:
+            yield ''.join(decode_pdf_string(s) for s in re.findall(PDF_STRING, match.group(2)))
+
+
+def decode_pdf_string(literal):
+    body = literal[1:-1]
+    out = bytearray()
+    i = 0
+    while i < len(body):
+        char = body[i:i + 1]
+        if char != b'\\':
+            out += char
+            i += 1
+            continue
+        following = body[i + 1:i + 2]
+        octal = re.match(rb'[0-7]{1,3}', body[i + 1:i + 4])
+        if octal:
+            out.append(int(octal.group(), 8) & 0xFF)
+            i += 1 + len(octal.group())
+        else:
+            out += PDF_ESCAPES.get(following, following if following not in b'\r\n' else b'')
+            i += 2
+    return out.decode('latin-1')
@@ -0,0 +1,46 @@
+"""
+File checks for bulk imports.
+
+Kept free of Django imports so that pool processes can load it without
+setting Django up.
+"""
+import hashlib
+import os
+
+# What NoteUploadForm accepts, and the leading bytes each format must have
+SIGNATURES = {
+    'pdf': (b'%PDF-',),
+    'docx': (b'PK\x03\x04',),
+    'pptx': (b'PK\x03\x04',),
+    'doc': (b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1',),
+    'ppt': (b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1',),
+}
+MAX_FILE_SIZE = 10 * 1024 * 1024
+READ_SIZE = 1024 * 1024
+
+
+def inspect_file(path, max_size):
+    """
+    Validate one file and hash it; runs in a pool process.
+    Returns (size, sha256 hex digest, error).
+    """
+    extension = path.rsplit('.', 1)[-1].lower() if '.' in path else ''
+    if extension not in SIGNATURES:
+        return 0, None, f'unsupported file type .{extension}'
+    try:
+        size = os.path.getsize(path)
+        if not size:
+            return 0, None, 'empty file'
+        if size > max_size:
+            return size, None, f'larger than {max_size:,} bytes'
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            head = f.read(READ_SIZE)
+            if not head.startswith(SIGNATURES[extension]):
+                return size, None, f'not a valid .{extension} file'
+            while head:
+                digest.update(head)
+                head = f.read(READ_SIZE)
+    except OSError as error:
+        return 0, None, error.strerror or str(error)
+    return size, digest.hexdigest(), None
@@ -1,3 +1,5 @@
+import hashlib
+
 from django import forms
 from .models import Note, Course, Semester, Subject
 from .models import Rating, Report
@@ -69,11 +71,68 @@ class NoteUploadForm(forms.ModelForm):
         note = super().save(commit=False)
         if note.file:
             note.file_size = note.file.size
+            digest = hashlib.sha256()
+            for chunk in note.file.chunks():
+                digest.update(chunk)
+            note.content_hash = digest.hexdigest()
         if commit:
             note.save()
         return note
 
 
+class PreloadedChoiceIterator(forms.models.ModelChoiceIterator):
+    def __iter__(self):
+        if self.field.empty_label is not None:
+            yield ('', self.field.empty_label)
+        for obj in self.field.objects():
+            yield self.choice(obj)
+
+    def __len__(self):
+        return len(self.field.objects()) + (self.field.empty_label is not None)
+
+
+class PreloadedChoiceField(forms.ModelChoiceField):
+    """
+    Loads its (short) list of choices once per form and both renders and
+    validates from it, instead of a query for each
+    """
+    iterator = PreloadedChoiceIterator
+
+    def __deepcopy__(self, memo):
+        result = super().__deepcopy__(memo)
+        result._objects = None
+        return result
+
+    def objects(self):
+        if getattr(self, '_objects', None) is None:
+            self._objects = list(self.queryset)
+        return self._objects
+
+    def to_python(self, value):
+        if value in self.empty_values:
+            return None
+        key = self.to_field_name or 'pk'
+        for obj in self.objects():
+            if str(getattr(obj, key)) == str(value):
+                return obj
+        raise forms.ValidationError(
+            self.error_messages['invalid_choice'], code='invalid_choice', params={'value': value},
+        )
+
+
+class SubjectFilterField(forms.ModelChoiceField):
+    """
+    Accepts any subject but only renders the selected one; the page fills
+    in the rest from the taxonomy document, so the form does not grow with
+    the number of subjects
+    """
+    def clean(self, value):
+        subject = super().clean(value)
+        selected = [(subject.pk, self.label_from_instance(subject))] if subject else []
+        self.widget.choices = [('', self.empty_label)] + selected
+        return subject
+
+
 class NoteSearchForm(forms.Form):
     """
     Form for searching notes
@@ -85,25 +144,30 @@ class NoteSearchForm(forms.Form):
             'placeholder': 'Search notes...'
         })
     )
-    course = forms.ModelChoiceField(
+    course = PreloadedChoiceField(
         queryset=Course.objects.all(),
         required=False,
         widget=forms.Select(attrs={'class': 'form-control'}),
         empty_label="All Courses"
     )
-    semester = forms.ModelChoiceField(
+    semester = PreloadedChoiceField(
         queryset=Semester.objects.all(),
         required=False,
         widget=forms.Select(attrs={'class': 'form-control'}),
         empty_label="All Semesters"
     )
-    subject = forms.ModelChoiceField(
-        queryset=Subject.objects.all(),
+    subject = SubjectFilterField(
+        queryset=Subject.objects.select_related('course', 'semester'),
         required=False,
         widget=forms.Select(attrs={'class': 'form-control'}),
         empty_label="All Subjects"
     )
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        subject = self.fields['subject']
+        subject.widget.choices = [('', subject.empty_label)]
+
 class RatingForm(forms.ModelForm):
         """
         Form for rating notes
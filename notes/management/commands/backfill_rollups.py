@@ -0,0 +1,63 @@
+"""
+Recompute the daily download rollups (see notes.rollups) from the raw
+Download rows, one month per transaction. Repeating a range is harmless.
+
+Days already archived by retention have no raw rows left; their rollups
+were computed before archiving and are not touched. Today is left out
+unless asked for, since downloads recorded while it runs would be counted
+twice. Views are not logged per event and cannot be backfilled.
+
+Example::
+
+    python manage.py backfill_rollups --from 2025-01-01
+"""
+import time
+from datetime import date, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from core import retention
+from notes import rollups
+from notes.models import Download
+
+
+def parse_day(value):
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        raise CommandError(f'{value!r} is not a date (YYYY-MM-DD)') from None
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the daily download rollups from the raw download rows'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--from', dest='start', help='First day (default: the oldest download kept)')
+        parser.add_argument('--to', dest='end', help='Last day, included (default: yesterday)')
+
+    def handle(self, *args, **options):
+        today = timezone.localdate()
+        last = parse_day(options['end']) if options['end'] else today - timedelta(days=1)
+        if options['start']:
+            first = parse_day(options['start'])
+        else:
+            oldest = Download.objects.order_by('downloaded_at').values_list('downloaded_at', flat=True).first()
+            if oldest is None:
+                self.stdout.write('No downloads to roll up')
+                return
+            first = timezone.localtime(oldest).date()
+        watermark = retention.policies()['downloads'].watermark()
+        if watermark is not None and first < watermark:
+            self.stdout.write(f'Days before {watermark} are archived; starting there')
+            first = watermark
+        if first > last:
+            raise CommandError(f'Nothing to do between {first} and {last}')
+
+        started = time.perf_counter()
+        for chunk_start, chunk_end in retention.chunks(first, last + timedelta(days=1)):
+            rollups.backfill(retention.day_start(chunk_start), retention.day_start(chunk_end))
+            self.stdout.write(f'{chunk_start} to {chunk_end - timedelta(days=1)} done')
+        self.stdout.write(self.style.SUCCESS(
+            f'Rolled up downloads from {first} to {last} in {time.perf_counter() - started:.1f}s'
+        ))
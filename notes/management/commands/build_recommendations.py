@@ -0,0 +1,24 @@
+"""
+Refresh the "students also downloaded" neighbours (see
+notes.recommendations). Run from cron; each run only recomputes the notes
+touched by downloads since the last one, and ``--full`` starts over.
+"""
+import time
+
+from django.core.management.base import BaseCommand
+
+from notes import recommendations
+
+
+class Command(BaseCommand):
+    help = 'Update related-note recommendations from new downloads'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help='Recompute every note instead of just new activity')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        count = recommendations.build(full=options['full'], log=self.stdout.write)
+        self.stdout.write(self.style.SUCCESS(
+            f'Recomputed neighbours of {count:,} note(s) in {time.perf_counter() - started:.1f}s'
+        ))
@@ -0,0 +1,25 @@
+"""
+Rebuild the "more like this" index and every note's content neighbours
+(see notes.similarity). Approved notes are added as they are listed; run
+this after bulk imports and now and then to refresh the vocabulary and
+document frequencies.
+"""
+import time
+
+from django.core.management.base import BaseCommand
+
+from notes import similarity
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the TF-IDF similarity index and neighbours of every approved note'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, help='Processes extracting text from files (default: one per CPU)')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        count = similarity.build(workers=options['workers'], log=self.stdout.write)
+        self.stdout.write(self.style.SUCCESS(
+            f'Indexed {count:,} note(s) in {time.perf_counter() - started:.1f}s'
+        ))
@@ -0,0 +1,291 @@
+"""
+Bulk-import note files from a directory tree or a manifest.
+
+A directory is read as ``<course code>/<semester number>/<subject code>/<file>``
+(the semester directory may be named e.g. ``semester-3``). A manifest is a
+CSV file with a header row, or a JSON list of objects, with the columns
+``file`` (relative to the manifest), ``course``, ``semester``, ``subject``
+and optionally ``title``, ``description`` and ``tags``.
+
+Files go through in batches. Each batch is checked and hashed on a process
+pool (extension, size limit and file signature, then SHA-256). Files whose
+content is already stored are skipped. The rest are copied into media
+storage on a thread pool and inserted with one ``bulk_create``.
+
+Every committed batch is appended to a state file, so an interrupted
+import can simply be run again. Files already seen are skipped without
+being re-read, and anything else that was already imported is caught by
+its hash. A crash between copying a batch and inserting it leaves
+unreferenced files in storage; the orphaned media sweep removes those.
+
+Example::
+
+    python manage.py import_notes /srv/incoming/bsc-csit --uploader admin --approve
+"""
+import csv
+import hashlib
+import json
+import multiprocessing
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from pathlib import Path
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, transaction
+from django.utils import timezone
+
+from core import versions
+from notes.filecheck import MAX_FILE_SIZE, inspect_file
+from notes.models import Note, Subject
+from notes.signals import ALL_NOTES, CATALOG, note_listed, note_tags
+
+User = get_user_model()
+
+
+def title_from_filename(path):
+    stem = Path(path).stem
+    return re.sub(r'[_\-\s]+', ' ', stem).strip().title() or stem
+
+
+class Entry:
+    """
+    One file to import and where it belongs
+    """
+    __slots__ = ('path', 'course', 'semester', 'subject', 'title', 'description', 'tags')
+
+    def __init__(self, path, course, semester, subject, title='', description='', tags=''):
+        self.path = path
+        self.course = course
+        self.semester = semester
+        self.subject = subject
+        self.title = title or title_from_filename(path)
+        self.description = description or self.title
+        self.tags = tags
+
+
+class Command(BaseCommand):
+    help = 'Import note files in bulk from a directory tree or a CSV/JSON manifest'
+
+    def add_arguments(self, parser):
+        parser.add_argument('source', help='Directory tree, or a .csv/.json manifest')
+        parser.add_argument('--uploader', required=True, help='Username recorded as the uploader')
+        parser.add_argument('--approve', action='store_true',
+                            help='Publish immediately instead of queueing for moderation')
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 2,
+                            help='Processes hashing files, and threads copying them')
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--max-size', type=int, default=MAX_FILE_SIZE, help='Largest file accepted, in bytes')
+        parser.add_argument('--state', help='Progress file for resuming (default: under var/imports/)')
+        parser.add_argument('--restart', action='store_true', help='Ignore progress from earlier runs')
+        parser.add_argument('--dry-run', action='store_true', help='Check and hash files without importing')
+
+    def handle(self, *args, **options):
+        source = Path(options['source']).resolve()
+        try:
+            self.uploader = User.objects.get(username=options['uploader'])
+        except User.DoesNotExist:
+            raise CommandError(f"No user named {options['uploader']!r}") from None
+        self.approve = options['approve']
+        self.dry_run = options['dry_run']
+
+        entries = self.read_source(source)
+        state_path = Path(options['state']) if options['state'] else self.default_state_path(source)
+        done = set() if options['restart'] else self.read_state(state_path)
+        pending = [entry for entry in entries if self.fingerprint(entry.path) not in done]
+        self.stdout.write(
+            f'{len(entries):,} file(s) in {source}; {len(entries) - len(pending):,} done in an earlier run'
+        )
+        self.subjects = self.load_subjects()
+        self.known = set(
+            Note.objects.exclude(content_hash='').exclude(status='deleted').values_list('content_hash', flat=True)
+        )
+        self.counts = {'imported': 0, 'duplicate': 0, 'invalid': 0}
+        self.bytes_read = 0
+
+        # Hashing processes run without Django; never share the parent's connections
+        connections.close_all()
+        started = time.perf_counter()
+        with ProcessPoolExecutor(
+            max_workers=options['workers'],
+            mp_context=multiprocessing.get_context('spawn'),
+        ) as hashers, ThreadPoolExecutor(max_workers=options['workers'], thread_name_prefix='copy') as copiers:
+            for lo in range(0, len(pending), options['batch_size']):
+                batch = pending[lo:lo + options['batch_size']]
+                finished = self.import_batch(batch, hashers, copiers, options['max_size'])
+                if not self.dry_run:
+                    self.append_state(state_path, finished)
+                self.report(lo + len(batch), len(pending), started)
+
+        elapsed = time.perf_counter() - started
+        summary = ', '.join(f'{n:,} {label}' for label, n in self.counts.items())
+        self.stdout.write(self.style.SUCCESS(
+            f'{"Checked" if self.dry_run else "Imported"} {len(pending):,} file(s) in {elapsed:.1f}s: {summary}'
+        ))
+
+    # Sources
+
+    def read_source(self, source):
+        if source.is_dir():
+            return self.read_tree(source)
+        if source.suffix.lower() == '.csv':
+            with open(source, newline='', encoding='utf-8-sig') as f:
+                rows = list(csv.DictReader(f))
+        elif source.suffix.lower() == '.json':
+            with open(source, encoding='utf-8') as f:
+                rows = json.load(f)
+        else:
+            raise CommandError(f'{source} is not a directory, .csv or .json manifest')
+        entries = []
+        for number, row in enumerate(rows, start=1):
+            missing = [column for column in ('file', 'course', 'semester', 'subject') if not row.get(column)]
+            if missing:
+                raise CommandError(f'Manifest row {number} is missing {", ".join(missing)}')
+            entries.append(Entry(
+                str(source.parent / row['file']), str(row['course']), str(row['semester']), str(row['subject']),
+                row.get('title', ''), row.get('description', ''), row.get('tags', ''),
+            ))
+        return entries
+
+    def read_tree(self, root):
+        entries = []
+        for dirpath, dirnames, filenames in os.walk(root):
+            dirnames[:] = sorted(d for d in dirnames if not d.startswith('.'))
+            parts = Path(dirpath).relative_to(root).parts
+            if len(parts) != 3:
+                continue
+            course, semester, subject = parts
+            entries.extend(
+                Entry(os.path.join(dirpath, name), course, semester, subject)
+                for name in sorted(filenames) if not name.startswith('.')
+            )
+        return entries
+
+    def load_subjects(self):
+        """
+        (course code, semester number, subject code) -> (course, semester, subject) ids
+        """
+        rows = Subject.objects.values_list(
+            'course__code', 'semester__number', 'code', 'course_id', 'semester_id', 'id'
+        )
+        return {
+            (course.lower(), number, code.lower()): (course_id, semester_id, subject_id)
+            for course, number, code, course_id, semester_id, subject_id in rows
+        }
+
+    def resolve(self, entry):
+        match = re.search(r'(\d+)$', entry.semester)
+        number = int(match.group(1)) if match else None
+        return self.subjects.get((entry.course.lower(), number, entry.subject.lower()))
+
+    # Progress
+
+    def default_state_path(self, source):
+        name = hashlib.blake2b(str(source).encode(), digest_size=6).hexdigest()
+        return Path(settings.BASE_DIR) / 'var' / 'imports' / f'{source.name}-{name}.state'
+
+    def fingerprint(self, path):
+        # Files changed since they were seen are looked at again
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        return f'{stat.st_size}:{stat.st_mtime_ns}:{path}'
+
+    def read_state(self, path):
+        if not path.exists():
+            return set()
+        with open(path, encoding='utf-8') as f:
+            return set(f.read().splitlines())
+
+    def append_state(self, path, entries):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fingerprints = filter(None, (self.fingerprint(entry.path) for entry in entries))
+        with open(path, 'a', encoding='utf-8') as f:
+            f.writelines(f'{fingerprint}\n' for fingerprint in fingerprints)
+
+    def report(self, processed, total, started):
+        elapsed = time.perf_counter() - started
+        files_rate = processed / elapsed if elapsed else 0
+        mb_rate = self.bytes_read / elapsed / (1024 * 1024) if elapsed else 0
+        self.stdout.write(
+            f'{processed:>9,}/{total:,} files  {elapsed:7.1f}s  {files_rate:>8,.0f} files/s  '
+            f'{mb_rate:>7,.1f} MB/s  imported {self.counts["imported"]:,}  '
+            f'duplicate {self.counts["duplicate"]:,}  invalid {self.counts["invalid"]:,}'
+        )
+
+    # Importing
+
+    def skip(self, entry, reason):
+        self.counts['invalid'] += 1
+        self.stderr.write(f'Skipped {entry.path}: {reason}')
+
+    def import_batch(self, batch, hashers, copiers, max_size):
+        """
+        Import one batch; return the entries that need no further runs
+        """
+        accepted, unplaced = [], set()
+        results = hashers.map(inspect_file, [entry.path for entry in batch], [max_size] * len(batch),
+                              chunksize=16)
+        for entry, (size, digest, error) in zip(batch, results):
+            self.bytes_read += size
+            if error:
+                self.skip(entry, error)
+                continue
+            location = self.resolve(entry)
+            if location is None:
+                # Retried next run, in case the subject is added meanwhile
+                self.skip(entry, f'no subject {entry.subject} for {entry.course}/{entry.semester}')
+                unplaced.add(entry.path)
+                continue
+            if digest in self.known:
+                self.counts['duplicate'] += 1
+                continue
+            self.known.add(digest)
+            accepted.append((entry, location, size, digest))
+
+        finished = [entry for entry in batch if entry.path not in unplaced]
+        if self.dry_run or not accepted:
+            self.counts['imported'] += len(accepted)
+            return finished
+
+        now = timezone.now()
+        folder = now.strftime('notes/%Y/%m/')
+        names = copiers.map(lambda item: self.store(folder, item[0].path), accepted)
+        notes = [
+            Note(
+                title=entry.title[:300],
+                description=entry.description,
+                tags=entry.tags[:500],
+                course_id=course_id,
+                semester_id=semester_id,
+                subject_id=subject_id,
+                file=name,
+                file_size=size,
+                content_hash=digest,
+                uploaded_by=self.uploader,
+                status='approved' if self.approve else 'pending',
+                approved_at=now if self.approve else None,
+                approved_by=self.uploader if self.approve else None,
+            )
+            for (entry, (course_id, semester_id, subject_id), size, digest), name in zip(accepted, names)
+        ]
+        with transaction.atomic():
+            Note.objects.bulk_create(notes)
+            if self.approve:
+                # bulk_create sends no post_save, so do what notes.signals would
+                tags = {tag for note in notes for tag in note_tags(note.course_id, note.semester_id, note.subject_id)}
+                versions.bump_many([CATALOG, ALL_NOTES, *tags])
+                for note in notes:
+                    note_listed(note.pk, (note.course_id, note.semester_id, note.subject_id))
+        self.counts['imported'] += len(notes)
+        return finished
+
+    def store(self, folder, path):
+        with open(path, 'rb') as f:
+            return default_storage.save(folder + os.path.basename(path), File(f))
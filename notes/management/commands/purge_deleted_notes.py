@@ -0,0 +1,25 @@
+"""
+Purge every note still marked deleted (see notes.purge). Deleting a note
+queues its purge, so this only finds notes whose purge task gave up;
+run it from cron as a safety net.
+"""
+import time
+
+from django.core.management.base import BaseCommand
+
+from notes import purge
+from notes.models import Note
+
+
+class Command(BaseCommand):
+    help = 'Remove deleted notes, their rows and their files'
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        pks = list(Note.objects.filter(status='deleted').order_by('deleted_at').values_list('pk', flat=True))
+        for pk in pks:
+            purge.purge(pk)
+            self.stdout.write(f'Purged note #{pk}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Purged {len(pks):,} note(s) in {time.perf_counter() - started:.1f}s'
+        ))
@@ -0,0 +1,22 @@
+"""
+Recompute every note's trending score and all trending rankings from the
+daily rollups and ratings (see notes.trending). Run once after deploying,
+after changing TRENDING_WEIGHTS or TRENDING_HALF_LIFE_DAYS, or whenever
+the rankings have drifted from notes being unlisted.
+"""
+import time
+
+from django.core.management.base import BaseCommand
+
+from notes import trending
+
+
+class Command(BaseCommand):
+    help = 'Rebuild trending scores and rankings from the daily rollups'
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        scored = trending.rebuild()
+        self.stdout.write(self.style.SUCCESS(
+            f'Scored {scored:,} note(s) in {time.perf_counter() - started:.1f}s'
+        ))
@@ -0,0 +1,411 @@
+"""
+Generate a large synthetic dataset for load and scale testing.
+
+All random columns (foreign keys, timestamps, statuses, counters) are drawn
+as NumPy arrays from a single seeded generator, so the same ``--seed``
+always produces the same database. Primary keys are assigned up front,
+which lets child rows reference parents without reading them back.
+
+Entity tables (taxonomy, users, notes, reports) are written with
+``bulk_create``. The append-only event tables (downloads, ratings,
+moderation actions) make up almost all of the rows, so they skip model
+instantiation and go straight from NumPy columns to ``executemany``; that
+keeps a 10M-download database in the range of minutes.
+
+Example::
+
+    python manage.py seed_scale --notes 500000 --downloads 10000000
+"""
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone as dt_timezone
+
+import numpy as np
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from notes.models import (
+    Course, Semester, Subject, Note, Download, Rating, Report, ModerationAction
+)
+
+User = get_user_model()
+
+SEED_PREFIX = 'SEED'
+
+WORDS = (
+    'algorithms', 'database', 'networks', 'operating', 'systems', 'compiler',
+    'calculus', 'linear', 'algebra', 'statistics', 'probability', 'physics',
+    'thermodynamics', 'circuits', 'signals', 'microprocessor', 'management',
+    'accounting', 'economics', 'marketing', 'software', 'engineering',
+    'graphics', 'security', 'cryptography', 'machine', 'learning', 'web',
+    'mobile', 'cloud', 'distributed', 'theory', 'automata', 'discrete',
+    'mathematics', 'structures', 'design', 'analysis', 'project', 'research',
+)
+KINDS = ('Lecture Notes', 'Midterm Revision', 'Final Exam Guide', 'Lab Manual',
+         'Assignment Solutions', 'Chapter Summary', 'Past Questions', 'Slides')
+TAGS = ('important', 'midterm', 'finals', 'lab', 'revision', 'solved',
+        'handwritten', 'slides', 'syllabus', 'practice')
+EXTENSIONS = ('pdf', 'pdf', 'pdf', 'docx', 'pptx', 'ppt', 'doc')
+REPORT_REASONS = [choice[0] for choice in Report.REASON_CHOICES]
+
+
+@contextmanager
+def explicit_timestamps(*models):
+    """
+    Let generated created_at/downloaded_at values through auto_now(_add)
+    """
+    fields = [f for m in models for f in m._meta.concrete_fields
+              if getattr(f, 'auto_now_add', False) or getattr(f, 'auto_now', False)]
+    saved = [(f, f.auto_now, f.auto_now_add) for f in fields]
+    for f in fields:
+        f.auto_now = f.auto_now_add = False
+    try:
+        yield
+    finally:
+        for f, auto_now, auto_now_add in saved:
+            f.auto_now, f.auto_now_add = auto_now, auto_now_add
+
+
+def to_datetimes(seconds):
+    """
+    Convert an array of epoch seconds into aware datetimes
+    """
+    naive = seconds.astype('datetime64[s]').astype('datetime64[us]').tolist()
+    return [d.replace(tzinfo=dt_timezone.utc) for d in naive]
+
+
+def to_db_datetimes(seconds):
+    """
+    Convert epoch seconds to values the database accepts for a DateTimeField
+    """
+    if connection.vendor == 'sqlite':
+        # Django stores UTC datetimes in SQLite as 'YYYY-MM-DD HH:MM:SS'
+        iso = np.datetime_as_string(seconds.astype('datetime64[s]'), unit='s')
+        return np.char.replace(iso, 'T', ' ').tolist()
+    return to_datetimes(seconds)
+
+
+def next_id(model):
+    return (model.objects.aggregate(m=Max('pk'))['m'] or 0) + 1
+
+
+class Command(BaseCommand):
+    help = 'Fill the database with deterministic synthetic data for scale testing'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--courses', type=int, default=12)
+        parser.add_argument('--semesters', type=int, default=8)
+        parser.add_argument('--subjects-per-semester', type=int, default=6)
+        parser.add_argument('--users', type=int, default=20000)
+        parser.add_argument('--moderators', type=int, default=10)
+        parser.add_argument('--notes', type=int, default=500000)
+        parser.add_argument('--downloads', type=int, default=10000000)
+        parser.add_argument('--ratings', type=int, default=None,
+                            help='Defaults to 2 per note')
+        parser.add_argument('--reports', type=int, default=None,
+                            help='Defaults to 1 per 50 notes')
+        parser.add_argument('--days', type=int, default=730,
+                            help='Spread creation dates over this many days')
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--chunk-size', type=int, default=200000,
+                            help='Rows generated per NumPy pass')
+
+    def handle(self, *args, **options):
+        if Course.objects.filter(code__startswith=SEED_PREFIX).exists():
+            raise CommandError('Seed data already present; run against a fresh database.')
+
+        self.rng = np.random.default_rng(options['seed'])
+        self.batch_size = options['batch_size']
+        self.chunk_size = options['chunk_size']
+        self.now = int(timezone.now().timestamp())
+        self.start = self.now - options['days'] * 86400
+        started = time.perf_counter()
+
+        with explicit_timestamps(Course, Subject, Note, Download, Rating, Report, ModerationAction, User):
+            self.seed_taxonomy(options)
+            self.seed_users(options)
+            self.seed_notes(options)
+            self.seed_downloads(options)
+            self.seed_ratings(options)
+            self.seed_reports(options)
+            self.seed_moderation(options)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Seeding finished in {time.perf_counter() - started:.1f}s'
+        ))
+
+    # Helpers
+
+    def insert(self, model, objs):
+        with transaction.atomic():
+            model.objects.bulk_create(objs, batch_size=self.batch_size)
+
+    def insert_columns(self, model, columns):
+        """
+        Insert rows given as {field name: sequence} without building instances
+        """
+        fields = [model._meta.get_field(name) for name in columns]
+        names = ', '.join(connection.ops.quote_name(f.column) for f in fields)
+        placeholders = ', '.join(['%s'] * len(fields))
+        sql = f'INSERT INTO {connection.ops.quote_name(model._meta.db_table)} ({names}) VALUES ({placeholders})'
+        values = [c.tolist() if isinstance(c, np.ndarray) else c for c in columns.values()]
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.executemany(sql, list(zip(*values)))
+
+    def report(self, label, count, started):
+        elapsed = time.perf_counter() - started
+        rate = count / elapsed if elapsed else 0
+        self.stdout.write(f'{label:<18} {count:>11,} rows  {elapsed:7.1f}s  {rate:>10,.0f} rows/s')
+
+    def chunks(self, total):
+        for lo in range(0, total, self.chunk_size):
+            yield lo, min(lo + self.chunk_size, total)
+
+    # Stages
+
+    def seed_taxonomy(self, options):
+        started = time.perf_counter()
+        semesters = []
+        for number in range(1, options['semesters'] + 1):
+            semester, _ = Semester.objects.get_or_create(number=number, defaults={'name': f'Semester {number}'})
+            semesters.append(semester.pk)
+
+        course_base = next_id(Course)
+        courses = [
+            Course(id=course_base + i, code=f'{SEED_PREFIX}{i:03d}', name=f'Seed Course {i}',
+                   slug=f'seed-course-{i}', created_at=timezone.now())
+            for i in range(options['courses'])
+        ]
+        self.insert(Course, courses)
+
+        subject_base = next_id(Subject)
+        subjects, pk = [], subject_base
+        for course in courses:
+            for semester_pk in semesters:
+                for k in range(options['subjects_per_semester']):
+                    words = self.rng.choice(WORDS, 2, replace=False)
+                    name = ' '.join(words).title()
+                    code = f'S{pk}'
+                    subjects.append(Subject(
+                        id=pk, name=name, code=code, course_id=course.pk, semester_id=semester_pk,
+                        slug=f'{code.lower()}-{"-".join(words)}', created_at=timezone.now(),
+                    ))
+                    pk += 1
+        self.insert(Subject, subjects)
+
+        self.subject_ids = np.array([s.pk for s in subjects])
+        self.subject_course = np.array([s.course_id for s in subjects])
+        self.subject_semester = np.array([s.semester_id for s in subjects])
+        self.report('taxonomy', len(courses) + len(subjects), started)
+
+    def seed_users(self, options):
+        started = time.perf_counter()
+        password = make_password(None)
+        base = next_id(User)
+        total = options['users'] + options['moderators']
+        joined = self.rng.integers(self.start, self.now, total)
+        joined_dt = to_datetimes(joined)
+        users = []
+        for i in range(total):
+            moderator = i >= options['users']
+            name = f'seed_mod_{i}' if moderator else f'seed_user_{i}'
+            users.append(User(
+                id=base + i, username=name, email=f'{name}@example.com', password=password,
+                role='moderator' if moderator else 'student',
+                date_joined=joined_dt[i], created_at=joined_dt[i], updated_at=joined_dt[i],
+            ))
+        self.insert(User, users)
+        self.user_ids = np.arange(base, base + options['users'])
+        self.moderator_ids = np.arange(base + options['users'], base + total)
+        self.report('users', total, started)
+
+    def seed_notes(self, options):
+        started = time.perf_counter()
+        total = options['notes']
+        self.note_base = next_id(Note)
+        self.note_created = np.empty(total, dtype=np.int64)
+        self.note_status = np.empty(total, dtype='<U8')
+
+        # Popularity follows a heavy-tailed distribution: a few notes get most downloads
+        popularity = self.rng.pareto(1.2, total) + 1
+        popularity /= popularity.sum()
+        self.download_counts = self.rng.multinomial(options['downloads'], popularity)
+
+        for lo, hi in self.chunks(total):
+            n = hi - lo
+            rng = self.rng
+            subject_idx = rng.integers(0, len(self.subject_ids), n)
+            created = rng.integers(self.start, self.now, n)
+            status = rng.choice(np.array(['approved', 'pending', 'rejected']), n, p=[0.9, 0.07, 0.03])
+            uploader = rng.choice(self.user_ids, n)
+            approver = rng.choice(self.moderator_ids, n)
+            approved_at = np.minimum(created + rng.integers(600, 3 * 86400, n), self.now)
+            kinds = rng.integers(0, len(KINDS), n)
+            w1 = rng.integers(0, len(WORDS), n)
+            w2 = rng.integers(0, len(WORDS), n)
+            tag_a = rng.integers(0, len(TAGS), n)
+            tag_b = rng.integers(0, len(TAGS), n)
+            ext = rng.integers(0, len(EXTENSIONS), n)
+            sizes = rng.lognormal(13.5, 1.0, n).clip(10_000, 10 * 1024 * 1024).astype(np.int64)
+            downloads = self.download_counts[lo:hi]
+            views = downloads * rng.integers(2, 8, n) + rng.integers(0, 50, n)
+
+            self.note_created[lo:hi] = created
+            self.note_status[lo:hi] = status
+            created_dt = to_datetimes(created)
+            approved_dt = to_datetimes(approved_at)
+            month_dirs = created.astype('datetime64[s]').astype('datetime64[M]').astype(str)
+
+            notes = []
+            for i in range(n):
+                pk = self.note_base + lo + i
+                s = subject_idx[i]
+                title = f'{WORDS[w1[i]].title()} {WORDS[w2[i]].title()} {KINDS[kinds[i]]}'
+                is_reviewed = status[i] != 'pending'
+                notes.append(Note(
+                    id=pk,
+                    title=title,
+                    description=f'{KINDS[kinds[i]]} covering {WORDS[w1[i]]} and {WORDS[w2[i]]}.',
+                    subject_id=self.subject_ids[s],
+                    course_id=self.subject_course[s],
+                    semester_id=self.subject_semester[s],
+                    file=f'notes/{month_dirs[i].replace("-", "/")}/seed_{pk}.{EXTENSIONS[ext[i]]}',
+                    file_size=int(sizes[i]),
+                    uploaded_by_id=int(uploader[i]),
+                    status=status[i],
+                    tags=f'{TAGS[tag_a[i]]}, {TAGS[tag_b[i]]}',
+                    download_count=int(downloads[i]),
+                    view_count=int(views[i]),
+                    created_at=created_dt[i],
+                    updated_at=approved_dt[i] if is_reviewed else created_dt[i],
+                    approved_at=approved_dt[i] if status[i] == 'approved' else None,
+                    approved_by_id=int(approver[i]) if status[i] == 'approved' else None,
+                ))
+            self.insert(Note, notes)
+        self.report('notes', total, started)
+
+    def seed_downloads(self, options):
+        started = time.perf_counter()
+        total = int(self.download_counts.sum())
+        # Row r belongs to the note whose cumulative download range contains r
+        boundaries = np.cumsum(self.download_counts)
+        base = next_id(Download)
+        for lo, hi in self.chunks(total):
+            n = hi - lo
+            note_idx = np.searchsorted(boundaries, np.arange(lo, hi), side='right')
+            created = self.note_created[note_idx]
+            when = created + (self.rng.random(n) * (self.now - created)).astype(np.int64)
+            users = self.rng.choice(self.user_ids, n)
+            ips = self.rng.integers(1, 255, (n, 2))
+            ips = np.char.add(np.char.add('10.0.', ips[:, 0].astype(str)),
+                              np.char.add('.', ips[:, 1].astype(str)))
+            self.insert_columns(Download, {
+                'id': np.arange(base + lo, base + hi),
+                'note': self.note_base + note_idx,
+                'user': users,
+                'downloaded_at': to_db_datetimes(when),
+                'ip_address': ips,
+            })
+        self.report('downloads', total, started)
+
+    def seed_ratings(self, options):
+        started = time.perf_counter()
+        wanted = options['ratings'] if options['ratings'] is not None else 2 * options['notes']
+        n_notes, n_users = len(self.note_created), len(self.user_ids)
+        # Draw (note, user) pairs as flat indices and drop duplicates to keep
+        # one rating per user per note
+        pairs = np.unique(self.rng.integers(0, n_notes * n_users, int(wanted * 1.05)))
+        pairs = self.rng.permutation(pairs)[:wanted]
+        base = next_id(Rating)
+        for lo, hi in self.chunks(len(pairs)):
+            chunk = pairs[lo:hi]
+            note_idx, user_idx = np.divmod(chunk, n_users)
+            stars = self.rng.choice(np.arange(1, 6), len(chunk), p=[0.05, 0.08, 0.2, 0.37, 0.3])
+            created = self.note_created[note_idx]
+            when = created + (self.rng.random(len(chunk)) * (self.now - created)).astype(np.int64)
+            when_db = to_db_datetimes(when)
+            self.insert_columns(Rating, {
+                'id': np.arange(base + lo, base + hi),
+                'note': self.note_base + note_idx,
+                'user': self.user_ids[user_idx],
+                'rating': stars,
+                'review': np.where(stars % 2 == 1, '', 'Helpful for revision.'),
+                'created_at': when_db,
+                'updated_at': when_db,
+            })
+        self.report('ratings', len(pairs), started)
+
+    def seed_reports(self, options):
+        started = time.perf_counter()
+        total = options['reports'] if options['reports'] is not None else options['notes'] // 50
+        base = next_id(Report)
+        self.report_base = base
+        note_idx = self.rng.integers(0, len(self.note_created), total)
+        reporters = self.rng.choice(self.user_ids, total)
+        reasons = self.rng.integers(0, len(REPORT_REASONS), total)
+        status = self.rng.choice(np.array(['pending', 'resolved', 'dismissed']), total, p=[0.3, 0.4, 0.3])
+        reviewers = self.rng.choice(self.moderator_ids, total)
+        created = self.note_created[note_idx] + self.rng.integers(3600, 30 * 86400, total)
+        created = np.minimum(created, self.now)
+        created_dt = to_datetimes(created)
+        self.report_note_idx = note_idx
+        self.report_status = status
+        self.report_reviewer = reviewers
+        self.report_created = created
+        reports = [
+            Report(
+                id=base + i,
+                note_id=self.note_base + int(note_idx[i]),
+                reported_by_id=int(reporters[i]),
+                reason=REPORT_REASONS[reasons[i]],
+                description='Generated report.',
+                status=status[i],
+                reviewed_by_id=int(reviewers[i]) if status[i] != 'pending' else None,
+                reviewed_at=created_dt[i] if status[i] != 'pending' else None,
+                created_at=created_dt[i],
+            )
+            for i in range(total)
+        ]
+        for lo, hi in self.chunks(total):
+            self.insert(Report, reports[lo:hi])
+        self.report('reports', total, started)
+
+    def seed_moderation(self, options):
+        started = time.perf_counter()
+        # One approve/reject action per reviewed note, one remove per resolved report
+        reviewed = np.flatnonzero(self.note_status != 'pending')
+        resolved = np.flatnonzero(self.report_status == 'resolved')
+        base = next_id(ModerationAction)
+        total = len(reviewed) + len(resolved)
+        moderators = self.rng.choice(self.moderator_ids, len(reviewed))
+        delays = self.rng.integers(600, 3 * 86400, len(reviewed))
+        for lo, hi in self.chunks(len(reviewed)):
+            idx = reviewed[lo:hi]
+            approved = self.note_status[idx] == 'approved'
+            self.insert_columns(ModerationAction, {
+                'id': np.arange(base + lo, base + hi),
+                'moderator': moderators[lo:hi],
+                'action_type': np.where(approved, 'approve', 'reject'),
+                'note': self.note_base + idx,
+                'report': [None] * len(idx),
+                'target_user': [None] * len(idx),
+                'reason': np.where(approved, 'Note approved', 'Quality standards not met'),
+                'created_at': to_db_datetimes(np.minimum(self.note_created[idx] + delays[lo:hi], self.now)),
+            })
+        offset = base + len(reviewed)
+        self.insert_columns(ModerationAction, {
+            'id': np.arange(offset, offset + len(resolved)),
+            'moderator': self.report_reviewer[resolved],
+            'action_type': ['remove'] * len(resolved),
+            'note': self.note_base + self.report_note_idx[resolved],
+            'report': self.report_base + resolved,
+            'target_user': [None] * len(resolved),
+            'reason': ['Removed due to report'] * len(resolved),
+            'created_at': to_db_datetimes(self.report_created[resolved]),
+        })
+        self.report('moderation', total, started)
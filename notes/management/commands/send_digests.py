@@ -0,0 +1,21 @@
+"""
+Mail digests of the new notes from users' saved searches and
+subscriptions (see notes.notifications). Workers queue digest runs
+themselves; this is for cron, or for development without a worker.
+"""
+import time
+
+from django.core.management.base import BaseCommand
+
+from notes import notifications
+
+
+class Command(BaseCommand):
+    help = 'Email users the notes approved since their last digest'
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        count = notifications.send_digests(log=self.stdout.write)
+        self.stdout.write(self.style.SUCCESS(
+            f'Sent {count:,} digest(s) in {time.perf_counter() - started:.1f}s'
+        ))
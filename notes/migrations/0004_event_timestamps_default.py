@@ -0,0 +1,24 @@
+# Generated by Django 5.2.8 on 2026-10-18 22:35
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notes', '0003_moderationaction_ratinghelpful'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='download',
+            name='downloaded_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AlterField(
+            model_name='moderationaction',
+            name='created_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+    ]
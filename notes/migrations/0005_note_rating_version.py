@@ -0,0 +1,18 @@
+# Generated by Django 5.2.8 on 2026-10-18 22:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notes', '0004_event_timestamps_default'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='note',
+            name='rating_version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.8 on 2026-10-18 22:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notes', '0005_note_rating_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='note',
+            name='content_hash',
+            field=models.CharField(blank=True, db_index=True, max_length=64),
+        ),
+    ]
@@ -0,0 +1,55 @@
+# Generated by Django 5.2.8 on 2026-10-18 22:59
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notes', '0006_note_content_hash'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='download',
+            name='downloaded_at',
+            field=models.DateTimeField(db_index=True, default=django.utils.timezone.now),
+        ),
+        migrations.AlterField(
+            model_name='moderationaction',
+            name='created_at',
+            field=models.DateTimeField(db_index=True, default=django.utils.timezone.now),
+        ),
+        migrations.CreateModel(
+            name='ModerationDailyStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('action_type', models.CharField(choices=[('approve', 'Approved Content'), ('reject', 'Rejected Content'), ('remove', 'Removed Content'), ('warn', 'Warned User'), ('restore', 'Restored Content')], max_length=20)),
+                ('actions', models.PositiveIntegerField(default=0)),
+                ('moderator', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name_plural': 'moderation daily stats',
+                'unique_together': {('day', 'moderator', 'action_type')},
+            },
+        ),
+        migrations.CreateModel(
+            name='NoteDailyStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('downloads', models.PositiveIntegerField(default=0)),
+                ('downloaders', models.PositiveIntegerField(default=0, help_text='Distinct users')),
+                ('note', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_stats', to='notes.note')),
+            ],
+            options={
+                'verbose_name_plural': 'note daily stats',
+                'unique_together': {('note', 'day')},
+            },
+        ),
+    ]
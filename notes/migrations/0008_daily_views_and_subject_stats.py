@@ -0,0 +1,33 @@
+# Generated by Django 5.2.8 on 2026-10-18 23:01
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notes', '0007_retention_rollups'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='notedailystats',
+            name='views',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.CreateModel(
+            name='SubjectDailyStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('downloads', models.PositiveIntegerField(default=0)),
+                ('views', models.PositiveIntegerField(default=0)),
+                ('subject', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_stats', to='notes.subject')),
+            ],
+            options={
+                'verbose_name_plural': 'subject daily stats',
+                'unique_together': {('subject', 'day')},
+            },
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.8 on 2026-10-18 23:06
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notes', '0008_daily_views_and_subject_stats'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TrendingList',
+            fields=[
+                ('key', models.CharField(max_length=50, primary_key=True, serialize=False)),
+                ('entries', models.JSONField(default=list)),
+                ('updated_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='note',
+            name='trend_score',
+            field=models.FloatField(blank=True, editable=False, null=True),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.8 on 2026-10-18 23:10
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notes', '0009_trending'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RelatedNote',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('score', models.FloatField()),
+                ('rank', models.PositiveSmallIntegerField()),
+                ('note', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='related_notes', to='notes.note')),
+                ('related', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='notes.note')),
+            ],
+            options={
+                'ordering': ['note', 'rank'],
+                'unique_together': {('note', 'rank')},
+            },
+        ),
+    ]
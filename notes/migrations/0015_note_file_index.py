@@ -0,0 +1,19 @@
+# Generated by Django 5.2.8 on 2026-10-18 23:47
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notes', '0014_note_soft_delete'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='note',
+            name='file',
+            field=models.FileField(db_index=True, upload_to='notes/%Y/%m/', validators=[django.core.validators.FileExtensionValidator(allowed_extensions=['pdf', 'docx', 'doc', 'ppt', 'pptx'])]),
+        ),
+    ]
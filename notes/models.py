@@ -1,9 +1,25 @@
-from django.db import models
+from django.db import models, transaction
 from django.conf import settings
 from django.core.validators import FileExtensionValidator
 from django.utils.text import slugify
 from django.core.validators import MinValueValidator, MaxValueValidator
 from django.db.models import Avg
+from django.utils import timezone
+
+
+def related_label(instance, name, attribute):
+    """
+    An attribute of a related object if it is already loaded, else its id:
+    __str__ of high-volume rows (admin lists, delete confirmations, logs)
+    must not fetch one related row per object
+    """
+    field = instance._meta.get_field(name)
+    if field.is_cached(instance):
+        related = getattr(instance, name)
+        return getattr(related, attribute) if related else None
+    return f'#{getattr(instance, field.attname)}'
+
+
 class Course(models.Model):
     """
     Academic courses/programs ( Computer Science, Engineering....)
@@ -73,6 +89,8 @@ class Note(models.Model):
         ('pending', 'Pending Review'),
         ('approved', 'Approved'),
         ('rejected', 'Rejected'),
+        # Hidden everywhere until notes.purge removes it
+        ('deleted', 'Deleted'),
     )
     
     title = models.CharField(max_length=300)
@@ -82,11 +100,15 @@ class Note(models.Model):
     semester = models.ForeignKey(Semester, on_delete=models.CASCADE, related_name='notes')
     
     # File upload
+    # Indexed for the range scans of the orphaned media collector
     file = models.FileField(
         upload_to='notes/%Y/%m/',
+        db_index=True,
         validators=[FileExtensionValidator(allowed_extensions=['pdf', 'docx', 'doc', 'ppt', 'pptx'])]
     )
     file_size = models.IntegerField(default=0, help_text="File size in bytes")
+    # SHA-256 of the file, used to skip duplicate uploads and imports
+    content_hash = models.CharField(max_length=64, blank=True, db_index=True)
     
     # Metadata
     uploaded_by = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='notes')
@@ -96,6 +118,12 @@ class Note(models.Model):
     # Stats
     download_count = models.IntegerField(default=0)
     view_count = models.IntegerField(default=0)
+    # Bumped by notes.signals whenever the note's ratings change
+    rating_version = models.PositiveIntegerField(default=0)
+    # Log of the time-decayed popularity score (see notes.trending)
+    trend_score = models.FloatField(null=True, blank=True, editable=False)
+    # Set with every score change until the rankings have taken it in
+    trend_changed = models.BooleanField(default=False, editable=False)
     
     def get_average_rating(self):
         #Get average rating for this note
@@ -118,6 +146,7 @@ class Note(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     approved_at = models.DateTimeField(null=True, blank=True)
+    deleted_at = models.DateTimeField(null=True, blank=True)
     approved_by = models.ForeignKey(
         settings.AUTH_USER_MODEL, 
         on_delete=models.SET_NULL, 
@@ -130,6 +159,9 @@ class Note(models.Model):
     
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['id'], condition=models.Q(trend_changed=True), name='note_trend_changed'),
+        ]
     
     def __str__(self):
         return self.title
@@ -143,6 +175,31 @@ class Note(models.Model):
     def is_approved(self):
         return self.status == 'approved'
 
+    def soft_delete(self):
+        """
+        Hide the note at once; its rows and file are purged later (see
+        notes.purge)
+        """
+        self.status = 'deleted'
+        self.deleted_at = timezone.now()
+        self.save(update_fields=['status', 'deleted_at', 'updated_at'])
+
+    def moderate(self, status, **fields):
+        """
+        Set the status (and any approval fields) unless the note has been
+        deleted; returns False if it has. The transaction opens with a
+        conditional write, so a soft delete cannot commit between that
+        check and the save.
+        """
+        with transaction.atomic():
+            if not Note.objects.filter(pk=self.pk).exclude(status='deleted').update(updated_at=timezone.now()):
+                return False
+            self.status = status
+            for name, value in fields.items():
+                setattr(self, name, value)
+            self.save(update_fields=['status', *fields, 'updated_at'])
+        return True
+
 
 class Download(models.Model):
     """
@@ -150,14 +207,15 @@ class Download(models.Model):
     """
     note = models.ForeignKey(Note, on_delete=models.CASCADE, related_name='downloads')
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='downloads')
-    downloaded_at = models.DateTimeField(auto_now_add=True)
+    # Not auto_now_add: deferred inserts keep the time of the request
+    downloaded_at = models.DateTimeField(default=timezone.now, db_index=True)
     ip_address = models.GenericIPAddressField(null=True, blank=True)
     
     class Meta:
         ordering = ['-downloaded_at']
     
     def __str__(self):
-        return f"{self.user.username} downloaded {self.note.title}"
+        return f"{related_label(self, 'user', 'username')} downloaded {related_label(self, 'note', 'title')}"
 
 class Rating(models.Model):
     """
@@ -178,7 +236,7 @@ class Rating(models.Model):
         ordering = ['-created_at']
     
     def __str__(self):
-        return f"{self.user.username} rated {self.note.title}: {self.rating}/5"
+        return f"{related_label(self, 'user', 'username')} rated {related_label(self, 'note', 'title')}: {self.rating}/5"
     
     def get_helpful_count(self):
         """Get count of users who found this rating helpful"""
@@ -238,7 +296,7 @@ class Report(models.Model):
         ordering = ['-created_at']
     
     def __str__(self):
-        return f"Report by {self.reported_by.username} on {self.note.title}"
+        return f"Report by {related_label(self, 'reported_by', 'username')} on {related_label(self, 'note', 'title')}"
 class RatingHelpful(models.Model):
     """
     Track which users found a rating helpful
@@ -252,7 +310,7 @@ class RatingHelpful(models.Model):
         ordering = ['-created_at']
     
     def __str__(self):
-        return f"{self.user.username} found rating helpful"
+        return f"{related_label(self, 'user', 'username')} found rating helpful"
 
 
 class ModerationAction(models.Model):
@@ -284,10 +342,214 @@ class ModerationAction(models.Model):
     )
     
     reason = models.TextField()
-    created_at = models.DateTimeField(auto_now_add=True)
+    created_at = models.DateTimeField(default=timezone.now, db_index=True)
     
     class Meta:
         ordering = ['-created_at']
     
     def __str__(self):
-        return f"{self.moderator.username} - {self.action_type} - {self.created_at}"
\ No newline at end of file
+        return f"{related_label(self, 'moderator', 'username')} - {self.action_type} - {self.created_at}"
+
+
+class NoteDailyStats(models.Model):
+    """
+    Downloads and views of a note per day (see notes.rollups)
+    """
+    note = models.ForeignKey(Note, on_delete=models.CASCADE, related_name='daily_stats')
+    day = models.DateField()
+    downloads = models.PositiveIntegerField(default=0)
+    downloaders = models.PositiveIntegerField(default=0, help_text="Distinct users")
+    views = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = ('note', 'day')
+        verbose_name_plural = 'note daily stats'
+
+    def __str__(self):
+        return f"Note #{self.note_id} on {self.day}: {self.downloads} downloads, {self.views} views"
+
+
+class SubjectDailyStats(models.Model):
+    """
+    Downloads and views of all notes in a subject per day (see notes.rollups)
+    """
+    subject = models.ForeignKey(Subject, on_delete=models.CASCADE, related_name='daily_stats')
+    day = models.DateField()
+    downloads = models.PositiveIntegerField(default=0)
+    views = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = ('subject', 'day')
+        verbose_name_plural = 'subject daily stats'
+
+    def __str__(self):
+        return f"Subject #{self.subject_id} on {self.day}: {self.downloads} downloads, {self.views} views"
+
+
+class ModerationDailyStats(models.Model):
+    """
+    Moderation actions per moderator, type and day, rolled up from
+    ModerationAction rows before they are archived
+    """
+    day = models.DateField()
+    moderator = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='+')
+    action_type = models.CharField(max_length=20, choices=ModerationAction.ACTION_TYPES)
+    actions = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = ('day', 'moderator', 'action_type')
+        verbose_name_plural = 'moderation daily stats'
+
+    def __str__(self):
+        return f"{self.action_type} x{self.actions} by #{self.moderator_id} on {self.day}"
+
+
+class TrendingList(models.Model):
+    """
+    The highest-scoring notes of the site or of one course, semester or
+    subject, kept as a bounded min-heap of [score, note id] pairs (see
+    notes.trending)
+    """
+    key = models.CharField(max_length=50, primary_key=True)
+    entries = models.JSONField(default=list)
+    updated_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f"Trending in {self.key}: {len(self.entries)} notes"
+
+
+class RelatedNote(models.Model):
+    """
+    A note often downloaded by the same students as another, ranked by
+    how much their downloaders overlap (see notes.recommendations)
+    """
+    note = models.ForeignKey(Note, on_delete=models.CASCADE, related_name='related_notes')
+    related = models.ForeignKey(Note, on_delete=models.CASCADE, related_name='+')
+    score = models.FloatField()
+    rank = models.PositiveSmallIntegerField()
+
+    class Meta:
+        # Also the index the detail page reads a note's neighbours from
+        unique_together = ('note', 'rank')
+        ordering = ['note', 'rank']
+
+    def __str__(self):
+        return f"Note #{self.note_id} -> #{self.related_id} ({self.score:.3f})"
+
+
+class SimilarNote(models.Model):
+    """
+    A note whose content is close to another's, by cosine similarity of
+    their TF-IDF vectors (see notes.similarity)
+    """
+    note = models.ForeignKey(Note, on_delete=models.CASCADE, related_name='similar_notes')
+    similar = models.ForeignKey(Note, on_delete=models.CASCADE, related_name='+')
+    score = models.FloatField()
+    rank = models.PositiveSmallIntegerField()
+
+    class Meta:
+        unique_together = ('note', 'rank')
+        ordering = ['note', 'rank']
+
+    def __str__(self):
+        return f"Note #{self.note_id} ~ #{self.similar_id} ({self.score:.3f})"
+
+
+class SavedSearch(models.Model):
+    """
+    A catalog search a user wants to hear about: notes approved later that
+    match it become notifications (see notes.percolator)
+    """
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='saved_searches')
+    query = models.CharField(max_length=200, blank=True)
+    course = models.ForeignKey(Course, on_delete=models.CASCADE, null=True, blank=True, related_name='+')
+    semester = models.ForeignKey(Semester, on_delete=models.CASCADE, null=True, blank=True, related_name='+')
+    subject = models.ForeignKey(Subject, on_delete=models.CASCADE, null=True, blank=True, related_name='+')
+    # Number of SavedSearchKey rows; a note matches when it has them all
+    key_count = models.PositiveSmallIntegerField(editable=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return self.query or f"Saved search #{self.pk}"
+
+
+class SavedSearchKey(models.Model):
+    """
+    The reverse index of saved searches: one row per word or filter a
+    search requires
+    """
+    key = models.CharField(max_length=60)
+    search = models.ForeignKey(SavedSearch, on_delete=models.CASCADE, related_name='keys')
+
+    class Meta:
+        # Also the index matching reads searches by key from
+        unique_together = ('key', 'search')
+
+    def __str__(self):
+        return f"{self.key} -> search #{self.search_id}"
+
+
+class Subscription(models.Model):
+    """
+    A user following a course or a subject: every note approved in it
+    becomes a notification (see notes.notifications)
+    """
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='subscriptions')
+    course = models.ForeignKey(Course, on_delete=models.CASCADE, null=True, blank=True, related_name='+')
+    subject = models.ForeignKey(Subject, on_delete=models.CASCADE, null=True, blank=True, related_name='+')
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['-created_at']
+        constraints = [
+            models.CheckConstraint(
+                condition=models.Q(course__isnull=True, subject__isnull=False)
+                | models.Q(course__isnull=False, subject__isnull=True),
+                name='subscription_course_or_subject',
+            ),
+            # Also the indexes fan-out pages through followers with
+            models.UniqueConstraint(
+                fields=['subject', 'user'], condition=models.Q(subject__isnull=False), name='subscription_subject_user',
+            ),
+            models.UniqueConstraint(
+                fields=['course', 'user'], condition=models.Q(course__isnull=False), name='subscription_course_user',
+            ),
+        ]
+
+    def __str__(self):
+        if self.subject_id:
+            return f"{related_label(self, 'user', 'username')} follows {related_label(self, 'subject', 'code')}"
+        return f"{related_label(self, 'user', 'username')} follows {related_label(self, 'course', 'code')}"
+
+
+class Notification(models.Model):
+    """
+    A newly approved note brought to a user's attention by a saved search
+    or a subscription, at most once per note; mailed in digests (see
+    notes.notifications)
+    """
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='notifications')
+    note = models.ForeignKey(Note, on_delete=models.CASCADE, related_name='+')
+    search = models.ForeignKey(SavedSearch, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    subscription = models.ForeignKey(
+        Subscription, on_delete=models.SET_NULL, null=True, blank=True, related_name='+'
+    )
+    created_at = models.DateTimeField(default=timezone.now)
+    emailed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        unique_together = ('user', 'note')
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['user', '-created_at'], name='notification_user_recent'),
+            # Digests read the unsent rows only
+            models.Index(
+                fields=['user'], condition=models.Q(emailed_at__isnull=True), name='notification_unsent',
+            ),
+        ]
+
+    def __str__(self):
+        return f"{related_label(self, 'note', 'title')} for {related_label(self, 'user', 'username')}"
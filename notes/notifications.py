@@ -0,0 +1,133 @@
+"""
+Notifications of newly approved notes, and their email digests.
+
+Notes reach users two ways: through saved searches (notes.percolator)
+and through subscriptions to a course or subject. Fanning a note out to
+its followers runs in the task queue, NOTIFICATION_FANOUT_CHUNK followers
+per task: each task pages through the followers of the note's subject,
+then its course, on the subscription's own index, bulk-inserts their
+notifications and queues the next page. However many follow a course,
+no task runs longer than one page, and rerunning one notifies nobody
+twice.
+
+Digests are then sent by ``send_digests``, queued
+NOTIFICATION_DIGEST_DELAY after the first new notification so that notes
+approved in between share a message (or run from cron with ``manage.py
+send_digests``, which needs no worker). Users are taken
+NOTIFICATION_DIGEST_BATCH at a time, and each batch is sent over one
+mail connection. A batch is claimed by stamping its rows first, so two
+runs never mail the same rows; a batch that fails to send is released
+for the next run. Users without an email address only see their
+notifications on the site.
+"""
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.template.loader import render_to_string
+from django.urls import reverse
+from django.utils import timezone
+
+from .models import Note, Notification, Subscription
+
+FACETS = ('subject', 'course')
+
+
+def follow(user, course=None, subject=None):
+    """
+    Subscribe a user to a course or a subject; raises ValueError when
+    they follow too many already
+    """
+    lookup = {'course': course} if course is not None else {'subject': subject}
+    subscription = user.subscriptions.filter(**lookup).first()
+    if subscription is not None:
+        return subscription
+    if user.subscriptions.count() >= settings.SUBSCRIPTIONS_PER_USER:
+        raise ValueError(f'You can follow up to {settings.SUBSCRIPTIONS_PER_USER} courses and subjects.')
+    return Subscription.objects.create(user=user, **lookup)
+
+
+def notify_followers(note_id, facet=FACETS[0], after=0):
+    """
+    Notify one page of the followers of an approved note's subject or
+    course, from user id ``after`` on. Returns where the next page starts
+    as (facet, after), or None when done.
+    """
+    row = Note.objects.filter(pk=note_id, status='approved').values_list(
+        f'{facet}_id', 'uploaded_by_id'
+    ).first()
+    if row is None:
+        return None
+    value, uploader_id = row
+    size = settings.NOTIFICATION_FANOUT_CHUNK
+    followers = list(
+        Subscription.objects.filter(**{f'{facet}_id': value}, user_id__gt=after)
+        .order_by('user_id').values_list('user_id', 'pk')[:size]
+    )
+    Notification.objects.bulk_create(
+        [
+            Notification(user_id=user_id, note_id=note_id, subscription_id=subscription_id)
+            for user_id, subscription_id in followers if user_id != uploader_id
+        ],
+        batch_size=1000,
+        # Followers of both the subject and the course, or matched by a
+        # saved search already
+        ignore_conflicts=True,
+    )
+    if len(followers) == size:
+        return facet, followers[-1][0]
+    following = FACETS.index(facet) + 1
+    return (FACETS[following], 0) if following < len(FACETS) else None
+
+
+def digest_message(user, notifications):
+    shown = notifications[:settings.NOTIFICATION_DIGEST_MAX_NOTES]
+    context = {
+        'user': user,
+        'notes': [
+            (notification.note, settings.SITE_URL + reverse('notes:detail', args=[notification.note_id]))
+            for notification in shown
+        ],
+        'more': len(notifications) - len(shown),
+        'alerts_url': settings.SITE_URL + reverse('notes:alerts'),
+    }
+    subject = render_to_string('notes/email/digest_subject.txt', context).strip()
+    body = render_to_string('notes/email/digest_message.txt', context)
+    return EmailMessage(subject, body, None, [user.email])
+
+
+def send_digests(log=lambda message: None):
+    """
+    Mail all unsent notifications; returns the number of messages sent
+    """
+    sent = 0
+    last_user = 0
+    while True:
+        users = list(
+            Notification.objects.filter(emailed_at=None, user_id__gt=last_user)
+            .order_by('user_id').values_list('user_id', flat=True).distinct()[:settings.NOTIFICATION_DIGEST_BATCH]
+        )
+        if not users:
+            return sent
+        last_user = users[-1]
+        # The stamp doubles as this run's claim on the rows
+        stamp = timezone.now()
+        Notification.objects.filter(emailed_at=None, user_id__in=users).update(emailed_at=stamp)
+        claimed = Notification.objects.filter(emailed_at=stamp, user_id__in=users)
+        by_user = {}
+        # Notes removed since are left out but still marked
+        for notification in claimed.filter(note__status='approved').select_related(
+            'user', 'note__subject'
+        ).order_by('user_id', '-created_at'):
+            by_user.setdefault(notification.user_id, []).append(notification)
+        messages = [
+            digest_message(notifications[0].user, notifications)
+            for notifications in by_user.values() if notifications[0].user.email
+        ]
+        if messages:
+            try:
+                with get_connection() as connection:
+                    connection.send_messages(messages)
+            except Exception:
+                claimed.update(emailed_at=None)
+                raise
+        sent += len(messages)
+        log(f'{len(messages):,} digest(s) for {len(users):,} user(s)')
@@ -0,0 +1,97 @@
+"""
+Saved searches, matched against notes as they are approved.
+
+A saved search requires every word of its query and each of its course,
+semester and subject filters. Words are the tokens of notes.similarity,
+so short words, numbers and stop words are ignored on both sides, and a
+word only matches whole words of a note's title, tags or description.
+Every requirement is stored as a key, and SavedSearchKey is the reverse
+index from keys to the searches requiring them.
+
+Approving a note looks up the note's own keys in that index and keeps, in
+a single grouped query, the searches that found all of theirs. The cost
+grows with the size of the note and the number of matching searches, not
+with the number of searches stored. Each owner gets one Notification per
+note, however many of their searches match.
+"""
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, F
+
+from .models import Note, Notification, SavedSearch, SavedSearchKey
+from .similarity import tokens
+
+KEY_LENGTH = 60
+
+
+def words(text):
+    return {token for token in tokens(text) if len(token) <= KEY_LENGTH}
+
+
+def facet_keys(course_id, semester_id, subject_id):
+    return {
+        f'{name}:{value}'
+        for name, value in (('course', course_id), ('semester', semester_id), ('subject', subject_id))
+        if value is not None
+    }
+
+
+def save_search(user, query, course=None, semester=None, subject=None):
+    """
+    Save a search for a user and index its keys; raises ValueError if it
+    would match nothing specific or the user has too many
+    """
+    keys = words(query) | facet_keys(
+        course and course.pk, semester and semester.pk, subject and subject.pk
+    )
+    if not keys:
+        raise ValueError('Add a search term or pick a course, semester or subject to save this search.')
+    if user.saved_searches.count() >= settings.SAVED_SEARCHES_PER_USER:
+        raise ValueError(f'You can save up to {settings.SAVED_SEARCHES_PER_USER} searches.')
+    with transaction.atomic():
+        search = SavedSearch.objects.create(
+            user=user, query=query.strip(), course=course, semester=semester, subject=subject, key_count=len(keys),
+        )
+        SavedSearchKey.objects.bulk_create([SavedSearchKey(key=key, search=search) for key in keys])
+    return search
+
+
+def matching_searches(keys):
+    """
+    (search id, owner id) of every saved search whose keys are all among
+    keys
+    """
+    return (
+        SavedSearchKey.objects.filter(key__in=keys)
+        .values('search_id')
+        .annotate(found=Count('id'))
+        .filter(found=F('search__key_count'))
+        .values_list('search_id', 'search__user_id')
+    )
+
+
+def percolate(note_id):
+    """
+    Notify the owners of the saved searches an approved note matches;
+    returns the number of users matched
+    """
+    row = Note.objects.filter(pk=note_id, status='approved').values_list(
+        'title', 'tags', 'description', 'course_id', 'semester_id', 'subject_id', 'uploaded_by_id'
+    ).first()
+    if row is None:
+        return 0
+    title, tags, description, course_id, semester_id, subject_id, uploader_id = row
+    keys = words(' '.join((title, tags.replace(',', ' '), description))) | facet_keys(
+        course_id, semester_id, subject_id
+    )
+    owners = {}
+    for search_id, user_id in matching_searches(sorted(keys)):
+        if user_id != uploader_id:
+            owners.setdefault(user_id, search_id)
+    # A rerun of the task notifies nobody twice
+    Notification.objects.bulk_create(
+        [Notification(user_id=user_id, note_id=note_id, search_id=search_id) for user_id, search_id in owners.items()],
+        batch_size=1000,
+        ignore_conflicts=True,
+    )
+    return len(owners)
@@ -0,0 +1,105 @@
+"""
+Purging deleted notes.
+
+Deleting a note only marks it deleted (``Note.soft_delete``), which hides
+it everywhere at once, since listings only show approved notes. The rows
+hanging off it are removed afterwards, NOTE_PURGE_BATCH_SIZE rows of one
+table at a time, each batch in its own short transaction. Even a note
+with a million downloads never holds the database's write lock for
+long, and other writers get their turn between batches. Moderation
+actions about the note are kept for the record, detached from it.
+
+Ratings and helpful marks are deleted without signals. Their post_delete
+receivers bump the rating version of the note, one UPDATE per row, which
+would be pointless for a note on its way out. That also keeps Django from
+loading every row of the batch. Their only dependents are the helpful
+marks, which go first.
+
+Once nothing refers to the note, its row goes, and then its file unless
+another note still uses the same one.
+"""
+import time
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import Q
+
+from .models import (
+    Download, ModerationAction, Note, NoteDailyStats, Notification, Rating, RatingHelpful, RelatedNote, Report,
+    SimilarNote,
+)
+
+# Deleted without signals or cascades (see above)
+RAW_DELETE = (RatingHelpful, Rating)
+
+
+def dependents(note_id):
+    """
+    The rows to delete before the note, in order. Batches are taken in no
+    particular order: sorting by each model's Meta.ordering would re-read
+    and sort every remaining row for each batch.
+    """
+    return [
+        queryset.order_by()
+        for queryset in (
+            Download.objects.filter(note_id=note_id),
+            RatingHelpful.objects.filter(rating__note_id=note_id),
+            Rating.objects.filter(note_id=note_id),
+            Report.objects.filter(note_id=note_id),
+            NoteDailyStats.objects.filter(note_id=note_id),
+            RelatedNote.objects.filter(Q(note_id=note_id) | Q(related_id=note_id)),
+            SimilarNote.objects.filter(Q(note_id=note_id) | Q(similar_id=note_id)),
+            Notification.objects.filter(note_id=note_id),
+        )
+    ]
+
+
+def release_file(name):
+    """
+    Delete a stored file unless a note still uses it
+    """
+    if name and not Note.objects.filter(file=name).exists():
+        default_storage.delete(name)
+
+
+def purge_batch(note_id):
+    """
+    Remove one batch of a deleted note's rows, or the note itself once
+    they are gone; returns whether anything is left to do
+    """
+    name = Note.objects.filter(pk=note_id, status='deleted').values_list('file', flat=True).first()
+    if name is None:
+        # Purged already, or never deleted
+        return False
+    size = settings.NOTE_PURGE_BATCH_SIZE
+    for queryset in dependents(note_id):
+        pks = list(queryset.values_list('pk', flat=True)[:size])
+        if pks:
+            batch = queryset.model.objects.filter(pk__in=pks)
+            with transaction.atomic():
+                if queryset.model in RAW_DELETE:
+                    batch._raw_delete(batch.db)
+                else:
+                    batch.delete()
+            return True
+    pks = list(ModerationAction.objects.filter(note_id=note_id).order_by().values_list('pk', flat=True)[:size])
+    if pks:
+        ModerationAction.objects.filter(pk__in=pks).update(note=None)
+        return True
+    with transaction.atomic():
+        Note.objects.filter(pk=note_id).delete()
+        transaction.on_commit(lambda: release_file(name))
+    return False
+
+
+def purge(note_id, seconds=None):
+    """
+    Purge a deleted note for up to ``seconds``; returns whether it is
+    gone
+    """
+    deadline = time.monotonic() + seconds if seconds is not None else None
+    while purge_batch(note_id):
+        if deadline is not None and time.monotonic() >= deadline:
+            return False
+    return True
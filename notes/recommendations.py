@@ -0,0 +1,179 @@
+"""
+"Students also downloaded": item-item recommendations from co-downloads.
+
+Two notes are related when the same students download both. From the
+distinct (user, note) pairs in Download, ``build`` counts for every pair
+of notes how many users downloaded both (the item-item co-occurrence
+matrix, kept sparse as flat pair keys), scores each pair by cosine
+similarity ``shared / sqrt(downloaders(a) * downloaders(b))`` and stores
+the best RECOMMENDATIONS_STORED neighbours of each note as RelatedNote
+rows. The detail page reads them back in one index range scan.
+
+Everything is vectorized with NumPy; users are processed in chunks so
+that the pairs generated at once stay bounded. Users with more than
+RECOMMENDATIONS_MAX_USER_NOTES notes are left out: they are mostly
+scrapers, and their pairs grow with the square of their downloads.
+
+The last Download id folded in is kept as the RECOMMENDATIONS version,
+which also validates cached detail pages. An incremental run only
+recomputes notes downloaded by someone who downloaded anything since.
+Their neighbours' popularity also changed, which shifts other notes'
+scores slightly; a periodic ``--full`` run (and only the downloads still
+inside the retention window count) keeps that drift bounded.
+"""
+from itertools import chain, islice
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+
+from core import versions
+
+from .models import Download, RelatedNote
+
+RECOMMENDATIONS = 'recommendations'
+CHUNK_PAIRS = 5_000_000
+FETCH_ROWS = 10_000
+
+
+def download_pairs(last_pk):
+    """
+    Distinct (user, note) pairs of approved notes as two arrays sorted by
+    user
+    """
+    rows = (
+        Download.objects.filter(pk__lte=last_pk, note__status='approved')
+        .values_list('user_id', 'note_id').distinct().order_by('user_id')
+        .iterator(chunk_size=FETCH_ROWS)
+    )
+    # Straight into int64 a chunk at a time: a list of tuples for every
+    # pair takes several times the memory of the arrays
+    chunks = [np.empty(0, dtype=np.int64)]
+    while len(chunk := np.fromiter(chain.from_iterable(islice(rows, FETCH_ROWS)), dtype=np.int64)):
+        chunks.append(chunk)
+    pairs = np.concatenate(chunks).reshape(-1, 2)
+    return pairs[:, 0], pairs[:, 1]
+
+
+def user_runs(users):
+    """
+    Start and length of each user's run in a user-sorted array
+    """
+    starts = np.flatnonzero(np.r_[True, users[1:] != users[:-1]]) if len(users) else np.array([], dtype=np.int64)
+    return starts, np.diff(np.r_[starts, len(users)])
+
+
+def co_downloads(users, items, targets, size):
+    """
+    (left, right, shared users) for every pair of distinct items
+    downloaded by the same users, with left in the targets mask. items are
+    indexes below size; users is sorted.
+    """
+    starts, lengths = user_runs(users)
+    cost = np.cumsum(lengths ** 2)
+    keys, counts = [], []
+    lo = 0
+    while lo < len(starts):
+        spent = cost[lo - 1] if lo else 0
+        hi = max(int(np.searchsorted(cost, spent + CHUNK_PAIRS, side='right')), lo + 1)
+        run_starts, run_lengths = starts[lo:hi], lengths[lo:hi]
+        # Every position of these users, with its user's run
+        left = np.arange(run_starts[0], run_starts[-1] + run_lengths[-1])
+        owner_start = np.repeat(run_starts, run_lengths)
+        owner_length = np.repeat(run_lengths, run_lengths)
+        keep = targets[items[left]]
+        left, owner_start, owner_length = left[keep], owner_start[keep], owner_length[keep]
+        # ... paired with every position of the same run
+        offsets = np.arange(owner_length.sum()) - np.repeat(np.cumsum(owner_length) - owner_length, owner_length)
+        right = np.repeat(owner_start, owner_length) + offsets
+        a, b = items[np.repeat(left, owner_length)], items[right]
+        distinct = a != b
+        chunk_keys, chunk_counts = np.unique(a[distinct] * size + b[distinct], return_counts=True)
+        keys.append(chunk_keys)
+        counts.append(chunk_counts)
+        lo = hi
+    if not keys:
+        empty = np.array([], dtype=np.int64)
+        return empty, empty, empty
+    unique_keys, inverse = np.unique(np.concatenate(keys), return_inverse=True)
+    shared = np.bincount(inverse, weights=np.concatenate(counts)).astype(np.int64)
+    return unique_keys // size, unique_keys % size, shared
+
+
+def top_neighbours(left, right, shared, popularity, limit, min_support):
+    """
+    (left, right, score, rank) of the best ``limit`` neighbours per item
+    """
+    keep = shared >= min_support
+    left, right, shared = left[keep], right[keep], shared[keep]
+    score = shared / np.sqrt(popularity[left] * popularity[right])
+    order = np.lexsort((right, -score, left))
+    left, right, score = left[order], right[order], score[order]
+    positions = np.arange(len(left))
+    first = np.r_[True, left[1:] != left[:-1]] if len(left) else np.array([], dtype=bool)
+    rank = positions - np.maximum.accumulate(np.where(first, positions, 0))
+    keep = rank < limit
+    return left[keep], right[keep], score[keep], rank[keep]
+
+
+def build(full=False, log=lambda message: None):
+    """
+    Bring the stored neighbours up to date; returns the number of notes
+    whose neighbours were recomputed
+    """
+    last_pk = Download.objects.order_by('-pk').values_list('pk', flat=True).first()
+    watermark, _ = versions.current(RECOMMENDATIONS)
+    if last_pk is None or (not full and watermark >= last_pk):
+        return 0
+    full = full or not watermark
+
+    users, note_ids = download_pairs(last_pk)
+    # Scrapers and the like
+    starts, lengths = user_runs(users)
+    regular = np.repeat(lengths <= settings.RECOMMENDATIONS_MAX_USER_NOTES, lengths)
+    users, note_ids = users[regular], note_ids[regular]
+    notes, items = np.unique(note_ids, return_inverse=True)
+    popularity = np.bincount(items, minlength=len(notes)).astype(np.float64)
+
+    if full:
+        targets = np.ones(len(notes), dtype=bool)
+    else:
+        recent = np.array(list(
+            Download.objects.filter(pk__gt=watermark, pk__lte=last_pk).values_list('user_id', flat=True).distinct()
+        ), dtype=np.int64)
+        targets = np.zeros(len(notes), dtype=bool)
+        targets[items[np.isin(users, recent)]] = True
+        # Only users who downloaded a target contribute to its row
+        involved = np.isin(users, np.unique(users[targets[items]]))
+        users, items = users[involved], items[involved]
+    log(f'{len(users):,} user/note pairs, {len(notes):,} notes, recomputing {int(targets.sum()):,}')
+
+    left, right, shared = co_downloads(users, items, targets, len(notes))
+    left, right, score, rank = top_neighbours(
+        left, right, shared, popularity, settings.RECOMMENDATIONS_STORED, settings.RECOMMENDATIONS_MIN_SUPPORT
+    )
+    rows = [
+        RelatedNote(note_id=note, related_id=related, score=value, rank=position)
+        for note, related, value, position in zip(
+            notes[left].tolist(), notes[right].tolist(), score.tolist(), rank.tolist()
+        )
+    ]
+    recomputed = notes[targets].tolist()
+    with transaction.atomic():
+        if full:
+            RelatedNote.objects.all().delete()
+        else:
+            for lo in range(0, len(recomputed), 500):
+                RelatedNote.objects.filter(note_id__in=recomputed[lo:lo + 500]).delete()
+        RelatedNote.objects.bulk_create(rows, batch_size=1000)
+        versions.set_value(RECOMMENDATIONS, last_pk)
+    return len(recomputed)
+
+
+def related_notes(note, limit=None):
+    """
+    The stored neighbours of a note that are still listed, best first
+    """
+    limit = limit or settings.RECOMMENDATIONS_SHOWN
+    rows = RelatedNote.objects.filter(note=note, related__status='approved').select_related('related__subject')
+    return [row.related for row in rows[:limit]]
@@ -0,0 +1,31 @@
+"""
+Retention policies for the notes event tables (see core.retention)
+"""
+from django.db.models import Count
+from django.db.models.functions import TruncDate
+
+from core.retention import Policy, register
+
+from .models import Download, ModerationAction, ModerationDailyStats
+from .rollups import backfill
+
+
+def rollup_moderation(start, end):
+    rows = (
+        ModerationAction.objects.filter(created_at__gte=start, created_at__lt=end)
+        .annotate(day=TruncDate('created_at'))
+        .values('day', 'moderator_id', 'action_type')
+        .annotate(actions=Count('id'))
+        .order_by()
+    )
+    ModerationDailyStats.objects.bulk_create(
+        (ModerationDailyStats(**row) for row in rows.iterator()),
+        batch_size=1000,
+        update_conflicts=True,
+        unique_fields=['day', 'moderator', 'action_type'],
+        update_fields=['actions'],
+    )
+
+
+register(Policy('downloads', Download, 'downloaded_at', keep_days=365, rollup=backfill))
+register(Policy('moderation_actions', ModerationAction, 'created_at', keep_days=730, rollup=rollup_moderation))
@@ -0,0 +1,147 @@
+"""
+Per-day download and view counts, per note (NoteDailyStats) and per
+subject (SubjectDailyStats).
+
+The download and view tasks add each event to its day's rows as it is
+recorded (``count_download``, ``count_view``). ``backfill`` recomputes the
+download columns of a range of days from the raw Download rows, for days
+recorded before the rollups existed or after a task was lost; it runs from
+the backfill_rollups command and before retention archives the raw rows.
+Views are only ever counted as they happen.
+
+``series`` turns rollup rows into chart data: a dense array per metric
+over the requested days, summed into day, week or month buckets.
+"""
+from datetime import timedelta
+
+import numpy as np
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from core.retention import day_start
+
+from .models import Download, Note, NoteDailyStats, SubjectDailyStats
+
+BUCKETS = ('day', 'week', 'month')
+
+
+def add(model, lookup, **counts):
+    """
+    Add counts to the row for lookup, creating it if needed
+    """
+    increments = {field: F(field) + n for field, n in counts.items()}
+    if model.objects.filter(**lookup).update(**increments):
+        return
+    try:
+        with transaction.atomic():
+            model.objects.create(**lookup, **counts)
+    except IntegrityError:
+        # Created by a concurrent event in the meantime
+        model.objects.filter(**lookup).update(**increments)
+
+
+def subject_of(note_id):
+    return Note.objects.filter(pk=note_id).values_list('subject_id', flat=True).first()
+
+
+def downloaded_that_day(note_id, user_id, downloaded_at):
+    """
+    Whether the user already downloaded the note on the day of
+    downloaded_at
+    """
+    day = timezone.localdate(downloaded_at)
+    return Download.objects.filter(
+        note_id=note_id, user_id=user_id,
+        downloaded_at__gte=day_start(day), downloaded_at__lt=day_start(day + timedelta(days=1)),
+    ).exists()
+
+
+def count_download(note_id, subject_id, downloaded_at, repeat):
+    """
+    Add a download to the rollups; ``repeat`` is whether the user had
+    downloaded the note that day already (``downloaded_that_day``)
+    """
+    day = timezone.localdate(downloaded_at)
+    add(NoteDailyStats, {'note_id': note_id, 'day': day}, downloads=1, downloaders=0 if repeat else 1)
+    add(SubjectDailyStats, {'subject_id': subject_id, 'day': day}, downloads=1)
+
+
+def count_view(note_id, subject_id, viewed_at, views=1):
+    day = timezone.localdate(viewed_at)
+    add(NoteDailyStats, {'note_id': note_id, 'day': day}, views=views)
+    add(SubjectDailyStats, {'subject_id': subject_id, 'day': day}, views=views)
+
+
+def backfill(start, end):
+    """
+    Recompute the download columns for the days in [start, end) (aware
+    datetimes on day boundaries) from the raw rows; view counts are kept
+    """
+    downloads = Download.objects.filter(downloaded_at__gte=start, downloaded_at__lt=end).annotate(
+        day=TruncDate('downloaded_at')
+    )
+    with transaction.atomic():
+        notes = (
+            downloads.values('note_id', 'day')
+            .annotate(downloads=Count('id'), downloaders=Count('user_id', distinct=True))
+            .order_by()
+        )
+        NoteDailyStats.objects.bulk_create(
+            (NoteDailyStats(**row) for row in notes.iterator()),
+            batch_size=1000,
+            update_conflicts=True,
+            unique_fields=['note', 'day'],
+            update_fields=['downloads', 'downloaders'],
+        )
+        subjects = (
+            downloads.values('day', subject_id=F('note__subject_id'))
+            .annotate(downloads=Count('id'))
+            .order_by()
+        )
+        SubjectDailyStats.objects.bulk_create(
+            (SubjectDailyStats(**row) for row in subjects.iterator()),
+            batch_size=1000,
+            update_conflicts=True,
+            unique_fields=['subject', 'day'],
+            update_fields=['downloads'],
+        )
+
+
+def series(rows, metrics, start, end, bucket='day'):
+    """
+    Chart data for rollup rows of (day, *metrics) with start <= day < end.
+    Several rows may fall on the same day (e.g. one per note); they are
+    added up. Returns the start day of every bucket and a list of sums per
+    metric, one entry per bucket.
+    """
+    days = np.arange(np.datetime64(start, 'D'), np.datetime64(end, 'D'))
+    dense = np.zeros((len(days), len(metrics)), dtype=np.int64)
+    rows = list(rows)
+    if rows:
+        offsets = np.fromiter((row[0].toordinal() for row in rows), dtype=np.int64, count=len(rows))
+        values = np.array([row[1:] for row in rows], dtype=np.int64)
+        np.add.at(dense, offsets - start.toordinal(), values)
+
+    if bucket == 'day':
+        keys = days
+    elif bucket == 'week':
+        # Day 0 of datetime64 is a Thursday; shifting by 3 starts weeks on Monday
+        keys = (days.astype(np.int64) + 3) // 7
+    else:
+        keys = days.astype('datetime64[M]')
+    edges = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]]) if len(days) else np.array([], dtype=np.int64)
+    sums = np.add.reduceat(dense, edges, axis=0) if len(edges) else dense
+
+    if bucket == 'week':
+        labels = (keys[edges] * 7 - 3).astype('datetime64[D]')
+    elif bucket == 'month':
+        labels = keys[edges].astype('datetime64[D]')
+    else:
+        labels = days
+    return {
+        'buckets': [str(label) for label in labels],
+        'series': {metric: sums[:, i].tolist() for i, metric in enumerate(metrics)},
+        'totals': {metric: int(total) for metric, total in zip(metrics, dense.sum(axis=0))},
+    }
@@ -0,0 +1,106 @@
+"""
+Keep cache validators in step with the data behind the catalog and detail
+pages (see core.conditional and core.pagecache).
+
+Besides the global catalog version, note changes bump dependency tags for
+the note's course, semester and subject, so the page cache only drops the
+filtered catalog pages that could show that note. Notes are also moved in
+and out of the trending rankings as they are listed and unlisted, and
+newly listed notes are added to the similarity index, matched against
+saved searches and fanned out to the followers of their subject and
+course.
+"""
+from django.db.models import F
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from core import versions
+
+from . import trending
+from .models import Course, Note, Rating, RatingHelpful, Semester, Subject
+from .tasks import fan_out_note, index_note, percolate_note
+
+CATALOG = 'catalog'
+ALL_NOTES = 'notes:all'
+TAXONOMY = 'taxonomy'
+FILTERS = 'catalog:filters'
+
+
+def note_tags(course_id, semester_id, subject_id):
+    return [f'course:{course_id}', f'semester:{semester_id}', f'subject:{subject_id}']
+
+
+@receiver(pre_save, sender=Note)
+def remember_listing(sender, instance, **kwargs):
+    # Where the note was listed before this save, if anywhere
+    instance._listed_before = None
+    if instance.pk:
+        instance._listed_before = Note.objects.filter(pk=instance.pk, status='approved').values_list(
+            'course_id', 'semester_id', 'subject_id'
+        ).first()
+
+
+def note_listed(note_id, location):
+    """
+    Take a note that was just listed into the trending rankings, the
+    similarity index, saved search matches and its followers' digests.
+    ``location`` is its (course, semester, subject) ids. post_save calls
+    this; bulk inserts send no signals and must call it themselves.
+    """
+    trending.relist(note_id, None, location)
+    index_note.defer(note_id)
+    percolate_note.defer(note_id)
+    fan_out_note.defer(note_id)
+
+
+@receiver(post_save, sender=Note)
+def note_saved(sender, instance, created, **kwargs):
+    before = getattr(instance, '_listed_before', None)
+    listed = instance.status == 'approved'
+    location = (instance.course_id, instance.semester_id, instance.subject_id)
+    if listed and before is None:
+        note_listed(instance.pk, location)
+    else:
+        trending.relist(instance.pk, before, location if listed else None)
+    # Pending and rejected notes never appear in the catalog
+    if not listed and before is None:
+        return
+    tags = [CATALOG, ALL_NOTES]
+    if before:
+        tags += note_tags(*before)
+    if listed:
+        tags += note_tags(*location)
+    versions.bump_many(tags)
+
+
+@receiver(post_delete, sender=Note)
+def note_deleted(sender, instance, **kwargs):
+    if instance.status == 'approved':
+        trending.relist(instance.pk, (instance.course_id, instance.semester_id, instance.subject_id), None)
+        versions.bump_many(
+            [CATALOG, ALL_NOTES] + note_tags(instance.course_id, instance.semester_id, instance.subject_id)
+        )
+
+
+@receiver(post_save, sender=Course)
+@receiver(post_delete, sender=Course)
+@receiver(post_save, sender=Semester)
+@receiver(post_delete, sender=Semester)
+@receiver(post_save, sender=Subject)
+@receiver(post_delete, sender=Subject)
+def taxonomy_changed(sender, instance, **kwargs):
+    # Every catalog page lists all courses and semesters in its filters,
+    # and its note cards name the course, semester and subject of each note
+    versions.bump_many([CATALOG, TAXONOMY, FILTERS, f'{sender._meta.model_name}:{instance.pk}'])
+
+
+@receiver(post_save, sender=Rating)
+@receiver(post_delete, sender=Rating)
+def rating_changed(sender, instance, **kwargs):
+    Note.objects.filter(pk=instance.note_id).update(rating_version=F('rating_version') + 1)
+
+
+@receiver(post_save, sender=RatingHelpful)
+@receiver(post_delete, sender=RatingHelpful)
+def helpful_changed(sender, instance, **kwargs):
+    Note.objects.filter(ratings=instance.rating_id).update(rating_version=F('rating_version') + 1)
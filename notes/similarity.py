@@ -0,0 +1,512 @@
+"""
+"More like this": content similarity between notes.
+
+Every approved note becomes a TF-IDF vector over the words of its title,
+tags, description and file text (see notes.extract), with words in the
+title and tags counting extra. ``build`` tokenizes all notes once, then
+weighs, normalizes and inverts the whole document-term matrix with a few
+NumPy array operations. Neighbours are found a block of notes at a time:
+the block's strongest terms are looked up in the inverted index and their
+products summed into a dense block of approximate similarities. The best
+candidates of each note are then scored exactly on all their terms, and
+the top SIMILARITY_NEIGHBOURS kept as SimilarNote rows. The index itself
+(vocabulary, IDF and postings) is saved under SIMILARITY_INDEX_DIR for
+free-text queries.
+
+Approving a note adds it with ``add_note`` instead of a rebuild. It is
+weighed with the existing vocabulary and IDF, gets its own neighbours and
+takes its place in the lists of the notes closest to it. Words new to the
+index are ignored, and document frequencies drift, until the next full
+build; notes unlisted meanwhile stay in the index and are filtered out by
+readers. Notes imported in bulk (import_notes) are added the same way.
+
+Added notes go to a small delta segment (delta.npz) rather than the main
+index, so adding one costs a scan of the delta, not a rewrite of every
+posting. Searches score both; a note in the delta overrides its old
+vector in the main index. Once the delta holds SIMILARITY_DELTA_NOTES
+notes it is merged into the main index in one pass, and a full build
+starts a new, empty one. The delta records the build (generation) its
+term ids belong to and is ignored next to any other.
+
+``search`` answers text queries from the saved index and delta, which
+each process loads once and reloads when their files change.
+"""
+import fcntl
+import io
+import multiprocessing
+import os
+import re
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from pathlib import Path
+
+import numpy as np
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import connections, transaction
+
+from core.retention import write_atomically
+
+from .extract import extract_text
+from .models import Note, SimilarNote
+
+TOKEN = re.compile(r'[^\W_]{2,}')
+STOP_WORDS = frozenset('''
+    about above after again all also and any are because been before being below between both but can
+    could did does doing down during each few for from further had has have having her here hers him
+    his how into its itself just more most not now off once only other our out over own same she should
+    some such than that the their them then there these they this those through too under until very
+    was were what when where which while who whom why will with would you your
+'''.split())
+FIELD_WEIGHTS = (3, 2, 1, 1)  # title, tags, description, file text
+BLOCK_PAIRS = 5_000_000
+BLOCK_CELLS = 4_000_000
+COMMON_TERM_SHARE = 0.02
+MIN_COMMON_TERM = 200
+
+_lock = threading.Lock()
+_loaded = {}  # path -> (mtime_ns, Index or Delta)
+
+
+def tokens(text):
+    return [token for token in TOKEN.findall(text.lower()) if token not in STOP_WORDS and not token.isdigit()]
+
+
+def term_counts(title, tags, description, text):
+    counts = Counter()
+    for field, weight in zip((title, tags.replace(',', ' '), description, text), FIELD_WEIGHTS):
+        for token in tokens(field):
+            counts[token] += weight
+    return counts
+
+
+def top(notes, scores, limit):
+    """
+    [(note id, score)] of the best scoring notes, best first
+    """
+    count = min(limit, int(np.count_nonzero(scores > 0)))
+    if not count:
+        return []
+    best = np.argpartition(-scores, count - 1)[:count]
+    best = best[np.argsort(-scores[best], kind='stable')]
+    return list(zip(notes[best].tolist(), scores[best].tolist()))
+
+
+def ranges(lengths):
+    """
+    0..n-1 for every n in lengths, concatenated
+    """
+    return np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+
+
+def index_path():
+    return Path(settings.SIMILARITY_INDEX_DIR) / 'index.npz'
+
+
+def delta_path():
+    return Path(settings.SIMILARITY_INDEX_DIR) / 'delta.npz'
+
+
+def local_path(name):
+    if not name:
+        return ''
+    try:
+        return default_storage.path(name)
+    except NotImplementedError:
+        # Remote storage: the note is matched on its metadata only
+        return ''
+
+
+class Index:
+    """
+    Vocabulary, IDF and the document-term matrix stored by term: the
+    notes (as positions in ``notes``) and weights using term t are
+    ``postings[pointers[t]:pointers[t + 1]]`` and the same slice of
+    ``weights``
+    """
+
+    def __init__(self, generation, terms, idf, notes, pointers, postings, weights):
+        self.generation = generation
+        self.terms = terms
+        self.vocabulary = {term: i for i, term in enumerate(terms)}
+        self.idf = idf
+        self.notes = notes
+        self.pointers = pointers
+        self.postings = postings
+        self.weights = weights
+
+    @classmethod
+    def from_entries(cls, generation, terms, idf, notes, docs, term_ids, weights):
+        order = np.lexsort((docs, term_ids))
+        pointers = np.r_[0, np.cumsum(np.bincount(term_ids, minlength=len(terms)))]
+        return cls(generation, terms, idf, notes, pointers, docs[order], weights[order].astype(np.float32))
+
+    def entries(self):
+        """
+        (docs, terms, weights) of every non-zero cell
+        """
+        term_ids = np.repeat(np.arange(len(self.terms)), np.diff(self.pointers))
+        return self.postings, term_ids, self.weights
+
+    def vector(self, counts):
+        """
+        A unit TF-IDF vector as (term ids, weights); unknown words are
+        dropped
+        """
+        known = [(self.vocabulary[term], count) for term, count in counts.items() if term in self.vocabulary]
+        if not known:
+            return np.array([], dtype=np.int64), np.array([], dtype=np.float64)
+        term_ids = np.array([term for term, _ in known], dtype=np.int64)
+        weights = (1 + np.log([count for _, count in known])) * self.idf[term_ids]
+        return term_ids, weights / np.linalg.norm(weights)
+
+    def scores(self, term_ids, weights):
+        """
+        Cosine similarity of a unit vector to every note
+        """
+        lengths = self.pointers[term_ids + 1] - self.pointers[term_ids]
+        positions = np.repeat(self.pointers[term_ids], lengths) + ranges(lengths)
+        return np.bincount(
+            self.postings[positions],
+            weights=np.repeat(weights, lengths) * self.weights[positions],
+            minlength=len(self.notes),
+        )
+
+    def merge(self, delta):
+        """
+        A copy with the delta's notes added, or replacing their old vectors
+        """
+        docs, term_ids, weights = self.entries()
+        replaced = np.isin(self.notes, delta.notes)
+        keep = ~replaced[docs]
+        added = ~np.isin(delta.notes, self.notes)
+        notes = np.r_[self.notes, delta.notes[added]]
+        # Where each delta note ends up; merged notes are appended, so the
+        # ids are not in order
+        order = np.argsort(self.notes)
+        positions = np.empty(len(delta.notes), dtype=np.int64)
+        positions[~added] = order[np.searchsorted(self.notes, delta.notes[~added], sorter=order)]
+        positions[added] = len(self.notes) + np.arange(np.count_nonzero(added))
+        return Index.from_entries(
+            self.generation, self.terms, self.idf, notes,
+            np.r_[docs[keep], positions[delta.docs]],
+            np.r_[term_ids[keep], delta.term_ids],
+            np.r_[weights[keep], delta.weights],
+        )
+
+    def save(self, path):
+        buffer = io.BytesIO()
+        np.savez(buffer, generation=self.generation, terms=np.array(self.terms, dtype=str), idf=self.idf,
+                 notes=self.notes, pointers=self.pointers, postings=self.postings, weights=self.weights)
+        write_atomically(path, buffer.getvalue())
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(int(data['generation']), data['terms'].tolist(), data['idf'], data['notes'],
+                       data['pointers'], data['postings'], data['weights'])
+
+
+class Delta:
+    """
+    Notes added since the index was built or merged, as (doc, term,
+    weight) entries in the index's term ids. Scored by a scan, which stays
+    cheap as long as the delta is small.
+    """
+
+    def __init__(self, generation, notes, docs, term_ids, weights):
+        self.generation = generation
+        self.notes = notes
+        self.docs = docs
+        self.term_ids = term_ids
+        self.weights = weights
+
+    @classmethod
+    def empty(cls, generation):
+        nothing = np.array([], dtype=np.int64)
+        return cls(generation, nothing, nothing, nothing, np.array([], dtype=np.float32))
+
+    def scores(self, term_ids, weights):
+        """
+        Cosine similarity of a unit vector to every note in the delta
+        """
+        if not len(term_ids):
+            return np.zeros(len(self.notes))
+        order = np.argsort(term_ids)
+        term_ids, weights = term_ids[order], weights[order]
+        found = np.minimum(np.searchsorted(term_ids, self.term_ids), len(term_ids) - 1)
+        products = np.where(term_ids[found] == self.term_ids, self.weights * weights[found], 0)
+        return np.bincount(self.docs, weights=products, minlength=len(self.notes))
+
+    def replace(self, note_id, term_ids, weights):
+        """
+        A copy with one note's vector added or replaced
+        """
+        found = np.flatnonzero(self.notes == note_id)
+        if len(found):
+            position, notes = int(found[0]), self.notes
+            keep = self.docs != position
+        else:
+            position, notes = len(self.notes), np.r_[self.notes, note_id]
+            keep = slice(None)
+        return Delta(
+            self.generation, notes,
+            np.r_[self.docs[keep], np.full(len(term_ids), position)],
+            np.r_[self.term_ids[keep], term_ids],
+            np.r_[self.weights[keep], weights.astype(np.float32)],
+        )
+
+    def save(self, path):
+        buffer = io.BytesIO()
+        np.savez(buffer, generation=self.generation, notes=self.notes, docs=self.docs,
+                 term_ids=self.term_ids, weights=self.weights)
+        write_atomically(path, buffer.getvalue())
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(int(data['generation']), data['notes'], data['docs'], data['term_ids'], data['weights'])
+
+
+def nearest(index, delta, term_ids, weights, limit, exclude=None):
+    """
+    [(note id, score)] of the notes in the index and delta closest to a
+    unit vector, best first, leaving out the note id exclude
+    """
+    scores = index.scores(term_ids, weights)
+    # The delta holds the current vectors of the notes it has
+    scores[np.isin(index.notes, delta.notes)] = 0
+    notes = np.r_[index.notes, delta.notes]
+    scores = np.r_[scores, delta.scores(term_ids, weights)]
+    if exclude is not None:
+        scores[notes == exclude] = 0
+    return top(notes, scores, limit)
+
+
+@contextmanager
+def index_lock():
+    directory = Path(settings.SIMILARITY_INDEX_DIR)
+    directory.mkdir(parents=True, exist_ok=True)
+    with open(directory / '.lock', 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        yield
+
+
+def load_cached(path, cls):
+    """
+    The saved file at path, loaded once per change, or None if missing
+    """
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+    with _lock:
+        if path not in _loaded or _loaded[path][0] != mtime:
+            _loaded[path] = (mtime, cls.load(path))
+        return _loaded[path][1]
+
+
+def current_index():
+    """
+    The saved index and its delta, or (None, None) before the first build
+    """
+    index = load_cached(index_path(), Index)
+    if index is None:
+        return None, None
+    delta = load_cached(delta_path(), Delta)
+    if delta is None or delta.generation != index.generation:
+        # Written against an earlier build's term ids
+        delta = Delta.empty(index.generation)
+    return index, delta
+
+
+def search(text, limit):
+    """
+    [(note id, score)] of the notes closest to a piece of text
+    """
+    index, delta = current_index()
+    if index is None:
+        return []
+    return nearest(index, delta, *index.vector(Counter(tokens(text))), limit)
+
+
+# Building
+
+def exact_scores(index, docs, term_ids, weights, left, right):
+    """
+    Cosine similarity of each (left, right) pair of note positions, from
+    the entries sorted by note
+    """
+    vocabulary = len(index.terms)
+    keys = docs * vocabulary + term_ids
+    starts = np.searchsorted(docs, left)
+    lengths = np.searchsorted(docs, left, side='right') - starts
+    positions = np.repeat(starts, lengths) + ranges(lengths)
+    wanted = np.repeat(right, lengths) * vocabulary + term_ids[positions]
+    found = np.minimum(np.searchsorted(keys, wanted), len(keys) - 1)
+    products = np.where(keys[found] == wanted, weights[positions] * weights[found], 0)
+    return np.bincount(np.repeat(np.arange(len(left)), lengths), weights=products, minlength=len(left))
+
+
+def neighbours(index, limit):
+    """
+    Yield (note id, [(similar id, score)]) for every note. Candidates are
+    found by matching each note on its SIMILARITY_QUERY_TERMS strongest
+    terms, leaving out the commonest words, then scored on all of them.
+    """
+    size = len(index.notes)
+    count = min(limit, size - 1)
+    if count <= 0:
+        return
+    candidates = min(2 * limit, size - 1)
+    docs, term_ids, weights = index.entries()
+    order = np.lexsort((-weights, docs))
+    docs, term_ids, weights = docs[order], term_ids[order], weights[order].astype(np.float64)
+    by_term = np.lexsort((term_ids, docs))
+    all_docs, all_terms, all_weights = docs[by_term], term_ids[by_term], weights[by_term]
+    positions = np.arange(len(docs))
+    first = np.r_[True, docs[1:] != docs[:-1]] if len(docs) else np.array([], dtype=bool)
+    strongest = positions - np.maximum.accumulate(np.where(first, positions, 0)) < settings.SIMILARITY_QUERY_TERMS
+    # Words most notes share nominate every note and tell little apart;
+    # they still count in the exact scores
+    frequency = np.diff(index.pointers)
+    strongest &= frequency[term_ids] <= max(COMMON_TERM_SHARE * size, MIN_COMMON_TERM)
+    docs, term_ids, weights = docs[strongest], term_ids[strongest], weights[strongest]
+
+    lengths = frequency[term_ids]
+    cost = np.cumsum(np.bincount(docs, weights=lengths, minlength=size))
+    bounds = np.searchsorted(docs, np.arange(size + 1))
+    rows_per_block = max(1, BLOCK_CELLS // size)
+    lo = 0
+    while lo < size:
+        spent = cost[lo - 1] if lo else 0
+        hi = int(np.searchsorted(cost, spent + BLOCK_PAIRS, side='right'))
+        hi = min(max(hi, lo + 1), lo + rows_per_block, size)
+        block = slice(bounds[lo], bounds[hi])
+        block_lengths = lengths[block]
+        cells = np.repeat(index.pointers[term_ids[block]], block_lengths) + ranges(block_lengths)
+        rows = np.repeat(docs[block] - lo, block_lengths)
+        scores = np.bincount(
+            rows * size + index.postings[cells],
+            weights=np.repeat(weights[block], block_lengths) * index.weights[cells],
+            minlength=(hi - lo) * size,
+        ).reshape(hi - lo, size)
+        scores[np.arange(hi - lo), np.arange(lo, hi)] = 0
+        best = np.argpartition(-scores, candidates - 1, axis=1)[:, :candidates]
+        found = np.take_along_axis(scores, best, axis=1) > 0
+        left = np.repeat(np.arange(lo, hi), candidates)[found.ravel()]
+        right = best[found]
+        exact = exact_scores(index, all_docs, all_terms, all_weights, left, right)
+        order = np.lexsort((-exact, left))
+        left, right, exact = left[order], right[order], exact[order]
+        ends = np.searchsorted(left, np.arange(lo, hi + 1))
+        for row in range(hi - lo):
+            picked = slice(ends[row], min(ends[row] + count, ends[row + 1]))
+            yield int(index.notes[lo + row]), list(zip(index.notes[right[picked]].tolist(), exact[picked].tolist()))
+        lo = hi
+
+
+def similar_rows(note_id, ranked):
+    return [
+        SimilarNote(note_id=note_id, similar_id=similar_id, score=score, rank=rank)
+        for rank, (similar_id, score) in enumerate(ranked)
+    ]
+
+
+def build(workers=None, log=lambda message: None):
+    """
+    Rebuild the index and every note's neighbours; returns the number of
+    notes indexed
+    """
+    rows = list(Note.objects.filter(status='approved').order_by('pk').values_list(
+        'pk', 'title', 'tags', 'description', 'file'
+    ))
+    # Extraction processes run without Django; never share the parent's connections
+    connections.close_all()
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+        texts = list(pool.map(extract_text, [local_path(row[4]) for row in rows], chunksize=8))
+    log(f'Extracted text from {sum(1 for text in texts if text):,} of {len(rows):,} file(s)')
+
+    vocabulary = {}
+    docs, term_ids, counts = [], [], []
+    for doc, ((pk, title, tags, description, _), text) in enumerate(zip(rows, texts)):
+        for term, count in term_counts(title, tags, description, text).items():
+            docs.append(doc)
+            term_ids.append(vocabulary.setdefault(term, len(vocabulary)))
+            counts.append(count)
+    docs = np.array(docs, dtype=np.int64)
+    term_ids = np.array(term_ids, dtype=np.int64)
+    counts = np.array(counts, dtype=np.float64)
+
+    # TF-IDF with sublinear term frequency and smoothed IDF, unit length per note
+    document_frequency = np.bincount(term_ids, minlength=len(vocabulary))
+    idf = np.log((1 + len(rows)) / (1 + document_frequency)) + 1
+    weights = (1 + np.log(counts)) * idf[term_ids]
+    weights /= np.sqrt(np.bincount(docs, weights=weights * weights, minlength=len(rows)))[docs]
+    index = Index.from_entries(
+        time.time_ns(), list(vocabulary), idf, np.array([row[0] for row in rows], dtype=np.int64),
+        docs, term_ids, weights,
+    )
+    log(f'{len(rows):,} notes, {len(vocabulary):,} terms, {len(docs):,} entries')
+
+    similar = []
+    for note_id, ranked in neighbours(index, settings.SIMILARITY_NEIGHBOURS):
+        similar.extend(similar_rows(note_id, ranked))
+    with index_lock():
+        with transaction.atomic():
+            SimilarNote.objects.all().delete()
+            SimilarNote.objects.bulk_create(similar, batch_size=1000)
+        index.save(index_path())
+        # Notes added meanwhile are in the new index; the old generation's
+        # delta is ignored anyway
+        delta_path().unlink(missing_ok=True)
+    return len(rows)
+
+
+def add_note(note_id):
+    """
+    Index one newly listed note without rebuilding
+    """
+    row = Note.objects.filter(pk=note_id, status='approved').values_list(
+        'title', 'tags', 'description', 'file'
+    ).first()
+    if row is None:
+        return
+    title, tags, description, name = row
+    limit = settings.SIMILARITY_NEIGHBOURS
+    with index_lock():
+        index, delta = current_index()
+        if index is None:
+            # The first build will include it
+            return
+        term_ids, weights = index.vector(term_counts(title, tags, description, extract_text(local_path(name))))
+        ranked = nearest(index, delta, term_ids, weights, limit, exclude=note_id)
+
+        with transaction.atomic():
+            SimilarNote.objects.filter(note_id=note_id).delete()
+            SimilarNote.objects.bulk_create(similar_rows(note_id, ranked))
+            # Cosine similarity is symmetric: the note may now belong in
+            # its neighbours' own lists
+            lists = {}
+            for owner, similar_id, score in SimilarNote.objects.filter(
+                note_id__in=[similar_id for similar_id, _ in ranked]
+            ).exclude(similar_id=note_id).values_list('note_id', 'similar_id', 'score'):
+                lists.setdefault(owner, []).append((similar_id, score))
+            changed = {}
+            for similar_id, score in ranked:
+                current = lists.get(similar_id, [])
+                if len(current) < limit or score > min(s for _, s in current):
+                    changed[similar_id] = sorted(current + [(note_id, score)], key=lambda item: -item[1])[:limit]
+            if changed:
+                SimilarNote.objects.filter(note_id__in=changed).delete()
+                SimilarNote.objects.bulk_create(
+                    [row for owner, ranked_list in changed.items() for row in similar_rows(owner, ranked_list)]
+                )
+        delta = delta.replace(note_id, term_ids, weights)
+        if len(delta.notes) >= settings.SIMILARITY_DELTA_NOTES:
+            index.merge(delta).save(index_path())
+            delta = Delta.empty(index.generation)
+        delta.save(delta_path())
@@ -0,0 +1,119 @@
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils.dateparse import parse_datetime
+
+from core.models import Task
+from core.taskqueue import enqueue, task
+
+from . import notifications, percolator, purge, rollups, similarity, trending
+from .models import Download, Note
+
+
+@task
+def record_download(note_id, user_id, ip_address, downloaded_at, subject_id=None):
+    """
+    Log a download, bump the note's counter and add it to the daily
+    rollups in one transaction
+    """
+    downloaded_at = parse_datetime(downloaded_at)
+    subject_id = subject_id or rollups.subject_of(note_id)
+    # The transaction opens with a write: SQLite cannot turn a deferred
+    # transaction's read lock into a write lock while another download
+    # holds one, and fails instead of waiting. Once the UPDATE holds the
+    # write lock no other download of the day can slip in, so the repeat
+    # check is read after it
+    with transaction.atomic():
+        Note.objects.filter(pk=note_id).update(download_count=F('download_count') + 1)
+        repeat = rollups.downloaded_that_day(note_id, user_id, downloaded_at)
+        rollups.count_download(note_id, subject_id, downloaded_at, repeat)
+        Download.objects.create(
+            note_id=note_id,
+            user_id=user_id,
+            ip_address=ip_address,
+            downloaded_at=downloaded_at,
+        )
+        trending.record(note_id, 'download', downloaded_at)
+    schedule_trending_refresh()
+
+
+@task
+def record_views(counts, viewed_at):
+    """
+    Add a batch of page views, [note id, subject id, views] each (see
+    notes.viewcounts), to the notes' counters, rollups and trending scores
+    """
+    viewed_at = parse_datetime(viewed_at)
+    with transaction.atomic():
+        for note_id, subject_id, views in counts:
+            Note.objects.filter(pk=note_id).update(view_count=F('view_count') + views)
+            rollups.count_view(note_id, subject_id or rollups.subject_of(note_id), viewed_at, views)
+            trending.record(note_id, 'view', viewed_at, weight=views)
+    schedule_trending_refresh()
+
+
+@task
+def record_rating(note_id, rating, rated_at):
+    trending.record(note_id, 'rating', parse_datetime(rated_at), weight=rating / 5)
+    schedule_trending_refresh()
+
+
+@task
+def refresh_trending():
+    trending.refresh()
+
+
+def schedule_trending_refresh():
+    """
+    Queue a ranking refresh TRENDING_REFRESH_INTERVAL from now, unless one
+    is waiting already
+    """
+    if not Task.objects.filter(name=refresh_trending.name, status=Task.QUEUED).exists():
+        enqueue(refresh_trending, delay=settings.TRENDING_REFRESH_INTERVAL or None)
+
+
+@task
+def index_note(note_id):
+    similarity.add_note(note_id)
+
+
+@task
+def percolate_note(note_id):
+    if percolator.percolate(note_id):
+        schedule_digests()
+
+
+@task
+def fan_out_note(note_id, facet=notifications.FACETS[0], after=0):
+    """
+    Notify one page of a newly approved note's followers, then queue the
+    next page, or the digests once all are done
+    """
+    following = notifications.notify_followers(note_id, facet, after)
+    if following is not None:
+        fan_out_note.defer(note_id, *following)
+    else:
+        schedule_digests()
+
+
+@task
+def send_digests():
+    notifications.send_digests()
+
+
+def schedule_digests():
+    """
+    Queue a digest run NOTIFICATION_DIGEST_DELAY from now, unless one is
+    waiting already
+    """
+    if not Task.objects.filter(name=send_digests.name, status=Task.QUEUED).exists():
+        enqueue(send_digests, delay=settings.NOTIFICATION_DIGEST_DELAY or None)
+
+
+@task
+def purge_note(note_id):
+    """
+    Purge a deleted note for a bounded time, then queue the rest
+    """
+    if not purge.purge(note_id, settings.NOTE_PURGE_TASK_SECONDS):
+        purge_note.defer(note_id)
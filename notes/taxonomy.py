@@ -0,0 +1,67 @@
+"""
+The whole course -> semester -> subject tree as one JSON document.
+
+Forms that pick a subject filter it client-side from this document instead
+of rendering every subject or asking the server on each dropdown change.
+The document is built once per process and rebuilt only when the
+'taxonomy' version (bumped by notes.signals on any Course, Semester or
+Subject change) moves on, so serving it costs one version lookup.
+
+Shape::
+
+    {"version": 12,
+     "semesters": [{"id": 1, "number": 1, "name": "Semester 1"}, ...],
+     "courses": [{"id": 3, "code": "CS", "name": "Computer Science",
+                  "semesters": {"1": [{"id": 7, "code": "CS101", "name": "..."}]}}]}
+"""
+import hashlib
+import json
+import threading
+
+from core import versions
+
+from .models import Course, Semester, Subject
+from .signals import TAXONOMY
+
+
+# (version, updated_at, body, etag)
+_document = None
+_lock = threading.Lock()
+
+
+def build():
+    """
+    The taxonomy tree from three flat queries
+    """
+    courses = {
+        course['id']: {**course, 'semesters': {}}
+        for course in Course.objects.order_by('name').values('id', 'code', 'name')
+    }
+    subjects = Subject.objects.order_by('name').values_list('id', 'code', 'name', 'course_id', 'semester_id')
+    for pk, code, name, course_id, semester_id in subjects:
+        courses[course_id]['semesters'].setdefault(str(semester_id), []).append(
+            {'id': pk, 'code': code, 'name': name}
+        )
+    return {
+        'semesters': list(Semester.objects.order_by('number').values('id', 'number', 'name')),
+        'courses': list(courses.values()),
+    }
+
+
+def document():
+    """
+    (body, etag, updated_at) for the current document, rebuilt if the
+    taxonomy changed since it was built
+    """
+    global _document
+    version, updated_at = versions.current(TAXONOMY)
+    cached = _document
+    if cached is None or cached[0] != version:
+        with _lock:
+            # Another thread may have rebuilt it while this one waited
+            if _document is None or _document[0] != version:
+                body = json.dumps({'version': version, **build()}, separators=(',', ':')).encode()
+                etag = '"taxonomy-%s"' % hashlib.blake2b(body, digest_size=8).hexdigest()
+                _document = (version, updated_at, body, etag)
+            cached = _document
+    return cached[2], cached[3], cached[1]
@@ -1,3 +1,762 @@
-from django.test import TestCase
+import hashlib
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from io import StringIO
+from pathlib import Path
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.admin import site
+from django.core import mail
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.mail import get_connection
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.http import content_disposition_header
+
+from accounts.models import User
+from core import retention
+from core.testing import QueryBudgetTestCase
+
+from . import notifications, percolator, purge, recommendations, similarity, trending, viewcounts, views
+from .models import (
+    Course, Download, ModerationAction, Note, NoteDailyStats, Notification, Rating, RatingHelpful, Report, Semester,
+    SimilarNote, Subject, SubjectDailyStats, TrendingList,
+)
+from .tasks import record_download
+
+# Nothing a test does may touch the real index or uploads
+isolated = override_settings(SIMILARITY_INDEX_DIR=tempfile.mkdtemp(), MEDIA_ROOT=tempfile.mkdtemp())
+
+
+def make_subject(code='CS101'):
+    course, _ = Course.objects.get_or_create(code='BCS', defaults={'name': 'Computer Science'})
+    semester, _ = Semester.objects.get_or_create(number=1, defaults={'name': 'First'})
+    return Subject.objects.create(name=f'Subject {code}', code=code, course=course, semester=semester)
+
+
+def make_note(uploader, subject, status='approved', **fields):
+    return Note.objects.create(
+        title=fields.pop('title', 'Lecture notes'),
+        description=fields.pop('description', 'Notes from the lectures'),
+        subject=subject,
+        course=subject.course,
+        semester=subject.semester,
+        file=fields.pop('file', 'notes/2026/01/lecture.pdf'),
+        uploaded_by=uploader,
+        status=status,
+        **fields,
+    )
+
+
+@isolated
+class ConcurrentDownloadTests(TransactionTestCase):
+    readers = 12
+
+    def test_concurrent_downloads_all_recorded(self):
+        uploader = User.objects.create_user('uploader', password='x')
+        note = make_note(uploader, make_subject())
+        readers = [User.objects.create_user(f'reader{i}', password='x') for i in range(self.readers)]
+        now = timezone.now().isoformat()
+        start = threading.Barrier(self.readers)
+        errors = []
+
+        def download(user):
+            try:
+                start.wait()
+                record_download(note.pk, user.pk, '127.0.0.1', now, note.subject_id)
+            except Exception as exc:
+                errors.append(exc)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=download, args=(user,)) for user in readers]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(Download.objects.filter(note=note).count(), self.readers)
+        note.refresh_from_db()
+        self.assertEqual(note.download_count, self.readers)
+        stats = NoteDailyStats.objects.get(note=note)
+        self.assertEqual((stats.downloads, stats.downloaders), (self.readers, self.readers))
+        self.assertEqual(SubjectDailyStats.objects.get(subject=note.subject).downloads, self.readers)
+
+
+@isolated
+class DeletedNoteModerationTests(TestCase):
+    def setUp(self):
+        uploader = User.objects.create_user('uploader', password='x')
+        self.note = make_note(uploader, make_subject(), status='pending')
+        self.note.soft_delete()
+        self.client.force_login(User.objects.create_user('moderator', password='x', role='moderator'))
+
+    def test_deleted_note_cannot_be_moderated_or_reported(self):
+        for name in ('notes:approve_note', 'notes:reject_note', 'moderation:approve_note', 'notes:report'):
+            with self.subTest(name):
+                response = self.client.post(reverse(name, args=[self.note.pk]), {'reason': 'spam'})
+                self.assertEqual(response.status_code, 404)
+        self.note.refresh_from_db()
+        self.assertEqual(self.note.status, 'deleted')
+
+    def test_note_deleted_after_the_lookup_stays_deleted(self):
+        note = make_note(self.note.uploaded_by, self.note.subject, status='pending')
+        fetch = views.get_object_or_404
+
+        def fetch_then_delete(*args, **kwargs):
+            found = fetch(*args, **kwargs)
+            Note.objects.get(pk=note.pk).soft_delete()
+            return found
+
+        for name in ('notes:approve_note', 'notes:reject_note'):
+            with self.subTest(name), mock.patch.object(views, 'get_object_or_404', fetch_then_delete):
+                note.status = 'pending'
+                note.save()
+                response = self.client.post(reverse(name, args=[note.pk]))
+                self.assertEqual(response.status_code, 404)
+                note.refresh_from_db()
+                self.assertEqual(note.status, 'deleted')
+
+    def test_other_notes_can_still_be_moderated_either_way(self):
+        subject = self.note.subject
+        rejected = make_note(self.note.uploaded_by, subject, status='rejected')
+        approved = make_note(self.note.uploaded_by, subject)
+        self.client.post(reverse('notes:approve_note', args=[rejected.pk]))
+        self.client.post(reverse('notes:reject_note', args=[approved.pk]))
+        rejected.refresh_from_db()
+        approved.refresh_from_db()
+        self.assertEqual((rejected.status, approved.status), ('approved', 'rejected'))
+
+
+@isolated
+@override_settings(VIEW_COUNT_FLUSH_INTERVAL=3600)
+class ViewCountTests(TestCase):
+    def test_views_are_recorded_in_one_batch(self):
+        note = make_note(User.objects.create_user('uploader', password='x'), make_subject())
+        for _ in range(3):
+            self.assertIsNone(viewcounts.add(note.pk, note.subject_id))
+        with self.captureOnCommitCallbacks(execute=True):
+            viewcounts.flush()
+        note.refresh_from_db()
+        self.assertEqual(note.view_count, 3)
+        self.assertEqual(NoteDailyStats.objects.get(note=note).views, 3)
+        self.assertEqual(SubjectDailyStats.objects.get(subject=note.subject).views, 3)
+
+    @override_settings(VIEW_COUNT_FLUSH_INTERVAL=0.1)
+    def test_idle_buffer_is_flushed_by_the_timer(self):
+        self.enterContext(mock.patch.object(viewcounts, '_last_flush', time.monotonic()))
+        self.enterContext(mock.patch.dict(viewcounts._pending, clear=True))
+        with mock.patch.object(viewcounts, '_timer', None), mock.patch.object(viewcounts, 'flush') as flush:
+            self.assertIsNone(viewcounts.add(1, 1))
+            timer = viewcounts._timer
+            timer.join(5)
+            # No further view came in, the timer flushed on its own
+            flush.assert_called_once_with()
+            self.assertIsNone(viewcounts._timer)
+
+
+@isolated
+class TrendingRefreshTests(TestCase):
+    def test_events_reach_the_rankings_on_refresh(self):
+        uploader = User.objects.create_user('uploader', password='x')
+        subject = make_subject()
+        quiet, busy = make_note(uploader, subject), make_note(uploader, subject)
+        now = timezone.now()
+        trending.record(quiet.pk, 'view', now)
+        for _ in range(3):
+            trending.record(busy.pk, 'download', now)
+        # Events only flag the notes
+        self.assertEqual(trending.top(trending.GLOBAL, 10), [])
+        self.assertEqual(Note.objects.filter(trend_changed=True).count(), 2)
+
+        self.assertEqual(trending.refresh(), 2)
+        for key in trending.facet_keys(subject.course_id, subject.semester_id, subject.pk):
+            self.assertEqual(trending.top(key, 10), [busy.pk, quiet.pk])
+        self.assertFalse(Note.objects.filter(trend_changed=True).exists())
+
+        ranked = TrendingList.objects.get(key=trending.GLOBAL).entries
+        # Worth more than the three older downloads
+        trending.record(quiet.pk, 'download', now + timedelta(days=7))
+        self.assertEqual(TrendingList.objects.get(key=trending.GLOBAL).entries, ranked)
+        trending.refresh()
+        self.assertEqual(trending.top(trending.GLOBAL, 10), [quiet.pk, busy.pk])
+
+
+
+@isolated
+class DownloadPairsTests(TestCase):
+    def test_pairs_are_distinct_and_sorted_across_fetch_chunks(self):
+        uploader = User.objects.create_user('uploader', password='x')
+        subject = make_subject()
+        notes = [make_note(uploader, subject) for _ in range(3)]
+        readers = [User.objects.create_user(f'reader{i}', password='x') for i in range(2)]
+        for reader in reversed(readers):
+            for note in notes:
+                Download.objects.create(note=note, user=reader)
+        Download.objects.create(note=notes[0], user=readers[0])
+        make_note(uploader, subject, status='pending').downloads.create(user=readers[0])
+
+        with mock.patch.object(recommendations, 'FETCH_ROWS', 4):
+            users, items = recommendations.download_pairs(Download.objects.latest('pk').pk)
+        self.assertEqual(users.dtype, 'int64')
+        self.assertEqual(
+            sorted(zip(users.tolist(), items.tolist())),
+            [(reader.pk, note.pk) for reader in readers for note in notes],
+        )
+        self.assertEqual(users.tolist(), sorted(users.tolist()))
+
+
+@isolated
+class SimilarityIndexTests(TransactionTestCase):
+    def setUp(self):
+        self.enterContext(override_settings(SIMILARITY_INDEX_DIR=tempfile.mkdtemp()))
+        uploader = User.objects.create_user('uploader', password='x')
+        self.subject = make_subject()
+        self.entropy = make_note(uploader, self.subject, title='Entropy and heat', tags='thermodynamics')
+        self.engines = make_note(uploader, self.subject, title='Heat engines', tags='thermodynamics')
+        make_note(uploader, self.subject, title='Sonnets', tags='poetry', description='Shakespeare')
+        # The build's extraction pool closes connections, so no TestCase
+        similarity.build(workers=1)
+        self.index = similarity.index_path().read_bytes()
+        self.note = make_note(
+            uploader, self.subject, status='pending', title='Entropy in heat engines', tags='thermodynamics'
+        )
+
+    def similar(self, note):
+        return list(SimilarNote.objects.filter(note=note).order_by('rank').values_list('similar_id', flat=True))
+
+    def approve(self):
+        self.note.status = 'approved'
+        self.note.save()
+
+    def test_approved_note_gets_neighbours_and_joins_theirs(self):
+        self.approve()
+        self.assertEqual(set(self.similar(self.note)), {self.entropy.pk, self.engines.pk})
+        self.assertIn(self.note.pk, self.similar(self.entropy))
+        self.assertIn(self.note.pk, self.similar(self.engines))
+        # It went to the delta; the main index was not rewritten
+        self.assertEqual(similarity.index_path().read_bytes(), self.index)
+        self.assertEqual(similarity.search('entropy engines', 1)[0][0], self.note.pk)
+
+    @override_settings(SIMILARITY_DELTA_NOTES=1)
+    def test_full_delta_is_merged_into_the_index(self):
+        self.approve()
+        index, delta = similarity.current_index()
+        self.assertEqual(len(delta.notes), 0)
+        self.assertIn(self.note.pk, index.notes.tolist())
+        self.assertEqual(similarity.search('entropy engines', 1)[0][0], self.note.pk)
+
+        # Re-adding a merged note replaces its vector instead of adding one
+        similarity.add_note(self.note.pk)
+        index, delta = similarity.current_index()
+        self.assertEqual(sorted(index.notes.tolist()), sorted(Note.objects.values_list('pk', flat=True)))
+        self.assertEqual(set(self.similar(self.note)), {self.entropy.pk, self.engines.pk})
+
+
+@isolated
+class NoteApiTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.uploader = User.objects.create_user('uploader', password='x')
+        self.subject = make_subject()
+        self.notes = [make_note(self.uploader, self.subject, title=f'Note {i}') for i in range(5)]
+        self.pending = make_note(self.uploader, self.subject, status='pending')
+        self.deleted = make_note(self.uploader, self.subject)
+        self.deleted.soft_delete()
+
+    def get(self, name, *args, **params):
+        return self.client.get(reverse(name, args=args), params)
+
+    def ids(self, response):
+        self.assertEqual(response.status_code, 200)
+        return [row['id'] for row in response.json()['data']]
+
+    def test_cursor_pages_are_stable_across_inserts(self):
+        first = self.get('api:notes', limit=2).json()
+        seen = [row['id'] for row in first['data']]
+        # Newer notes land before the cursor and never shift later pages
+        make_note(self.uploader, self.subject, title='Newer')
+        cursor = first['next']
+        while cursor:
+            body = self.get('api:notes', limit=2, cursor=cursor).json()
+            seen += [row['id'] for row in body['data']]
+            cursor = body['next']
+        self.assertEqual(seen, [note.pk for note in reversed(self.notes)])
+
+    def test_fields_and_ids_are_projected(self):
+        response = self.get('api:notes', fields='title,uploader,rating_count')
+        self.assertEqual(set(response.json()['data'][0]), {'id', 'title', 'uploader', 'rating_count'})
+        a, b, c = self.notes[:3]
+        wanted = [c.pk, a.pk, 999_999, self.pending.pk, self.deleted.pk, c.pk, b.pk]
+        response = self.get('api:notes', ids=','.join(map(str, wanted)), fields='title')
+        self.assertEqual(response.json()['data'], [
+            {'id': c.pk, 'title': c.title}, {'id': a.pk, 'title': a.title}, {'id': b.pk, 'title': b.title},
+        ])
+
+    def test_bad_parameters_are_rejected(self):
+        too_many = ','.join(map(str, range(settings.API_MAX_PAGE_SIZE + 1)))
+        for params in (
+            {'cursor': '!!'}, {'cursor': 'bm90LWEtbnVtYmVy'}, {'fields': 'title,password'}, {'limit': '0'},
+            {'limit': str(settings.API_MAX_PAGE_SIZE + 1)}, {'limit': 'ten'}, {'ids': '1,x'}, {'ids': too_many},
+            {'subject': 'CS101'},
+        ):
+            with self.subTest(params):
+                response = self.get('api:notes', **params)
+                self.assertEqual(response.status_code, 400)
+                self.assertIn('error', response.json())
+
+    def test_unlisted_notes_never_appear(self):
+        hidden = {self.pending.pk, self.deleted.pk}
+        self.assertFalse(hidden & set(self.ids(self.get('api:notes', limit=50))))
+        self.assertFalse(hidden & set(self.ids(self.get('api:notes', subject=self.subject.pk))))
+        for note in (self.pending, self.deleted):
+            for name in ('api:note', 'api:note_ratings'):
+                with self.subTest(name, status=note.status):
+                    self.assertEqual(self.get(name, note.pk).status_code, 404)
+
+
+
+@isolated
+class PercolatorTests(TestCase):
+    def setUp(self):
+        self.uploader = User.objects.create_user('uploader', password='x')
+        self.subject, self.other = make_subject(), make_subject('CS102')
+        self.searches = {}
+        for name, query, facets in (
+            ('words', 'Entropy thermodynamics', {'subject': self.subject}),
+            ('course', '', {'course': self.subject.course}),
+            ('missing_word', 'thermodynamics poetry', {}),
+            ('other_subject', 'entropy', {'subject': self.other}),
+            ('uploader', 'entropy', {}),
+        ):
+            user = self.uploader if name == 'uploader' else User.objects.create_user(name)
+            self.searches[name] = percolator.save_search(user, query, **facets)
+        # A second match for the same user still makes one notification
+        percolator.save_search(self.searches['words'].user, 'heat')
+        for i in range(20):
+            percolator.save_search(User.objects.create_user(f'unrelated{i}'), f'topic{i} lectures')
+
+    def notified(self):
+        return set(Notification.objects.values_list('user__username', 'search_id'))
+
+    def test_newly_listed_note_notifies_matching_searches_only(self):
+        note = make_note(
+            self.uploader, self.subject, status='pending', title='Entropy and heat', tags='thermodynamics, exam',
+        )
+        self.assertEqual(self.notified(), set())
+        note.status = 'approved'
+        with self.captureOnCommitCallbacks(execute=True):
+            note.save()
+        self.assertEqual({user for user, _ in self.notified()}, {'words', 'course'})
+        self.assertIn(('course', self.searches['course'].pk), self.notified())
+
+    def test_matching_reads_the_reverse_index_once(self):
+        note = make_note(self.uploader, self.subject, title='Entropy and heat', tags='thermodynamics')
+        # The note, the grouped key lookup and the insert, however many
+        # searches are stored
+        with self.assertNumQueries(3):
+            self.assertEqual(percolator.percolate(note.pk), 2)
+
+    def test_repercolating_creates_no_duplicates(self):
+        note = make_note(self.uploader, self.subject, title='Entropy and heat', tags='thermodynamics')
+        percolator.percolate(note.pk)
+        before = self.notified()
+        percolator.percolate(note.pk)
+        self.assertEqual(self.notified(), before)
+        self.assertEqual(Notification.objects.filter(note=note).count(), 2)
+
+
+
+@isolated
+class PurgeTests(TestCase):
+    def setUp(self):
+        self.uploader = User.objects.create_user('uploader', password='x')
+        self.readers = [User.objects.create_user(f'reader{i}') for i in range(5)]
+        self.moderator = User.objects.create_user('moderator', role='moderator')
+        self.note = make_note(self.uploader, make_subject())
+        self.note.file.save('doomed.pdf', ContentFile(b'%PDF-1.4 notes'))
+        for reader in self.readers:
+            rating = Rating.objects.create(note=self.note, user=reader, rating=3, review='Fine')
+            for marker in self.readers[:3]:
+                RatingHelpful.objects.create(rating=rating, user=marker)
+            Download.objects.create(note=self.note, user=reader)
+        report = Report.objects.create(note=self.note, reported_by=self.readers[0], reason='spam', description='Spam')
+        self.action = ModerationAction.objects.create(
+            moderator=self.moderator, action_type='remove', note=self.note, report=report, reason='Spam',
+        )
+        self.note.soft_delete()
+
+    def test_purge_removes_everything_but_the_moderation_record(self):
+        name = self.note.file.name
+        with override_settings(NOTE_PURGE_BATCH_SIZE=2), self.captureOnCommitCallbacks(execute=True):
+            self.assertTrue(purge.purge(self.note.pk))
+        self.assertFalse(Note.objects.filter(pk=self.note.pk).exists())
+        for model in (Download, Rating, RatingHelpful, Report):
+            self.assertFalse(model.objects.exists(), model.__name__)
+        self.action.refresh_from_db()
+        self.assertIsNone(self.action.note_id)
+        self.assertFalse(default_storage.exists(name))
+
+    def test_rating_batches_take_a_fixed_number_of_queries(self):
+        Download.objects.all().delete()
+        RatingHelpful.objects.all().delete()
+        # The note's status, the (empty) earlier tables, the batch's ids and
+        # one DELETE in a savepoint; no row loads or rating_version UPDATEs
+        with self.assertNumQueries(7):
+            self.assertTrue(purge.purge_batch(self.note.pk))
+        self.assertFalse(Rating.objects.exists())
+
+
+
+
+class AdminSearchTests(TestCase):
+    def setUp(self):
+        self.uploader = User.objects.create_user('uploader')
+        self.reader = User.objects.create_user('reader')
+        self.note = make_note(self.uploader, make_subject(), title='Graph theory')
+
+    def search(self, model, term):
+        queryset, _ = site._registry[model].get_search_results(None, model.objects.all(), term)
+        return list(queryset)
+
+    def test_reviews_and_report_descriptions_stay_searchable(self):
+        rating = Rating.objects.create(note=self.note, user=self.reader, rating=2, review='Blurry scans')
+        report = Report.objects.create(
+            note=self.note, reported_by=self.reader, reason='other', description='Pages missing',
+        )
+        self.assertEqual(self.search(Rating, 'blurry'), [rating])
+        self.assertEqual(self.search(Rating, 'graph'), [rating])
+        self.assertEqual(self.search(Report, 'missing'), [report])
+        self.assertEqual(self.search(Report, 'reader'), [report])
+        self.assertEqual(self.search(Report, 'blurry'), [])
+
+
+@isolated
+class NotificationTests(TestCase):
+    def setUp(self):
+        self.uploader = User.objects.create_user('uploader', email='uploader@example.com')
+        self.subject = make_subject()
+
+    def notify(self, users, note):
+        Notification.objects.bulk_create([Notification(user=user, note=note) for user in users])
+
+    def test_follow_is_idempotent_and_capped(self):
+        user = User.objects.create_user('reader')
+        first = notifications.follow(user, subject=self.subject)
+        self.assertEqual(notifications.follow(user, subject=self.subject), first)
+        with override_settings(SUBSCRIPTIONS_PER_USER=2):
+            notifications.follow(user, course=self.subject.course)
+            with self.assertRaises(ValueError):
+                notifications.follow(user, subject=make_subject('CS102'))
+
+    @override_settings(NOTIFICATION_FANOUT_CHUNK=2)
+    def test_fan_out_pages_through_subject_then_course_followers(self):
+        note = make_note(self.uploader, self.subject)
+        subject_followers = [User.objects.create_user(f'subject{i}') for i in range(3)]
+        course_followers = [User.objects.create_user(f'course{i}') for i in range(2)]
+        for user in subject_followers + [self.uploader]:
+            notifications.follow(user, subject=self.subject)
+        for user in course_followers + subject_followers[:1]:
+            notifications.follow(user, course=self.subject.course)
+
+        pages = []
+        following = ('subject', 0)
+        while following is not None:
+            pages.append(following[0])
+            following = notifications.notify_followers(note.pk, *following)
+        self.assertEqual(pages, ['subject', 'subject', 'subject', 'course', 'course'])
+        # Everyone once, the uploader never
+        self.assertEqual(
+            sorted(Notification.objects.values_list('user__username', flat=True)),
+            sorted(user.username for user in subject_followers + course_followers),
+        )
+
+    @override_settings(NOTIFICATION_DIGEST_BATCH=2)
+    def test_digests_claim_rows_and_share_a_connection_per_batch(self):
+        readers = [User.objects.create_user(f'reader{i}', email=f'reader{i}@example.com') for i in range(4)]
+        silent = User.objects.create_user('silent')
+        notes = [make_note(self.uploader, self.subject, title=f'Note {i}') for i in range(2)]
+        for note in notes:
+            self.notify(readers + [silent], note)
+        connections = []
+
+        def connection(*args, **kwargs):
+            connections.append(get_connection(*args, **kwargs))
+            return connections[-1]
+
+        with mock.patch.object(notifications, 'get_connection', connection):
+            self.assertEqual(notifications.send_digests(), 4)
+        # Three batches, but the last only holds a user without an address
+        self.assertEqual(len(connections), 2)
+        self.assertEqual(sorted(message.to[0] for message in mail.outbox), [user.email for user in readers])
+        self.assertFalse(Notification.objects.filter(emailed_at=None).exists())
+        # Claimed rows are never mailed again
+        self.assertEqual(notifications.send_digests(), 0)
+        self.assertEqual(len(mail.outbox), 4)
+
+    def test_failed_batch_is_released(self):
+        reader = User.objects.create_user('reader', email='reader@example.com')
+        self.notify([reader], make_note(self.uploader, self.subject))
+        with mock.patch('django.core.mail.backends.locmem.EmailBackend.send_messages', side_effect=OSError):
+            with self.assertRaises(OSError):
+                notifications.send_digests()
+        self.assertTrue(Notification.objects.filter(emailed_at=None).exists())
+        self.assertEqual(notifications.send_digests(), 1)
+        self.assertEqual(len(mail.outbox), 1)
+
+    def test_eager_tasks_send_digests_right_away(self):
+        notifications.follow(User.objects.create_user('reader', email='reader@example.com'), subject=self.subject)
+        note = make_note(self.uploader, self.subject, status='pending', title='Fresh notes')
+        note.status = 'approved'
+        with override_settings(TASKS_EAGER=True, NOTIFICATION_DIGEST_DELAY=0):
+            with self.captureOnCommitCallbacks(execute=True):
+                note.save()
+        self.assertEqual([message.to for message in mail.outbox], [['reader@example.com']])
+
+
+@isolated
+class ImportListingTests(TransactionTestCase):
+    def test_approved_imports_reach_followers_and_saved_searches(self):
+        User.objects.create_user('uploader', password='x')
+        subject = make_subject()
+        notifications.follow(User.objects.create_user('follower', password='x'), subject=subject)
+        percolator.save_search(User.objects.create_user('searcher', password='x'), 'thermodynamics')
+        root = Path(tempfile.mkdtemp())
+        folder = root / subject.course.code / str(subject.semester.number) / subject.code
+        folder.mkdir(parents=True)
+        (folder / 'thermodynamics_notes.pdf').write_bytes(b'%PDF-1.4 first law')
+
+        # The command closes connections for its process pool, so no TestCase
+        call_command(
+            'import_notes', str(root), uploader='uploader', approve=True, workers=1,
+            state=str(root / 'state.json'), stdout=StringIO(),
+        )
+        note = Note.objects.get()
+        self.assertEqual(
+            set(Notification.objects.filter(note=note).values_list('user__username', flat=True)),
+            {'follower', 'searcher'},
+        )
+
+    def test_files_of_deleted_notes_are_not_duplicates(self):
+        uploader = User.objects.create_user('uploader', password='x')
+        subject = make_subject()
+        content = b'%PDF-1.4 second law'
+        make_note(uploader, subject, status='deleted', content_hash=hashlib.sha256(content).hexdigest())
+        root = Path(tempfile.mkdtemp())
+        folder = root / subject.course.code / str(subject.semester.number) / subject.code
+        folder.mkdir(parents=True)
+        (folder / 'entropy.pdf').write_bytes(content)
+
+        call_command(
+            'import_notes', str(root), uploader='uploader', approve=True, workers=1,
+            state=str(root / 'state.json'), stdout=StringIO(),
+        )
+        self.assertEqual(Note.objects.filter(status='approved').get().title, 'Entropy')
+
+
+@isolated
+class NoteCardCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_cards_follow_subject_renames(self):
+        subject = make_subject()
+        make_note(User.objects.create_user('uploader', password='x'), subject)
+        self.assertContains(self.client.get(reverse('notes:list')), 'Subject CS101')
+        subject.name = 'Algorithms'
+        subject.save()
+        response = self.client.get(reverse('notes:list'))
+        self.assertContains(response, 'Algorithms')
+        self.assertNotContains(response, 'Subject CS101')
+
+
+class Interrupted(Exception):
+    pass
+
+
+@isolated
+class RetentionRecoveryTests(TestCase):
+    """
+    A run of apply_retention killed part-way leaves files and rows behind;
+    the next run must finish the job without losing or double counting rows
+    """
+
+    def setUp(self):
+        self.enterContext(override_settings(RETENTION_ARCHIVE_DIR=tempfile.mkdtemp()))
+        self.policy = retention.policies()['downloads']
+        today = timezone.localdate()
+        # Mid-month, so the last chunk ends inside its month
+        self.cutoff = (today.replace(day=1) - timedelta(days=400)).replace(day=20)
+        self.enterContext(mock.patch.object(self.policy, 'keep_days', (today - self.cutoff).days))
+        previous_month = (self.cutoff.replace(day=1) - timedelta(days=1)).replace(day=5)
+
+        uploader = User.objects.create_user('uploader', password='x')
+        reader = User.objects.create_user('reader', password='x')
+        self.note = make_note(uploader, make_subject())
+        days = [previous_month] * 3 + [self.cutoff.replace(day=10)] * 2 + [self.cutoff - timedelta(days=1)]
+        self.old = [
+            Download.objects.create(
+                note=self.note, user=uploader if i == 0 else reader,
+                downloaded_at=retention.day_start(day) + timedelta(hours=12, minutes=i),
+            ).pk
+            for i, day in enumerate(days)
+        ]
+        self.kept = Download.objects.create(note=self.note, user=reader).pk
+
+    def interrupt(self, name, calls):
+        """
+        Make the nth call of retention.<name> raise, the earlier ones run
+        """
+        original = getattr(retention, name)
+        seen = []
+
+        def wrapper(*args, **kwargs):
+            seen.append(args)
+            if len(seen) == calls:
+                raise Interrupted
+            return original(*args, **kwargs)
+
+        return mock.patch.object(retention, name, wrapper)
+
+    def assertRecovered(self):
+        self.assertEqual(list(Download.objects.values_list('pk', flat=True)), [self.kept])
+        self.assertEqual(sorted(row['id'] for row in retention.read_archive(self.policy)), self.old)
+        self.assertEqual(self.policy.watermark(), self.cutoff)
+        stats = NoteDailyStats.objects.filter(note=self.note, day__lt=self.cutoff)
+        self.assertEqual(
+            sorted(stats.values_list('day', 'downloads', 'downloaders')),
+            [
+                ((self.cutoff.replace(day=1) - timedelta(days=1)).replace(day=5), 3, 2),
+                (self.cutoff.replace(day=10), 2, 1),
+                (self.cutoff - timedelta(days=1), 1, 1),
+            ],
+        )
+        self.assertEqual(
+            sum(SubjectDailyStats.objects.filter(day__lt=self.cutoff).values_list('downloads', flat=True)),
+            len(self.old),
+        )
+
+    def test_rerun_after_archive_before_watermark(self):
+        # A day earlier, the second chunk ends before the last old row
+        with mock.patch.object(self.policy, 'keep_days', self.policy.keep_days + 1):
+            with self.interrupt('write_atomically', 2), self.assertRaises(Interrupted):
+                retention.apply(self.policy)
+        self.assertEqual(self.policy.watermark(), self.cutoff.replace(day=1))
+        month = self.policy.directory / self.cutoff.strftime('%Y-%m')
+        self.assertEqual(len(list(month.glob('*.ndjson.gz'))), 1)
+
+        stats = retention.apply(self.policy)
+        self.assertEqual(stats, {'archived': 3, 'deleted': 3})
+        # The stopped run's file started before the oldest row left; it is
+        # replaced, not read alongside the new one
+        self.assertEqual([path.name for path in month.glob('*.ndjson.gz')], [
+            f'{self.cutoff.replace(day=10)}_{self.cutoff - timedelta(days=1)}.ndjson.gz',
+        ])
+        self.assertRecovered()
+
+    def test_rerun_after_watermark_mid_delete(self):
+        with self.interrupt('delete_before', 2), self.assertRaises(Interrupted):
+            retention.apply(self.policy, batch_size=1)
+        # The second chunk is archived and marked, but its rows are still here
+        self.assertEqual(self.policy.watermark(), self.cutoff)
+        self.assertEqual(Download.objects.count(), 4)
+
+        stats = retention.apply(self.policy, batch_size=1)
+        self.assertEqual(stats, {'archived': 0, 'deleted': 3})
+        self.assertRecovered()
+        self.assertEqual(retention.apply(self.policy), {'archived': 0, 'deleted': 0})
+
+
+@isolated
+@override_settings(TASKS_EAGER=False, VIEW_COUNT_FLUSH_INTERVAL=0)
+class QueryBudgetTests(QueryBudgetTestCase):
+    """
+    Every URL in QUERY_BUDGETS, for every role, against enough rows that a
+    per-row query shows up. Tasks are queued as in production (one INSERT),
+    and every view is taken to flush the buffered view counts.
+    """
+    roles = (None, 'student', 'moderator', 'admin')
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = {role: User.objects.create_user(role, password='x', role=role) for role in cls.roles[1:]}
+        readers = [User.objects.create_user(f'reader{i}', password='x') for i in range(4)]
+        subjects = [make_subject(f'CS10{i}') for i in range(3)]
+        notes = []
+        for i in range(12):
+            uploader = cls.users['student'] if i % 2 else readers[0]
+            note = make_note(uploader, subjects[i % 3], title=f'Note {i}', tags='exam, summary')
+            note.file.save(f'note{i}.pdf', ContentFile(b'%PDF-1.4 notes'))
+            for reader in readers[:3]:
+                Rating.objects.create(note=note, user=reader, rating=4, review='Useful')
+                Download.objects.create(note=note, user=reader)
+            notes.append(note)
+        for i in range(4):
+            pending = make_note(readers[3], subjects[i % 3], status='pending', title=f'Pending {i}')
+            report = Report.objects.create(note=notes[i], reported_by=readers[3], reason='spam', description='Spam')
+            ModerationAction.objects.create(
+                moderator=cls.users['moderator'], action_type='approve', note=pending, report=report,
+                target_user=readers[3], reason='Fine',
+            )
+        recommendations.build(full=True)
+        trending.rebuild()
+        cls.note, cls.subject = notes[0], subjects[0]
+
+    def urls(self):
+        note, subject = [self.note.pk], [self.subject.pk]
+        course, semester = self.subject.course_id, self.subject.semester_id
+        return [
+            ('core:home', [], ''), ('core:dashboard', [], ''),
+            ('notes:list', [], ''), ('notes:list', [], '?query=notes'), ('notes:list', [], f'?course={course}'),
+            ('notes:list', [], f'?semester={semester}'), ('notes:list', [], f'?subject={self.subject.pk}'),
+            ('notes:list', [], f'?query=notes&course={course}&semester={semester}&subject={self.subject.pk}'),
+            ('notes:detail', note, ''),
+            ('notes:download', note, ''), ('notes:taxonomy', [], ''), ('notes:my_notes', [], ''),
+            ('notes:upload', [], ''), ('notes:moderation_dashboard', [], ''),
+            ('api:notes', [], ''), ('api:note', note, ''), ('api:note_ratings', note, ''),
+            ('api:subjects', [], ''), ('api:note_stats', note, ''), ('api:subject_stats', subject, ''),
+            ('api:my_stats', [], ''), ('api:trending', [], ''), ('api:similar_notes', note, ''),
+            ('api:similar', [], '?q=notes'),
+            ('moderation:dashboard', [], ''), ('moderation:pending_notes', [], ''),
+            ('moderation:pending_reports', [], ''), ('moderation:history', [], ''),
+        ]
+
+    def test_every_budget_is_exercised(self):
+        self.assertEqual({name for name, *_ in self.urls()}, set(settings.QUERY_BUDGETS))
+
+    def test_views_stay_within_budget(self):
+        for role in self.roles:
+            self.client.logout()
+            if role:
+                self.client.force_login(self.users[role])
+            for name, args, query in self.urls():
+                with self.subTest(role=role, url=name + query):
+                    # Cold caches: the worst case
+                    cache.clear()
+                    with self.assertQueryBudget(name):
+                        response = self.client.get(reverse(name, args=args) + query)
+                    self.assertLess(response.status_code, 500)
+                    self.assertNoNPlusOne(response)
+
+
+
+@isolated
+class DownloadHeaderTests(TestCase):
+    def test_download_is_named_after_the_file_not_its_path(self):
+        user = User.objects.create_user('reader', password='x')
+        note = make_note(user, make_subject())
+        note.file.save('lecture.pdf', ContentFile(b'%PDF-1.4 notes'))
+        self.client.force_login(user)
+        response = self.client.get(reverse('notes:download', args=[note.pk]))
+        response.close()
+        # The same header note_download_async builds
+        self.assertEqual(response['Content-Disposition'], content_disposition_header(True, 'lecture.pdf'))
@@ -0,0 +1,279 @@
+"""
+Trending notes: popularity that fades with time.
+
+Every download, view and rating adds its TRENDING_WEIGHTS weight to the
+note's score, and weights halve every TRENDING_HALF_LIFE_DAYS. Rather than
+decaying every score as time passes, an event at time t adds
+``w * e^(rate * (t - EPOCH))``: all scores shrink by the same factor at
+any moment, so newer events simply count for more and the ranking never
+has to be recomputed. ``Note.trend_score`` holds the log of that sum, which
+grows by ln 2 per half-life and never overflows; it is updated in one SQL
+UPDATE, so concurrent events are never lost.
+
+The site and each course, semester and subject keep their best
+TRENDING_HEAP_SIZE notes in a TrendingList row as a min-heap, and reading
+a ranking is one primary-key lookup. Events leave the heaps alone and only
+flag the note as changed. As scores keep growing, nearly every event would
+otherwise rewrite its facets' rows, the site-wide one included, and all
+events would queue on that row. ``refresh`` (the refresh_trending task,
+queued TRENDING_REFRESH_INTERVAL after an event) folds every flagged note
+into its heaps at once, rewriting each heap row at most once. Notes that
+stop being listed are dropped from the heaps, which leaves gaps a lower
+note may never fill, so rankings are served from the top of the heap only;
+``rebuild_trending`` recomputes everything from the daily rollups.
+"""
+import heapq
+import math
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, F, FloatField, Value, When
+from django.db.models.functions import Abs, Exp, Greatest, Ln
+from django.utils import timezone
+
+from core.retention import day_start
+
+from .models import Note, NoteDailyStats, Rating, TrendingList
+
+EPOCH = datetime(2024, 1, 1, tzinfo=dt_timezone.utc)
+GLOBAL = 'all'
+
+
+def rate():
+    """
+    Decay per second
+    """
+    return math.log(2) / (settings.TRENDING_HALF_LIFE_DAYS * 24 * 60 * 60)
+
+
+def log_weight(weight, at):
+    return math.log(weight) + rate() * (at - EPOCH).total_seconds()
+
+
+def facet_keys(course_id, semester_id, subject_id):
+    return [GLOBAL, f'course:{course_id}', f'semester:{semester_id}', f'subject:{subject_id}']
+
+
+def facet_key(course=None, semester=None, subject=None):
+    """
+    The most specific ranking for a catalog filter
+    """
+    for name, value in (('subject', subject), ('semester', semester), ('course', course)):
+        if value is not None:
+            return f'{name}:{value}'
+    return GLOBAL
+
+
+def log_add(value):
+    """
+    trend_score = log(e^trend_score + e^value), computed without overflow
+    """
+    value = Value(value, output_field=FloatField())
+    return Case(
+        When(trend_score__isnull=True, then=value),
+        default=Greatest(F('trend_score'), value) + Ln(Value(1.0) + Exp(-Abs(F('trend_score') - value))),
+        output_field=FloatField(),
+    )
+
+
+def push(heap, note_id, score, size):
+    """
+    Put a note into a bounded min-heap of [score, note id]; returns
+    whether the heap changed
+    """
+    for entry in heap:
+        if entry[1] == note_id:
+            entry[0] = score
+            # Scores only grow, so the entry can only need to sink
+            heapq.heapify(heap)
+            return True
+    if len(heap) < size:
+        heapq.heappush(heap, [score, note_id])
+        return True
+    if score > heap[0][0]:
+        heapq.heapreplace(heap, [score, note_id])
+        return True
+    return False
+
+
+def locked_lists(keys, create=False):
+    lists = {row.key: row for row in TrendingList.objects.select_for_update().filter(key__in=keys)}
+    missing = [key for key in keys if key not in lists]
+    if create and missing:
+        # Created empty first so that concurrent writers merge into one row
+        TrendingList.objects.bulk_create([TrendingList(key=key) for key in missing], ignore_conflicts=True)
+        lists.update((row.key, row) for row in TrendingList.objects.select_for_update().filter(key__in=missing))
+    return lists
+
+
+def save_lists(rows):
+    now = timezone.now()
+    for row in rows:
+        row.updated_at = now
+    TrendingList.objects.bulk_update(rows, ['entries', 'updated_at'])
+
+
+def offer(note_id, score, keys):
+    size = settings.TRENDING_HEAP_SIZE
+    lists = locked_lists(keys, create=True)
+    changed = [row for row in lists.values() if push(row.entries, note_id, score, size)]
+    if changed:
+        save_lists(changed)
+
+
+def discard(note_id, keys):
+    lists = locked_lists(keys)
+    changed = []
+    for row in lists.values():
+        entries = [entry for entry in row.entries if entry[1] != note_id]
+        if len(entries) != len(row.entries):
+            heapq.heapify(entries)
+            row.entries = entries
+            changed.append(row)
+    if changed:
+        save_lists(changed)
+
+
+def record(note_id, event, at, weight=1.0):
+    """
+    Add an event to a note's score; the rankings take it in on the next
+    ``refresh``
+    """
+    score = log_weight(settings.TRENDING_WEIGHTS[event] * weight, at)
+    Note.objects.filter(pk=note_id).update(trend_score=log_add(score), trend_changed=True)
+
+
+def refresh():
+    """
+    Fold the scores changed since the last refresh into the rankings;
+    returns the number of listed notes taken in
+    """
+    size = settings.TRENDING_HEAP_SIZE
+    with transaction.atomic():
+        # A write first, so events wait rather than flag notes in between
+        TrendingList.objects.filter(key=GLOBAL).update(updated_at=timezone.now())
+        changed = Note.objects.filter(trend_changed=True)
+        rows = list(changed.filter(status='approved', trend_score__isnull=False).values_list(
+            'pk', 'trend_score', 'course_id', 'semester_id', 'subject_id'
+        ))
+        changed.update(trend_changed=False)
+        offers = {}
+        for note_id, score, *location in rows:
+            for key in facet_keys(*location):
+                offers.setdefault(key, []).append((note_id, score))
+        updated = []
+        for key, row in locked_lists(sorted(offers), create=True).items():
+            pushed = [push(row.entries, note_id, score, size) for note_id, score in offers[key]]
+            if any(pushed):
+                updated.append(row)
+        if updated:
+            save_lists(updated)
+    return len(rows)
+
+
+def relist(note_id, before, after):
+    """
+    Move a note between rankings when it is listed, unlisted or moved to
+    another course, semester or subject. ``before`` and ``after`` are its
+    (course, semester, subject) ids while listed, or None.
+    """
+    old = set(facet_keys(*before)) if before else set()
+    new = set(facet_keys(*after)) if after else set()
+    if old == new:
+        return
+    with transaction.atomic(savepoint=False):
+        if old - new:
+            discard(note_id, sorted(old - new))
+        if new - old:
+            score = Note.objects.filter(pk=note_id).values_list('trend_score', flat=True).first()
+            if score is not None:
+                offer(note_id, score, sorted(new - old))
+
+
+def top(key, limit):
+    """
+    Note ids of one ranking, best first
+    """
+    entries = TrendingList.objects.filter(key=key).values_list('entries', flat=True).first() or []
+    return [note_id for score, note_id in heapq.nlargest(limit, entries)]
+
+
+def listed(key, queryset):
+    """
+    The notes of queryset that are still listed under a ranking; a heap
+    may hold a note that has since moved
+    """
+    queryset = queryset.filter(status='approved')
+    if key != GLOBAL:
+        name, value = key.split(':')
+        queryset = queryset.filter(**{f'{name}_id': value})
+    return queryset
+
+
+def notes(key, limit, queryset=None):
+    """
+    The listed notes of one ranking, best first
+    """
+    ids = top(key, limit)
+    if not ids:
+        return []
+    queryset = queryset if queryset is not None else Note.objects.all()
+    by_id = {note.pk: note for note in listed(key, queryset.filter(pk__in=ids))}
+    return [by_id[pk] for pk in ids if pk in by_id]
+
+
+def rebuild(now=None):
+    """
+    Recompute every score and ranking from the daily rollups and ratings;
+    returns the number of notes with a score
+    """
+    now = now or timezone.now()
+    since = now - timedelta(days=settings.TRENDING_HALF_LIFE_DAYS * 20)
+    weights = settings.TRENDING_WEIGHTS
+
+    days = np.array(list(NoteDailyStats.objects.filter(day__gte=since.date()).values_list(
+        'note_id', 'day', 'downloads', 'views'
+    )), dtype=object).reshape(-1, 4)
+    ratings = np.array(list(Rating.objects.filter(created_at__gte=since).values_list(
+        'note_id', 'created_at', 'rating'
+    )), dtype=object).reshape(-1, 3)
+
+    # Each day's events are taken to happen at noon
+    noon = timedelta(hours=12)
+    note_ids = np.concatenate([days[:, 0], ratings[:, 0]]).astype(np.int64)
+    moments = np.array(
+        [(day_start(day) + noon - EPOCH).total_seconds() for day in days[:, 1]]
+        + [(moment - EPOCH).total_seconds() for moment in ratings[:, 1]],
+        dtype=np.float64,
+    )
+    amounts = np.concatenate([
+        days[:, 2].astype(np.float64) * weights['download'] + days[:, 3].astype(np.float64) * weights['view'],
+        ratings[:, 2].astype(np.float64) / 5 * weights['rating'],
+    ])
+    keep = amounts > 0
+    note_ids, moments, amounts = note_ids[keep], moments[keep], amounts[keep]
+    unique_ids, index = np.unique(note_ids, return_inverse=True)
+    scores = np.full(len(unique_ids), -np.inf)
+    np.logaddexp.at(scores, index, np.log(amounts) + rate() * moments)
+    scores = dict(zip(unique_ids.tolist(), scores.tolist()))
+
+    size = settings.TRENDING_HEAP_SIZE
+    heaps = {}
+    with transaction.atomic():
+        Note.objects.exclude(trend_score=None).update(trend_score=None, trend_changed=False)
+        Note.objects.bulk_update(
+            [Note(pk=pk, trend_score=score) for pk, score in scores.items()], ['trend_score'], batch_size=500
+        )
+        listed = Note.objects.filter(status='approved', trend_score__isnull=False).values_list(
+            'pk', 'course_id', 'semester_id', 'subject_id'
+        )
+        for pk, *location in listed.iterator():
+            for key in facet_keys(*location):
+                push(heaps.setdefault(key, []), pk, scores[pk], size)
+        TrendingList.objects.all().delete()
+        TrendingList.objects.bulk_create(
+            [TrendingList(key=key, entries=heap, updated_at=now) for key, heap in heaps.items()], batch_size=500
+        )
+    return len(scores)
@@ -1,16 +1,34 @@
+from django.conf import settings
 from django.urls import path
 from . import views
 
 app_name = 'notes'
 
+# Read-heavy views have async variants used when serving through ASGI
+if settings.ASYNC_VIEWS:
+    list_view = views.note_list_async
+    detail_view = views.note_detail_async
+    download_view = views.note_download_async
+    taxonomy_view = views.taxonomy_async
+else:
+    list_view = views.note_list_view
+    detail_view = views.note_detail_view
+    download_view = views.note_download_view
+    taxonomy_view = views.taxonomy_view
+
 urlpatterns = [
-    path('', views.note_list_view, name='list'),
+    path('', list_view, name='list'),
     path('upload/', views.note_upload_view, name='upload'),
     path('my-notes/', views.my_notes_view, name='my_notes'),
-    path('<int:pk>/', views.note_detail_view, name='detail'),
-    path('<int:pk>/download/', views.note_download_view, name='download'),
+    path('alerts/', views.alerts_view, name='alerts'),
+    path('searches/save/', views.save_search_view, name='save_search'),
+    path('searches/<int:pk>/delete/', views.delete_saved_search_view, name='delete_saved_search'),
+    path('follow/', views.follow_view, name='follow'),
+    path('follow/<int:pk>/delete/', views.unfollow_view, name='unfollow'),
+    path('<int:pk>/', detail_view, name='detail'),
+    path('<int:pk>/download/', download_view, name='download'),
     path('<int:pk>/delete/', views.note_delete_view, name='delete'),
-    path('ajax/load-subjects/', views.load_subjects, name='ajax_load_subjects'),
+    path('taxonomy.json', taxonomy_view, name='taxonomy'),
     path('<int:pk>/rate/', views.rate_note_view, name='rate'),
     path('rating/<int:pk>/delete/', views.delete_rating_view, name='delete_rating'),
     path('<int:pk>/report/', views.report_note_view, name='report'),
@@ -1,15 +1,81 @@
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
-from django.db.models import Q, Count, Avg
-from django.http import FileResponse, Http404
+from django.db.models import Q, Count, Avg, Subquery
+from django.http import FileResponse, Http404, HttpResponse
 from django.utils import timezone
-from .models import Note, Course, Semester, Subject, Download
+from .models import Note, Course, Semester, Subject, Download, SavedSearch, Subscription
 from .forms import NoteUploadForm, NoteSearchForm
+from .tasks import purge_note, record_download, record_rating, record_views
 from .models import Rating, Report
 from .forms import RatingForm, ReportForm
 from django.db.models import Avg, Count
+import hashlib
+import os
+from django.conf import settings
+from django.contrib.messages.storage.cookie import CookieStorage
+from django.utils.cache import get_conditional_response, patch_cache_control
+from core import versions
+from core.models import Version
+from core.conditional import conditional_page, is_anonymous
+from core.pagecache import cache_anonymous_page
+from .signals import ALL_NOTES, CATALOG, FILTERS, TAXONOMY
+from . import notifications, percolator, taxonomy, viewcounts
+from .recommendations import RECOMMENDATIONS, related_notes
+
+
+def catalog_validators(request):
+    """
+    The catalog only changes when notes are approved, rejected or deleted,
+    or the course/semester/subject lists change
+    """
+    # A pending flash message is part of the page
+    if CookieStorage.cookie_name in request.COOKIES:
+        return None
+    version, updated_at = versions.current(CATALOG)
+    if is_anonymous(request):
+        return f'W/"catalog-{version}-{settings.FRAGMENT_CACHE_VERSION}"', updated_at
+    # Signed-in pages carry the user's navbar; scope the tag to the session
+    # and leave out Last-Modified, which cannot tell sessions apart
+    session = hashlib.blake2b(request.COOKIES[settings.SESSION_COOKIE_NAME].encode(), digest_size=8).hexdigest()
+    return f'W/"catalog-{version}-{settings.FRAGMENT_CACHE_VERSION}-{session}"', None
+
+
+def catalog_tags(request):
+    """
+    Page cache dependencies: a filtered page only lists notes from its
+    course/semester/subject, anything else can list any note
+    """
+    tags = [FILTERS]
+    facets = [f'{name}:{request.GET[name]}' for name in ('course', 'semester', 'subject')
+              if request.GET.get(name, '').isdigit()]
+    return tags + (facets or [ALL_NOTES])
+
 
+def detail_validators(request, pk):
+    """
+    A note page changes with the note itself, its ratings or its related
+    notes. Signed-in users also see their own rating and download state,
+    which these do not cover, so only anonymous requests are validated.
+    Ratings do not touch updated_at, so there is no Last-Modified either.
+    """
+    if not is_anonymous(request):
+        return None
+    related_version = Version.objects.filter(name=RECOMMENDATIONS).values('value')
+    row = Note.objects.filter(pk=pk, status='approved').annotate(
+        related_version=Subquery(related_version),
+    ).values_list('updated_at', 'rating_version', 'related_version').first()
+    if row is None:
+        return None
+    updated_at, rating_version, related_version = row
+    return (
+        f'W/"note-{pk}-{updated_at.timestamp():.6f}-{rating_version}-{related_version or 0}-'
+        f'{settings.FRAGMENT_CACHE_VERSION}"'
+    ), None
+
+
+@conditional_page(catalog_validators)
+@cache_anonymous_page(catalog_tags)
 def note_list_view(request):
     """
     Display all approved notes with search and filter
@@ -41,7 +107,9 @@ def note_list_view(request):
     context = {
         'notes': notes,
         'form': form,
-        'total_notes': notes.count()
+        'total_notes': notes.count(),
+        # Cards show course, semester and subject names
+        'taxonomy_version': versions.current(TAXONOMY)[0],
     }
     return render(request, 'notes/note_list.html', context)
 
@@ -49,25 +117,24 @@ from django.shortcuts import render, get_object_or_404
 from django.db.models import Avg, Count
 from .models import Note, Rating, Download
 
+@conditional_page(detail_validators)
 def note_detail_view(request, pk):
     """
     Display note details with ratings
     """
-    note = get_object_or_404(Note, pk=pk, status='approved')
+    note = get_object_or_404(
+        Note.objects.select_related('course', 'semester', 'subject', 'uploaded_by'),
+        pk=pk, status='approved',
+    )
+    views = viewcounts.add(note.pk, note.subject_id)
+    if views:
+        record_views.defer(views, timezone.now().isoformat())
     note.view_count += 1
-    note.save(update_fields=['view_count'])
 
-    # Ratings queryset
-    ratings = note.ratings.all().select_related('user')
-
-    # Aggregated rating data
-    rating_stats = ratings.aggregate(
-        average_rating=Avg('rating'),
-        rating_count=Count('id'),
-    )  # [web:66][web:65]
-
-    average_rating = rating_stats['average_rating'] or 0
-    rating_count = rating_stats['rating_count'] or 0
+    # One query for the ratings; the average and the user's own come from it
+    ratings = list(note.ratings.all().select_related('user'))
+    rating_count = len(ratings)
+    average_rating = sum(r.rating for r in ratings) / rating_count if rating_count else 0
 
     user_rating = None
     has_downloaded = False
@@ -76,10 +143,7 @@ def note_detail_view(request, pk):
         has_downloaded = Download.objects.filter(
             note=note, user=request.user
         ).exists()
-        try:
-            user_rating = Rating.objects.get(note=note, user=request.user)
-        except Rating.DoesNotExist:
-            user_rating = None
+        user_rating = next((r for r in ratings if r.user_id == request.user.pk), None)
 
     # Tags: split in view, not in template
     if note.tags:
@@ -95,6 +159,7 @@ def note_detail_view(request, pk):
         'average_rating': round(average_rating, 1),
         'rating_count': rating_count,
         'tag_list': tag_list,
+        'related_notes': related_notes(note),
     }
 
     return render(request, 'notes/note_detail.html', context)
@@ -126,20 +191,14 @@ def note_download_view(request, pk):
     """
     note = get_object_or_404(Note, pk=pk, status='approved')
     
-    # Track download
-    Download.objects.create(
-        note=note,
-        user=request.user,
-        ip_address=request.META.get('REMOTE_ADDR')
+    # Track download and increment the count off the request path
+    record_download.defer(
+        note.pk, request.user.pk, request.META.get('REMOTE_ADDR'), timezone.now().isoformat(), note.subject_id
     )
     
-    # Increment download count
-    note.download_count += 1
-    note.save(update_fields=['download_count'])
-    
     # Serve file
     try:
-        return FileResponse(note.file.open('rb'), as_attachment=True, filename=note.file.name)
+        return FileResponse(note.file.open('rb'), as_attachment=True, filename=os.path.basename(note.file.name))
     except FileNotFoundError:
         raise Http404("File not found")
 
@@ -149,16 +208,16 @@ def my_notes_view(request):
     """
     Display user's uploaded notes
     """
-    notes = Note.objects.filter(uploaded_by=request.user).select_related(
+    notes = Note.objects.filter(uploaded_by=request.user).exclude(status='deleted').select_related(
         'subject', 'course', 'semester'
     ).order_by('-created_at')
     
-    context = {
-        'notes': notes,
-        'pending_count': notes.filter(status='pending').count(),
-        'approved_count': notes.filter(status='approved').count(),
-        'rejected_count': notes.filter(status='rejected').count(),
-    }
+    counts = notes.aggregate(
+        pending_count=Count('id', filter=Q(status='pending')),
+        approved_count=Count('id', filter=Q(status='approved')),
+        rejected_count=Count('id', filter=Q(status='rejected')),
+    )
+    context = {'notes': notes, **counts}
     return render(request, 'notes/my_notes.html', context)
 
 
@@ -167,34 +226,124 @@ def note_delete_view(request, pk):
     """
     Delete own note
     """
-    note = get_object_or_404(Note, pk=pk, uploaded_by=request.user)
+    note = get_object_or_404(Note.objects.exclude(status='deleted'), pk=pk, uploaded_by=request.user)
     
     if request.method == 'POST':
-        note.delete()
+        # Hidden now; its downloads, ratings and file go in the background
+        note.soft_delete()
+        purge_note.defer(note.pk)
         messages.success(request, 'Note deleted successfully!')
         return redirect('notes:my_notes')
     
     return render(request, 'notes/note_confirm_delete.html', {'note': note})
 
 
-# AJAX view for dynamic subject loading
-from django.http import JsonResponse
-
-def load_subjects(request):
+@login_required
+def alerts_view(request):
     """
-    AJAX view to load subjects based on course and semester
+    The user's subscriptions and saved searches, and the latest notes
+    they brought
     """
-    course_id = request.GET.get('course_id')
-    semester_id = request.GET.get('semester_id')
-    
-    subjects = Subject.objects.filter(
-        course_id=course_id,
-        semester_id=semester_id
-    ).order_by('name')
-    
-    return JsonResponse({
-        'subjects': list(subjects.values('id', 'name', 'code'))
+    subscriptions = request.user.subscriptions.select_related('course', 'subject')
+    searches = request.user.saved_searches.select_related('course', 'semester', 'subject')
+    recent = request.user.notifications.filter(note__status='approved').select_related(
+        'note__subject', 'search', 'subscription__course', 'subscription__subject'
+    )[:30]
+    return render(request, 'notes/alerts.html', {
+        'subscriptions': subscriptions,
+        'searches': searches,
+        'notifications': recent,
     })
+
+
+@login_required
+def save_search_view(request):
+    """
+    Save the catalog search being shown
+    """
+    if request.method == 'POST':
+        form = NoteSearchForm(request.POST)
+        if form.is_valid():
+            try:
+                percolator.save_search(
+                    request.user,
+                    form.cleaned_data.get('query') or '',
+                    form.cleaned_data.get('course'),
+                    form.cleaned_data.get('semester'),
+                    form.cleaned_data.get('subject'),
+                )
+            except ValueError as error:
+                messages.error(request, str(error))
+            else:
+                messages.success(request, "Search saved! We'll let you know when new notes match it.")
+    return redirect('notes:alerts')
+
+
+@login_required
+def delete_saved_search_view(request, pk):
+    """
+    Stop following a saved search
+    """
+    search = get_object_or_404(SavedSearch, pk=pk, user=request.user)
+    if request.method == 'POST':
+        search.delete()
+        messages.success(request, 'Saved search removed.')
+    return redirect('notes:alerts')
+
+
+@login_required
+def follow_view(request):
+    """
+    Follow the course or subject posted
+    """
+    if request.method == 'POST':
+        subject = Subject.objects.filter(pk=request.POST.get('subject') or None).first()
+        course = Course.objects.filter(pk=request.POST.get('course') or None).first() if subject is None else None
+        if subject is None and course is None:
+            raise Http404
+        try:
+            notifications.follow(request.user, course=course, subject=subject)
+        except ValueError as error:
+            messages.error(request, str(error))
+        else:
+            messages.success(request, f"You're following {subject or course}. New notes will show up in your alerts.")
+    return redirect('notes:alerts')
+
+
+@login_required
+def unfollow_view(request, pk):
+    """
+    Stop following a course or subject
+    """
+    subscription = get_object_or_404(Subscription, pk=pk, user=request.user)
+    if request.method == 'POST':
+        subscription.delete()
+        messages.success(request, 'Unfollowed.')
+    return redirect('notes:alerts')
+
+
+def taxonomy_response(request, body, etag, updated_at):
+    """
+    The taxonomy document, or a 304 when the client already has it
+    """
+    last_modified = int(updated_at.timestamp()) if updated_at else None
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        response = HttpResponse(body, content_type='application/json')
+    response.headers['ETag'] = etag
+    # The same for everyone; clients revalidate with If-None-Match
+    patch_cache_control(response, public=True, max_age=0, s_maxage=settings.CONDITIONAL_SHARED_MAX_AGE)
+    return response
+
+
+def taxonomy_view(request):
+    """
+    Courses, semesters and subjects as one JSON document for client-side
+    dropdown filtering
+    """
+    return taxonomy_response(request, *taxonomy.document())
+
+
 @login_required
 def rate_note_view(request, pk):
     """
@@ -216,7 +365,10 @@ def rate_note_view(request, pk):
             rating = form.save(commit=False)
             rating.note = note
             rating.user = request.user
+            created = rating.pk is None
             rating.save()
+            if created:
+                record_rating.defer(note.pk, rating.rating, rating.created_at.isoformat())
             messages.success(request, message)
         else:
             messages.error(request, 'Please provide a valid rating.')
@@ -229,7 +381,7 @@ def report_note_view(request, pk):
     """
     Report a note
     """
-    note = get_object_or_404(Note, pk=pk)
+    note = get_object_or_404(Note.objects.exclude(status='deleted'), pk=pk)
     
     # Check if user already reported this note
     existing_report = Report.objects.filter(note=note, reported_by=request.user, status='pending').first()
@@ -296,13 +448,11 @@ def approve_note_view(request, pk):
     """
     Approve a pending note
     """
-    note = get_object_or_404(Note, pk=pk)
+    note = get_object_or_404(Note.objects.exclude(status='deleted'), pk=pk)
     
     if request.method == 'POST':
-        note.status = 'approved'
-        note.approved_by = request.user
-        note.approved_at = timezone.now()
-        note.save()
+        if not note.moderate('approved', approved_by=request.user, approved_at=timezone.now()):
+            raise Http404("Note not found")
         messages.success(request, f'Note "{note.title}" has been approved!')
         return redirect('notes:moderation_dashboard')
     
@@ -314,11 +464,11 @@ def reject_note_view(request, pk):
     """
     Reject a pending note
     """
-    note = get_object_or_404(Note, pk=pk)
+    note = get_object_or_404(Note.objects.exclude(status='deleted'), pk=pk)
     
     if request.method == 'POST':
-        note.status = 'rejected'
-        note.save()
+        if not note.moderate('rejected'):
+            raise Http404("Note not found")
         messages.warning(request, f'Note "{note.title}" has been rejected.')
         return redirect('notes:moderation_dashboard')
     
@@ -342,8 +492,8 @@ def review_report_view(request, pk):
         
         if action == 'resolve':
             report.status = 'resolved'
-            # Optionally reject the note
-            if request.POST.get('reject_note'):
+            # Optionally reject the note, unless it is deleted and being purged
+            if request.POST.get('reject_note') and report.note.status != 'deleted':
                 report.note.status = 'rejected'
                 report.note.save()
             messages.success(request, 'Report resolved successfully.')
@@ -354,4 +504,152 @@ def review_report_view(request, pk):
         report.save()
         return redirect('notes:moderation_dashboard')
     
-    return render(request, 'notes/review_report.html', {'report': report})
\ No newline at end of file
+    return render(request, 'notes/review_report.html', {'report': report})
+
+# ASYNC VIEWS
+# Served in place of the sync versions when ASYNC_VIEWS is on (the default
+# under noteghar/asgi.py). A slow client or search then waits on the event
+# loop instead of holding a worker thread.
+import mimetypes
+
+from asgiref.sync import sync_to_async
+from django.http import StreamingHttpResponse
+from django.shortcuts import aget_object_or_404
+from django.utils.http import content_disposition_header
+
+from core.db import serialized_write
+
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+
+@conditional_page(catalog_validators)
+@cache_anonymous_page(catalog_tags)
+async def note_list_async(request):
+    """
+    Async version of note_list_view
+    """
+    notes = Note.objects.filter(status='approved').select_related(
+        'subject', 'course', 'semester', 'uploaded_by'
+    )
+
+    form = NoteSearchForm(request.GET)
+
+    query = request.GET.get('query')
+    if query:
+        notes = notes.filter(
+            Q(title__icontains=query) |
+            Q(description__icontains=query) |
+            Q(tags__icontains=query)
+        )
+
+    # ModelChoiceField validation queries the database synchronously
+    if await sync_to_async(form.is_valid)():
+        if form.cleaned_data.get('course'):
+            notes = notes.filter(course=form.cleaned_data['course'])
+        if form.cleaned_data.get('semester'):
+            notes = notes.filter(semester=form.cleaned_data['semester'])
+        if form.cleaned_data.get('subject'):
+            notes = notes.filter(subject=form.cleaned_data['subject'])
+
+    note_list = [note async for note in notes]
+    context = {
+        'notes': note_list,
+        'form': form,
+        'total_notes': len(note_list),
+        'taxonomy_version': (await sync_to_async(versions.current)(TAXONOMY))[0],
+    }
+    # Form choices and context processors still use the sync ORM
+    return await sync_to_async(render)(request, 'notes/note_list.html', context)
+
+
+@conditional_page(detail_validators)
+async def note_detail_async(request, pk):
+    """
+    Async version of note_detail_view
+    """
+    note = await aget_object_or_404(
+        Note.objects.select_related('course', 'semester', 'subject', 'uploaded_by'),
+        pk=pk, status='approved',
+    )
+    views = viewcounts.add(note.pk, note.subject_id)
+    if views:
+        await serialized_write(record_views.defer)(views, timezone.now().isoformat())
+    note.view_count += 1
+
+    ratings = [r async for r in note.ratings.all().select_related('user')]
+    rating_count = len(ratings)
+    average_rating = sum(r.rating for r in ratings) / rating_count if rating_count else 0
+
+    user_rating = None
+    has_downloaded = False
+
+    user = await request.auser()
+    if user.is_authenticated:
+        has_downloaded = await Download.objects.filter(note=note, user=user).aexists()
+        user_rating = next((r for r in ratings if r.user_id == user.pk), None)
+
+    if note.tags:
+        tag_list = [tag.strip() for tag in note.tags.split(',')]
+    else:
+        tag_list = []
+
+    context = {
+        'note': note,
+        'ratings': ratings,
+        'user_rating': user_rating,
+        'has_downloaded': has_downloaded,
+        'average_rating': round(average_rating, 1),
+        'rating_count': rating_count,
+        'tag_list': tag_list,
+        'related_notes': await sync_to_async(related_notes)(note),
+    }
+    return await sync_to_async(render)(request, 'notes/note_detail.html', context)
+
+
+async def taxonomy_async(request):
+    """
+    Async version of taxonomy_view
+    """
+    return taxonomy_response(request, *await sync_to_async(taxonomy.document)())
+
+
+async def _stream_file(field_file):
+    """
+    Read a stored file in chunks off the event loop
+    """
+    read = sync_to_async(field_file.read, thread_sensitive=False)
+    try:
+        while True:
+            chunk = await read(DOWNLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            yield chunk
+    finally:
+        await sync_to_async(field_file.close, thread_sensitive=False)()
+
+
+@login_required
+async def note_download_async(request, pk):
+    """
+    Async version of note_download_view, streaming the file
+    """
+    note = await aget_object_or_404(Note, pk=pk, status='approved')
+    user = await request.auser()
+
+    await serialized_write(record_download.defer)(
+        note.pk, user.pk, request.META.get('REMOTE_ADDR'), timezone.now().isoformat(), note.subject_id
+    )
+
+    try:
+        await sync_to_async(note.file.open, thread_sensitive=False)('rb')
+    except FileNotFoundError:
+        raise Http404("File not found")
+
+    content_type, encoding = mimetypes.guess_type(note.file.name)
+    response = StreamingHttpResponse(
+        _stream_file(note.file),
+        content_type=content_type or 'application/octet-stream',
+    )
+    response['Content-Length'] = note.file.size
+    response['Content-Disposition'] = content_disposition_header(True, os.path.basename(note.file.name))
+    return response